@@ -0,0 +1,7 @@
+"""
+Offline benchmark suite.
+
+Product pages are recorded once into versioned fixtures and replayed through
+a local HTTP stand-in server, so scraping, parsing and email rendering can be
+measured without touching live retailer sites. Run ``python -m benchmarks.run``.
+"""
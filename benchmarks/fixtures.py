@@ -0,0 +1,194 @@
+"""
+Recorded product-page fixtures and a local HTTP server that replays them.
+
+Fixtures live in ``benchmarks/fixtures/v<FIXTURE_VERSION>/`` as gzipped HTML
+plus a ``manifest.json``. Record them from the configured product links with
+``python -m benchmarks.run record``; bump FIXTURE_VERSION when re-recording
+changes what the benchmarks measure, so results are only compared against
+baselines taken with the same pages. Without recorded fixtures, synthetic
+pages with the same JSON-LD structure are generated instead.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import config_enhanced as config
+from retailers import registry
+
+FIXTURE_VERSION = 1
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture_dir(version: int = FIXTURE_VERSION) -> str:
+    return os.path.join(FIXTURES_DIR, f"v{version}")
+
+
+def record(product_links: Optional[Dict[str, List[str]]] = None, version: int = FIXTURE_VERSION) -> List[Dict[str, Any]]:
+    """Fetch live product pages once and store them as fixtures.
+
+    Returns:
+        The manifest entries written
+    """
+    product_links = product_links or config.PRODUCT_LINKS
+    directory = fixture_dir(version)
+    os.makedirs(directory, exist_ok=True)
+
+    entries = []
+    for retailer_name, urls in product_links.items():
+        for i, url in enumerate(urls):
+            retailer = registry.get_retailer_for_url(url)
+            response = retailer.session.get(url, timeout=retailer.timeout)
+            response.raise_for_status()
+            body = response.content
+            filename = f"{retailer_name}-{i}.html.gz"
+            with gzip.open(os.path.join(directory, filename), "wb") as f:
+                f.write(body)
+            entries.append({
+                'retailer': retailer_name,
+                'url': url,
+                'file': filename,
+                'bytes': len(body),
+                'sha256': hashlib.sha256(body).hexdigest(),
+                'recorded_at': datetime.now().isoformat()
+            })
+
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({'version': version, 'source': 'recorded', 'pages': entries}, f, indent=2)
+    return entries
+
+
+def _synthetic_page(retailer_name: str, index: int) -> bytes:
+    """Build a product page shaped like the real ones (JSON-LD plus bulky markup)."""
+    product = {
+        "@context": "https://schema.org",
+        "@type": "Product",
+        "name": f"{retailer_name.title()} Benchmark Jacket {index}",
+        "image": [f"https://images.example.com/{retailer_name}/{index}/{n}.jpg" for n in range(6)],
+        "offers": {"@type": "Offer", "price": f"{98 + index}.00", "priceCurrency": "USD"},
+        "description": "Water-repellent shell. " * 20,
+    }
+    filler = "".join(
+        f'<div class="tile" data-sku="{index}-{n}"><a href="/p/{n}"><img src="/i/{n}.jpg" alt="item {n}">'
+        f'<span class="name">Related product {n}</span><span class="price">${n}.00</span></a></div>'
+        for n in range(400)
+    )
+    scripts = "".join(f"<script>window.__STATE_{n}__ = {json.dumps({'k': list(range(50))})};</script>"
+                      for n in range(20))
+    html = (
+        "<!DOCTYPE html><html><head><title>Product</title>"
+        f'<script type="application/ld+json">{json.dumps(product)}</script>{scripts}</head>'
+        f'<body><h1 data-testid="pdp-product-name">{product["name"]}</h1>'
+        f'<span class="price">${product["offers"]["price"]}</span><main>{filler}</main></body></html>'
+    )
+    return html.encode("utf-8")
+
+
+def load(version: int = FIXTURE_VERSION, synthetic_per_retailer: int = 3) -> Dict[str, Any]:
+    """Load fixture pages, falling back to synthetic ones.
+
+    Returns:
+        Dict with 'version', 'source' ("recorded" or "synthetic") and 'pages',
+        a list of dicts with retailer, url and body (bytes)
+    """
+    manifest_path = os.path.join(fixture_dir(version), "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        pages = []
+        for entry in manifest['pages']:
+            with gzip.open(os.path.join(fixture_dir(version), entry['file']), "rb") as f:
+                pages.append({'retailer': entry['retailer'], 'url': entry['url'], 'body': f.read()})
+        return {'version': version, 'source': 'recorded', 'pages': pages}
+
+    hosts = {"lululemon": "https://shop.lululemon.com/p/benchmark/_/prod{}",
+             "nike": "https://www.nike.com/t/benchmark/{}"}
+    pages = [
+        {'retailer': retailer_name, 'url': pattern.format(i), 'body': _synthetic_page(retailer_name, i)}
+        for retailer_name, pattern in hosts.items()
+        for i in range(synthetic_per_retailer)
+    ]
+    return {'version': version, 'source': 'synthetic', 'pages': pages}
+
+
+class FixtureServer:
+    """Serves fixture pages on localhost in place of the retailer sites.
+
+    The server is an HTTP proxy: while it runs, ``http_proxy`` points at it
+    and ``urls`` holds each page's URL with an ``http`` scheme. The URLs keep
+    the real retailer hosts, so the registry routes them as usual, but every
+    request is answered locally. ``latency`` adds a fixed delay per response
+    to mimic the network.
+    """
+
+    PROXY_VARIABLES = ("http_proxy", "HTTP_PROXY")
+
+    def __init__(self, pages: List[Dict[str, Any]], latency: float = 0.0):
+        self.latency = latency
+        self.bodies: Dict[str, bytes] = {}
+        self.urls: List[str] = []
+        self._pages = pages
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._saved_env: Dict[str, Optional[str]] = {}
+
+    @staticmethod
+    def _local_url(url: str) -> str:
+        parsed = urlparse(url)
+        return f"http://{parsed.netloc}{parsed.path}" + (f"?{parsed.query}" if parsed.query else "")
+
+    def __enter__(self) -> "FixtureServer":
+        bodies = self.bodies
+        latency = self.latency
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                # Proxied requests carry the absolute URL; direct ones only the path
+                url = self.path if self.path.startswith("http://") else f"http://{self.headers['Host']}{self.path}"
+                body = bodies.get(url)
+                if latency:
+                    time.sleep(latency)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        for page in self._pages:
+            url = self._local_url(page['url'])
+            bodies[url] = page['body']
+            self.urls.append(url)
+        threading.Thread(target=self._server.serve_forever, name="fixture-server", daemon=True).start()
+
+        proxy = f"http://127.0.0.1:{self._server.server_address[1]}"
+        for variable in self.PROXY_VARIABLES:
+            self._saved_env[variable] = os.environ.get(variable)
+            os.environ[variable] = proxy
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for variable, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+        self._server.shutdown()
+        self._server.server_close()
+        return False
@@ -0,0 +1,394 @@
+"""
+Synthetic load generator for the web API.
+
+Starts ``web_app_enhanced`` on a local port with a temporary data directory,
+seeded subscriptions and stubbed retailers (scrape jobs return canned results
+instead of hitting the sites), then drives it with concurrent clients and
+reports throughput, latency percentiles and error rates per endpoint::
+
+    python -m benchmarks.load --mix read --clients 16 --duration 20
+    python -m benchmarks.load --mix status=5,subscribe=1,unsubscribe=1 --requests 5000
+    python -m benchmarks.load --url http://localhost:8000 --mix read   # an already running server
+    python -m benchmarks.load --mix dashboard --revalidate             # clients keep ETags like browsers
+
+Only requests that raise or return 5xx count as errors; other status codes
+are listed per endpoint.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+
+from retailers import LatencyHistogram
+
+# Operation name -> (endpoint label, request function). Request functions get
+# the client's session, the base URL and the client's state.
+OPERATIONS: Dict[str, Any] = {}
+
+# Named traffic mixes: operation -> weight
+MIXES = {
+    "read": {"status": 4, "health": 3, "subscriptions": 3},
+    "mixed": {"status": 3, "health": 2, "subscriptions": 2, "subscriptions_email": 1,
+              "config": 1, "subscribe": 1, "unsubscribe": 1},
+    "write": {"subscribe": 2, "unsubscribe": 2, "subscriptions_email": 1},
+    "dashboard": {"status": 2, "metrics": 2, "retailers": 1, "health": 1, "index": 1},
+}
+
+PRODUCT_URLS = (
+    "https://shop.lululemon.com/p/load/_/prod{}",
+    "https://www.nike.com/t/load/{}",
+)
+
+
+def operation(name: str, method: str, path: str) -> Callable:
+    """Register a request function as a named operation."""
+    def decorator(fn: Callable) -> Callable:
+        OPERATIONS[name] = (f"{method} {path}", fn)
+        return fn
+    return decorator
+
+
+@operation("index", "GET", "/")
+def _index(session, base, state):
+    return session.get(f"{base}/")
+
+
+@operation("status", "GET", "/api/status")
+def _status(session, base, state):
+    return session.get(f"{base}/api/status")
+
+
+@operation("health", "GET", "/api/enhanced/health")
+def _health(session, base, state):
+    return session.get(f"{base}/api/enhanced/health")
+
+
+@operation("config", "GET", "/api/config")
+def _config(session, base, state):
+    return session.get(f"{base}/api/config")
+
+
+@operation("metrics", "GET", "/api/enhanced/metrics")
+def _metrics(session, base, state):
+    return session.get(f"{base}/api/enhanced/metrics")
+
+
+@operation("retailers", "GET", "/api/enhanced/retailers")
+def _retailers(session, base, state):
+    return session.get(f"{base}/api/enhanced/retailers")
+
+
+@operation("subscriptions", "GET", "/api/subscriptions")
+def _subscriptions(session, base, state):
+    return session.get(f"{base}/api/subscriptions")
+
+
+@operation("subscriptions_email", "GET", "/api/subscriptions?email=")
+def _subscriptions_email(session, base, state):
+    return session.get(f"{base}/api/subscriptions", params={'email': state['email']})
+
+
+@operation("subscribe", "POST", "/api/subscriptions")
+def _subscribe(session, base, state):
+    url = random.choice(PRODUCT_URLS).format(random.randrange(1000000))
+    response = session.post(f"{base}/api/subscriptions", json={'email': state['email'], 'url': url})
+    if response.status_code == 200:
+        state['urls'].append(url)
+    return response
+
+
+@operation("unsubscribe", "DELETE", "/api/subscriptions")
+def _unsubscribe(session, base, state):
+    # Remove one of this client's own products, so deletes don't race other clients
+    if not state['urls']:
+        return _subscribe(session, base, state)
+    url = state['urls'].pop(random.randrange(len(state['urls'])))
+    return session.delete(f"{base}/api/subscriptions", json={'email': state['email'], 'url': url})
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    """Parse a named mix or ``op=weight,op=weight``."""
+    if spec in MIXES:
+        return dict(MIXES[spec])
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r} (choose from {', '.join(sorted(OPERATIONS))})")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def _fake_scrape(product_links=None, on_result=None):
+    """Stand-in for scrape_products_enhanced: canned results, no network."""
+    import config_enhanced as config
+
+    results = []
+    for retailer_name, urls in (product_links or config.PRODUCT_LINKS).items():
+        for url in urls:
+            time.sleep(0.01)
+            result = {'url': url, 'name': f"{retailer_name.title()} product", 'price': "$100USD",
+                      'image': "", 'retailer': retailer_name, 'timestamp': datetime.now().isoformat(),
+                      'success': True, 'duration': 0.01}
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+@contextmanager
+def local_app(subscribers: int = 200, products_per_subscriber: int = 3,
+              status_products: int = 50) -> Iterator[str]:
+    """Run web_app_enhanced on a free local port with seeded temporary data.
+
+    Module-level paths and the scrape function are swapped for the duration
+    and restored afterwards.
+
+    Yields:
+        The base URL of the running app
+    """
+    from werkzeug.serving import make_server
+
+    import jobs
+    import recipients_store
+    import subscriptions_store
+    import web_app_enhanced
+
+    directory = tempfile.mkdtemp(prefix="sale-tracker-load-")
+    with ExitStack() as stack:
+        stack.callback(shutil.rmtree, directory, True)
+
+        def override(obj, attr, value):
+            original = getattr(obj, attr)
+            setattr(obj, attr, value)
+            stack.callback(setattr, obj, attr, original)
+
+        for var in ("SENDER_EMAIL", "EMAIL_PASSWORD"):
+            if var not in os.environ:
+                os.environ[var] = "load-test"
+                stack.callback(os.environ.pop, var, None)
+
+        override(recipients_store, "RECIPIENTS_FILE", os.path.join(directory, "recipients.json"))
+        override(subscriptions_store, "SUBSCRIPTIONS_FILE", os.path.join(directory, "subscriptions.json"))
+        override(web_app_enhanced, "job_manager", jobs.JobManager(os.path.join(directory, "jobs.db")))
+        override(web_app_enhanced.main_enhanced, "scrape_products_enhanced", _fake_scrape)
+        override(web_app_enhanced.main_enhanced.exporter, "directory", os.path.join(directory, "metrics"))
+        override(web_app_enhanced.profiler, "directory", os.path.join(directory, "profiles"))
+        override(web_app_enhanced, "app_state", web_app_enhanced.EnhancedWebAppState())
+
+        subscriptions_store.import_subscriptions({
+            f"seed{i}@example.com": [
+                {"url": PRODUCT_URLS[n % 2].format(i * products_per_subscriber + n),
+                 "company": ("lululemon", "nike")[n % 2], "added_at": datetime.now().isoformat()}
+                for n in range(products_per_subscriber)
+            ]
+            for i in range(subscribers)
+        })
+        for i in range(min(subscribers, 50)):
+            recipients_store.add_recipient(f"seed{i}@example.com")
+
+        web_app_enhanced.app_state.update_scrape_results([
+            {'url': PRODUCT_URLS[i % 2].format(i), 'name': f"Product {i}", 'price': "$100USD", 'image': "",
+             'retailer': ("lululemon", "nike")[i % 2], 'timestamp': datetime.now().isoformat(), 'success': i % 10 != 0}
+            for i in range(status_products)
+        ])
+        web_app_enhanced.app_state.system_status = "healthy"
+
+        server = make_server("127.0.0.1", 0, web_app_enhanced.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="load-app", daemon=True).start()
+        stack.callback(server.shutdown)
+        yield f"http://127.0.0.1:{server.server_port}"
+
+
+class _Session(requests.Session):
+    """Session applying a default timeout to every request.
+
+    With ``revalidate`` it behaves like a browser cache: GETs send the ETag of
+    the last response for the same URL, so unchanged data comes back as 304.
+    """
+
+    def __init__(self, timeout: float, revalidate: bool = False):
+        super().__init__()
+        self.timeout = timeout
+        self.revalidate = revalidate
+        self.etags: Dict[str, str] = {}
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        key = f"{url}?{sorted((kwargs.get('params') or {}).items())}"
+        if self.revalidate and method == "GET" and key in self.etags:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'If-None-Match': self.etags[key]})
+        response = super().request(method, url, **kwargs)
+        if self.revalidate and method == "GET" and response.headers.get('ETag'):
+            self.etags[key] = response.headers['ETag']
+        return response
+
+
+class _ClientStats:
+    """One client's per-endpoint status counts (merged after the run)."""
+
+    def __init__(self):
+        self.statuses: Dict[str, Dict[str, int]] = {}
+
+    def add(self, endpoint: str, status: str):
+        counts = self.statuses.setdefault(endpoint, {})
+        counts[status] = counts.get(status, 0) + 1
+
+
+def generate_load(base_url: str, mix: Dict[str, int], clients: int = 8,
+                  duration: Optional[float] = 10.0, total_requests: Optional[int] = None,
+                  timeout: float = 30.0, revalidate: bool = False) -> Dict[str, Any]:
+    """Drive ``base_url`` with ``clients`` concurrent clients.
+
+    Runs for ``duration`` seconds, or until ``total_requests`` have been
+    sent when that is given. With ``revalidate`` clients send ``If-None-Match``
+    like a browser cache would.
+
+    Returns:
+        Dict with overall and per-endpoint requests, throughput, latency
+        percentiles, error rate and status counts
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies: Dict[str, LatencyHistogram] = {OPERATIONS[name][0]: LatencyHistogram() for name in names}
+    client_stats = [_ClientStats() for _ in range(clients)]
+    remaining = [total_requests]
+    remaining_lock = threading.Lock()
+    deadline = None if total_requests else time.monotonic() + duration
+
+    def take() -> bool:
+        if deadline is not None:
+            return time.monotonic() < deadline
+        with remaining_lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def client(index: int):
+        stats = client_stats[index]
+        state = {'email': f"load{index}@example.com", 'urls': []}
+        rng = random.Random(index)
+        with _Session(timeout, revalidate) as session:
+            while take():
+                name = rng.choices(names, weights)[0]
+                endpoint, fn = OPERATIONS[name]
+                started = time.perf_counter()
+                try:
+                    status = str(fn(session, base_url, state).status_code)
+                except requests.RequestException as e:
+                    status = type(e).__name__
+                latencies[endpoint].record(time.perf_counter() - started)
+                stats.add(endpoint, status)
+
+    threads = [threading.Thread(target=client, args=(i,), name=f"load-client-{i}") for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for endpoint, histogram in latencies.items():
+        statuses: Dict[str, int] = {}
+        for stats in client_stats:
+            for status, count in stats.statuses.get(endpoint, {}).items():
+                statuses[status] = statuses.get(status, 0) + count
+        count = sum(statuses.values())
+        errors = sum(n for status, n in statuses.items() if not status.isdigit() or int(status) >= 500)
+        summary = histogram.summary()
+        endpoints[endpoint] = {
+            'requests': count,
+            'throughput': count / elapsed,
+            'errors': errors,
+            'error_rate': errors / count if count else 0.0,
+            'statuses': dict(sorted(statuses.items())),
+            'latency': {key: summary[key] for key in ('mean', 'p50', 'p95', 'p99', 'max')}
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    errors = sum(e['errors'] for e in endpoints.values())
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(),
+            'base_url': base_url,
+            'mix': mix,
+            'clients': clients,
+            'revalidate': revalidate,
+            'duration': elapsed
+        },
+        'total': {
+            'requests': total,
+            'throughput': total / elapsed,
+            'errors': errors,
+            'error_rate': errors / total if total else 0.0
+        },
+        'endpoints': endpoints
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    meta, total = report['meta'], report['total']
+    print(f"{meta['clients']} clients for {meta['duration']:.1f}s against {meta['base_url']}: "
+          f"{total['requests']} requests, {total['throughput']:.1f} req/s, {total['error_rate']:.2%} errors")
+    print(f"  {'endpoint':<36} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>7}  statuses")
+    for endpoint, stats in sorted(report['endpoints'].items()):
+        if not stats['requests']:
+            continue
+        lat = stats['latency']
+        statuses = " ".join(f"{status}:{count}" for status, count in stats['statuses'].items())
+        print(f"  {endpoint:<36} {stats['requests']:>7} {stats['throughput']:>8.1f} "
+              f"{lat['p50'] * 1000:>8.1f} {lat['p95'] * 1000:>8.1f} {lat['p99'] * 1000:>8.1f} "
+              f"{stats['error_rate']:>7.2%}  {statuses}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Sale Tracker web API load generator")
+    parser.add_argument("--mix", default="read",
+                        help=f"Named mix ({', '.join(MIXES)}) or op=weight,... "
+                             f"with ops: {', '.join(sorted(OPERATIONS))}")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests instead")
+    parser.add_argument("--url", help="Load an already running server instead of a local app")
+    parser.add_argument("--subscribers", type=int, default=200, help="Seeded subscribers (local app)")
+    parser.add_argument("--revalidate", action="store_true",
+                        help="Send If-None-Match with the last ETag per URL, like a browser cache")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.disable(logging.INFO)  # Request logs would dominate the timings
+    with ExitStack() as stack:
+        base_url = args.url or stack.enter_context(local_app(subscribers=args.subscribers))
+        report = generate_load(base_url.rstrip("/"), mix, clients=args.clients,
+                               duration=args.duration, total_requests=args.requests,
+                               revalidate=args.revalidate)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    return 1 if report['total']['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
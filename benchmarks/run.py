@@ -0,0 +1,419 @@
+"""
+Offline benchmark suite.
+
+Runs against recorded fixtures served from localhost, so results don't depend
+on the network or on the retailers' sites:
+
+- ``extract``: BeautifulSoup parsing and ``extract_product_info`` per retailer
+- ``scrape``:  ``scrape_multiple`` throughput at several concurrency levels
+- ``email``:   rendering and MIME-encoding the daily email for 10/100/1000 recipients,
+               shared and personalised (one template render per recipient)
+- ``daily``:   the whole daily run (scrape, plan, render, deliver) into a local file sink
+- ``startup``: wall time of ``cli_enhanced.py`` subcommands in a fresh interpreter
+
+Usage::
+
+    python -m benchmarks.run                        # run all suites, print a report
+    python -m benchmarks.run --output results.json  # also write machine-readable results
+    python -m benchmarks.run --compare              # fail (exit 1) on regressions vs the baseline
+    python -m benchmarks.run --save-baseline        # store these results as the new baseline
+    python -m benchmarks.run record                 # re-record fixtures from PRODUCT_LINKS
+
+Baselines are machine-specific: take one on the machine that will run the
+comparison (e.g. the CI runner), and retake it after re-recording fixtures.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from unittest.mock import patch
+
+from bs4 import BeautifulSoup
+
+from benchmarks import fixtures
+from retailers import LatencyHistogram, RetailerRegistry
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+CLI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli_enhanced.py")
+
+SUITES = ("extract", "scrape", "email", "daily", "startup")
+CONCURRENCY_LEVELS = (1, 2, 4, 8)
+RECIPIENT_COUNTS = (10, 100, 1000)
+# CLI subcommands timed by the startup suite (offline and read-only)
+STARTUP_COMMANDS = (("--help",), ("config",), ("recipients", "list"), ("retailers",))
+
+# Relative change tolerated before a metric counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def _metric(value: float, unit: str, better: str = "lower", **extra) -> Dict[str, Any]:
+    """A single result; ``better`` says which direction is an improvement."""
+    return {'value': value, 'unit': unit, 'better': better, **extra}
+
+
+def bench_extract(pages: List[Dict[str, Any]], iterations: int) -> Dict[str, Dict[str, Any]]:
+    """Time parsing and extraction separately, per retailer."""
+    registry = RetailerRegistry(enable_cache=False)
+    results: Dict[str, Dict[str, Any]] = {}
+    by_retailer: Dict[str, List[Dict[str, Any]]] = {}
+    for page in pages:
+        by_retailer.setdefault(page['retailer'], []).append(page)
+
+    for retailer_name, retailer_pages in sorted(by_retailer.items()):
+        retailer = registry.get_retailer(retailer_name)
+        parse = LatencyHistogram()
+        extract = LatencyHistogram()
+        for page in retailer_pages:
+            html = page['body'].decode("utf-8", errors="replace")
+            for _ in range(iterations):
+                started = time.perf_counter()
+                soup = BeautifulSoup(html, "html.parser")
+                parsed = time.perf_counter()
+                retailer.extract_product_info(soup, page['url'])
+                parse.record(parsed - started)
+                extract.record(time.perf_counter() - parsed)
+
+        for stage, histogram in (("parse", parse), ("extract", extract)):
+            summary = histogram.summary()
+            prefix = f"extract.{retailer_name}.{stage}"
+            results[f"{prefix}.p50"] = _metric(summary['p50'], "s")
+            results[f"{prefix}.p95"] = _metric(summary['p95'], "s")
+            results[f"{prefix}.ops"] = _metric(1 / summary['mean'], "ops/s", better="higher")
+    return results
+
+
+def bench_scrape(pages: List[Dict[str, Any]], rounds: int, latency: float,
+                 concurrency_levels=CONCURRENCY_LEVELS) -> Dict[str, Dict[str, Any]]:
+    """Scrape every fixture ``rounds`` times through the local server.
+
+    Each worker runs ``scrape_multiple`` over its share of the URLs (no cache,
+    no throttling delay), as the web app and scheduler do per batch.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    with fixtures.FixtureServer(pages, latency=latency) as server:
+        urls = server.urls * rounds
+        for workers in concurrency_levels:
+            registry = RetailerRegistry(enable_cache=False)
+            chunks = [urls[i::workers] for i in range(workers)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                batches = list(pool.map(lambda chunk: registry.scrape_multiple(chunk, use_cache=False, delay=0),
+                                        chunks))
+            elapsed = time.perf_counter() - started
+            scraped = [result for batch in batches for result in batch]
+            failures = sum(1 for result in scraped if not result['success'])
+            durations = LatencyHistogram()
+            for result in scraped:
+                durations.record(result['duration'])
+            summary = durations.summary()
+            results[f"scrape.c{workers}.throughput"] = _metric(len(scraped) / elapsed, "products/s", better="higher")
+            results[f"scrape.c{workers}.p50"] = _metric(summary['p50'], "s")
+            results[f"scrape.c{workers}.p95"] = _metric(summary['p95'], "s")
+            results[f"scrape.c{workers}.failures"] = _metric(failures, "count")
+    return results
+
+
+def _products(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Build the product dicts the email is rendered from, one per fixture."""
+    registry = RetailerRegistry(enable_cache=False)
+    products = []
+    for page in pages:
+        retailer = registry.get_retailer(page['retailer'])
+        soup = BeautifulSoup(page['body'].decode("utf-8", errors="replace"), "html.parser")
+        name, price, image = retailer.extract_product_info(soup, page['url'])
+        products.append({
+            'url': page['url'],
+            'name': name,
+            'price': price,
+            'image': image,
+            'retailer': page['retailer'],
+            'timestamp': datetime.now().isoformat(),
+            'success': name != "Product name not found",
+            'previous_price': None,
+            'price_drop': False
+        })
+    return products
+
+
+def bench_email(pages: List[Dict[str, Any]], recipient_counts=RECIPIENT_COUNTS) -> Dict[str, Dict[str, Any]]:
+    """Build the daily email and MIME-encode it for each recipient (no SMTP), as the sender does."""
+    import email_builder
+    import main_enhanced  # Deferred: only this suite needs the email pipeline
+
+    products = _products(pages)
+    results: Dict[str, Dict[str, Any]] = {}
+    # Compiling the templates is a one-off per process, so it is reported on its own
+    started = time.perf_counter()
+    email_builder.render_daily_email(products)
+    results["email.first_render_seconds"] = _metric(time.perf_counter() - started, "s")
+    for count in recipient_counts:
+        recipients = [f"user{i}@example.com" for i in range(count)]
+        total_bytes = 0
+        started = time.perf_counter()
+        msg = email_builder.build_message("benchmark@example.com", recipients[0], "Daily Product Update",
+                                          main_enhanced.create_enhanced_email_content(products))
+        for recipient in recipients:
+            email_builder.address(msg, recipient)
+            total_bytes += len(msg.as_bytes())
+        elapsed = time.perf_counter() - started
+        results[f"email.r{count}.seconds"] = _metric(elapsed, "s")
+        results[f"email.r{count}.per_recipient"] = _metric(elapsed / count, "s")
+        results[f"email.r{count}.bytes_per_message"] = _metric(total_bytes / count, "bytes")
+
+        # Personalised: every recipient gets their own product subset, so each is rendered
+        started = time.perf_counter()
+        for i, recipient in enumerate(recipients):
+            subset = products[i % len(products):] + products[:i % len(products)]
+            content = email_builder.render_daily_email(subset[:max(1, len(subset) - i % 3)])
+            email_builder.build_message("benchmark@example.com", recipient, "Daily Product Update", content).as_bytes()
+        elapsed = time.perf_counter() - started
+        results[f"email.r{count}.personalized_per_recipient"] = _metric(elapsed / count, "s")
+    return results
+
+
+def bench_daily(pages: List[Dict[str, Any]], recipient_counts=RECIPIENT_COUNTS) -> Dict[str, Dict[str, Any]]:
+    """Run the full daily email pipeline offline, delivering into a file sink.
+
+    Products are scraped from the fixture server and every recipient gets the
+    digest (alerts off), so the run exercises scraping, unit planning,
+    rendering and delivery. All state lives in a temporary directory.
+    """
+    import config_enhanced as config
+    import delivery_ledger
+    import main_enhanced
+    import recipients_store
+    import subscriptions_store
+    from work_queue import WorkQueue
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with fixtures.FixtureServer(pages) as server:
+        for count in recipient_counts:
+            directory = tempfile.mkdtemp(prefix="sale-tracker-daily-")
+            outbox = os.path.join(directory, "outbox")
+            queue = WorkQueue(os.path.join(directory, "work.db"))
+            with ExitStack() as stack:
+                stack.callback(shutil.rmtree, directory, True)
+                stack.enter_context(patch.dict(os.environ, {"EMAIL_TRANSPORT": "file"}))
+                stack.enter_context(patch.object(config, "_env_loaded", True))
+                for var in ("RECIPIENT_EMAIL", "RECIPIENT_EMAIL2"):
+                    os.environ.pop(var, None)
+                stack.enter_context(patch.dict(config.EMAIL_SETTINGS, {"outbox_path": outbox}))
+                stack.enter_context(patch.dict(config.ALERT_SETTINGS, {"enabled": False}))
+                stack.enter_context(patch.dict(config.REFRESH_SETTINGS, {"enabled": False}))
+                stack.enter_context(patch.dict(config.STORAGE_SETTINGS, {"enable_price_history": False}))
+                stack.enter_context(patch.dict(config.SCRAPING_SETTINGS, {"enable_cache": False, "rate_limit_delay": 0}))
+                stack.enter_context(patch.object(config, "PRODUCT_LINKS", {"fixtures": server.urls}))
+                stack.enter_context(patch.object(recipients_store, "RECIPIENTS_FILE",
+                                                 os.path.join(directory, "recipients.json")))
+                stack.enter_context(patch.object(subscriptions_store, "SUBSCRIPTIONS_FILE",
+                                                 os.path.join(directory, "subscriptions.json")))
+                stack.enter_context(patch.object(main_enhanced, "work_queue", queue))
+                stack.enter_context(patch.object(delivery_ledger, "ledger", delivery_ledger.DeliveryLedger(
+                    os.path.join(directory, "deliveries.db"))))
+                recipients_store._write_store({
+                    "recipients": [{"email": f"user{i}@example.com"} for i in range(count)],
+                    "last_updated": None
+                })
+
+                started = time.perf_counter()
+                main_enhanced.send_daily_email_enhanced(run_id=f"bench-{count}")
+                elapsed = time.perf_counter() - started
+
+                run_state = queue.get_run(f"bench-{count}")
+                delivered = len(os.listdir(outbox)) if os.path.isdir(outbox) else 0
+                failed = sum(units.get('failed', 0) for units in run_state['units'].values())
+                results[f"daily.r{count}.seconds"] = _metric(elapsed, "s")
+                results[f"daily.r{count}.emails_per_second"] = _metric(delivered / elapsed, "emails/s", better="higher")
+                results[f"daily.r{count}.undelivered"] = _metric(count - delivered + failed, "count")
+    return results
+
+
+def bench_startup(runs: int, commands=STARTUP_COMMANDS) -> Dict[str, Dict[str, Any]]:
+    """Time CLI subcommands from interpreter start to exit.
+
+    Commands run in an empty working directory, so they read no local data
+    and write nothing into the checkout.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    directory = tempfile.mkdtemp(prefix="sale-tracker-startup-")
+    try:
+        for command in commands:
+            histogram = LatencyHistogram()
+            for _ in range(runs):
+                started = time.perf_counter()
+                subprocess.run([sys.executable, CLI_PATH, *command], cwd=directory,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+                histogram.record(time.perf_counter() - started)
+            summary = histogram.summary()
+            name = "_".join(part.lstrip("-") for part in command)
+            results[f"startup.{name}.p50"] = _metric(summary['p50'], "s")
+            results[f"startup.{name}.min"] = _metric(summary['min'], "s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(suites=SUITES, quick: bool = False, latency: float = 0.0) -> Dict[str, Any]:
+    """Run the selected suites.
+
+    Returns:
+        Dict with 'meta' (environment and fixture info) and 'results'
+        (metric name -> {value, unit, better})
+    """
+    loaded = fixtures.load()
+    pages = loaded['pages']
+    results: Dict[str, Dict[str, Any]] = {}
+    if "extract" in suites:
+        results.update(bench_extract(pages, iterations=2 if quick else 20))
+    if "scrape" in suites:
+        results.update(bench_scrape(pages, rounds=1 if quick else 10, latency=latency,
+                                    concurrency_levels=(1, 2) if quick else CONCURRENCY_LEVELS))
+    if "email" in suites:
+        results.update(bench_email(pages, recipient_counts=(10,) if quick else RECIPIENT_COUNTS))
+    if "daily" in suites:
+        results.update(bench_daily(pages, recipient_counts=(10,) if quick else RECIPIENT_COUNTS))
+    if "startup" in suites:
+        results.update(bench_startup(runs=1 if quick else 10))
+
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'git_revision': _git_revision(),
+            'fixture_version': loaded['version'],
+            'fixture_source': loaded['source'],
+            'fixture_pages': len(pages),
+            'quick': quick,
+            'latency': latency
+        },
+        'results': results
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float = DEFAULT_TOLERANCE) -> Dict[str, Any]:
+    """Compare results against a baseline.
+
+    Metrics are only compared when both runs used the same fixtures and mode.
+    A metric regresses when it moves in its worse direction by more than
+    ``tolerance`` (relative); counts such as failures regress on any increase.
+
+    Returns:
+        Dict with 'comparable', 'reason' and per-metric 'changes' and 'regressions'
+    """
+    for key in ('fixture_version', 'fixture_source', 'quick', 'latency'):
+        if current['meta'].get(key) != baseline['meta'].get(key):
+            return {'comparable': False, 'reason': f"{key} differs from the baseline",
+                    'changes': {}, 'regressions': []}
+
+    changes: Dict[str, Dict[str, Any]] = {}
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None or result['value'] is None or base['value'] is None:
+            continue
+        if result['unit'] == "count":
+            regressed = result['value'] > base['value']
+            change = result['value'] - base['value']
+        else:
+            if not base['value']:
+                continue
+            change = (result['value'] - base['value']) / base['value']
+            worse = -change if result['better'] == "higher" else change
+            regressed = worse > tolerance
+        changes[name] = {'baseline': base['value'], 'current': result['value'], 'change': change}
+        if regressed:
+            regressions.append(name)
+    return {'comparable': True, 'reason': None, 'changes': changes, 'regressions': regressions}
+
+
+def _format_value(value: float, unit: str) -> str:
+    if unit == "s":
+        return f"{value * 1000:.3f} ms"
+    if unit == "count":
+        return str(value)
+    return f"{value:,.1f} {unit}"
+
+
+def print_report(report: Dict[str, Any], comparison: Optional[Dict[str, Any]] = None):
+    meta = report['meta']
+    print(f"Fixtures v{meta['fixture_version']} ({meta['fixture_source']}, {meta['fixture_pages']} pages), "
+          f"Python {meta['python']}, rev {meta['git_revision'] or 'unknown'}")
+    changes = (comparison or {}).get('changes', {})
+    regressions = set((comparison or {}).get('regressions', []))
+    for name, result in report['results'].items():
+        line = f"  {name:<40} {_format_value(result['value'], result['unit']):>20}"
+        if name in changes:
+            change = changes[name]['change']
+            line += f"  {change:+.0%}" if result['unit'] != "count" else f"  {change:+d}"
+            if name in regressions:
+                line += "  REGRESSION"
+        print(line)
+    if comparison and not comparison['comparable']:
+        print(f"Not compared with the baseline: {comparison['reason']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Sale Tracker offline benchmarks")
+    parser.add_argument("command", nargs="?", choices=["run", "record"], default="run")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="Suite to run (repeatable, default: all)")
+    parser.add_argument("--quick", action="store_true", help="Few iterations, for smoke tests")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated network latency per response (s)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, help="Compare against a baseline file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed relative slowdown")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH, help="Save results as the baseline")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        entries = fixtures.record()
+        print(f"Recorded {len(entries)} pages to {fixtures.fixture_dir()}")
+        return 0
+
+    logging.disable(logging.INFO)  # Per-product scrape logs would dominate the timings
+    report = run(tuple(args.suite or SUITES), quick=args.quick, latency=args.latency)
+
+    comparison = None
+    if args.compare:
+        if os.path.exists(args.compare):
+            with open(args.compare, "r", encoding="utf-8") as f:
+                comparison = compare(report, json.load(f), args.tolerance)
+            report['comparison'] = comparison
+        else:
+            print(f"No baseline at {args.compare}", file=sys.stderr)
+
+    print_report(report, comparison)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {path}")
+
+    if comparison and comparison['regressions']:
+        print(f"{len(comparison['regressions'])} regression(s) beyond {args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
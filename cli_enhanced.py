@@ -9,12 +9,13 @@ import json
 from datetime import datetime
 from typing import Dict, Any
 
-# Import enhanced modules
-import main_enhanced
+# Import enhanced modules (main_enhanced is imported only by the commands that
+# scrape or send, so quick commands like config and recipients start fast)
 import config_enhanced as config
 from retailers import registry
 import recipients_store
 import subscriptions_store
+from profiling import profiler
 
 
 def setup_logging(verbose=False, quiet=False):
@@ -35,6 +36,8 @@ def setup_logging(verbose=False, quiet=False):
 
 def test_enhanced_scraping(retailer_filter=None, use_cache=True):
     """Test enhanced scraping functionality with new framework."""
+    import main_enhanced
+    
     print("🔍 Testing Enhanced Scraping Framework")
     print("=" * 60)
     
@@ -59,7 +62,8 @@ def test_enhanced_scraping(retailer_filter=None, use_cache=True):
     
     # Test scraping
     start_time = datetime.now()
-    results = main_enhanced.scrape_products_enhanced(product_links)
+    with main_enhanced.trace_run("test_scraping") as run:
+        results = main_enhanced.scrape_products_enhanced(product_links)
     end_time = datetime.now()
     
     # Display results
@@ -71,6 +75,8 @@ def test_enhanced_scraping(retailer_filter=None, use_cache=True):
     print(f"   Successful: {success_count}")
     print(f"   Failed: {total_count - success_count}")
     print(f"   Duration: {(end_time - start_time).total_seconds():.2f}s")
+    if run.path:
+        print(f"   Trace: {run.path}")
     print()
     
     # Show detailed results
@@ -94,6 +100,19 @@ def test_enhanced_scraping(retailer_filter=None, use_cache=True):
         print(f"💾 Cache Statistics:")
         print(f"   Cache Size: {cache_stats['size']} items")
         print(f"   Default TTL: {cache_stats['default_ttl']}s")
+    coalescing = registry.get_coalescing_stats()
+    if coalescing['fetches_saved']:
+        print(f"   Duplicate Fetches Saved: {coalescing['fetches_saved']}")
+    
+    # Show latency percentiles per retailer
+    latency_stats = registry.get_latency_stats()
+    if latency_stats:
+        print(f"⏱️  Latency (p50 / p95 / p99):")
+        for retailer_name, stages in latency_stats.items():
+            for stage, summary in stages.items():
+                if summary['count']:
+                    print(f"   {retailer_name} {stage}: {summary['p50'] * 1000:.1f} / "
+                          f"{summary['p95'] * 1000:.1f} / {summary['p99'] * 1000:.1f} ms ({summary['count']} samples)")
 
 
 def show_enhanced_config():
@@ -141,6 +160,8 @@ def show_enhanced_config():
 
 def send_test_email_enhanced(recipients=None):
     """Send enhanced test email."""
+    import main_enhanced
+    
     print("📧 Sending Enhanced Test Email")
     print("=" * 40)
     
@@ -159,12 +180,15 @@ def send_test_email_enhanced(recipients=None):
         print(f"Recipients: {', '.join(recipients)}")
         
         # Get sample products for test email
-        print("Fetching sample product data...")
-        sample_products = main_enhanced.scrape_products_enhanced()
-        
-        # Send test email
-        main_enhanced.send_enhanced_email(sample_products, recipients)
+        with main_enhanced.trace_run("send_test") as run:
+            print("Fetching sample product data...")
+            sample_products = main_enhanced.scrape_products_enhanced()
+            
+            # Send test email
+            main_enhanced.send_enhanced_email(sample_products, recipients)
         print("✅ Enhanced test email sent successfully!")
+        if run.path:
+            print(f"   Trace: {run.path}")
         
     except Exception as e:
         print(f"❌ Failed to send test email: {e}")
@@ -182,6 +206,9 @@ def show_retailer_info():
         if retailer:
             print(f"\n📦 {retailer_name.upper()}")
             metadata = retailer.get_metadata()
+            spec = registry.get_spec(retailer_name)
+            if spec:
+                print(f"   Hosts: {', '.join(spec.hosts)}")
             print(f"   User Agent: {metadata['user_agent'][:50]}...")
             print(f"   Timeout: {metadata['timeout']}s")
             print(f"   Retry Attempts: {metadata['retry_attempts']}")
@@ -242,6 +269,8 @@ def manage_recipients(action, email=None):
 
 def health_check():
     """Perform comprehensive health check."""
+    import main_enhanced
+    
     print("🏥 System Health Check")
     print("=" * 40)
     
@@ -304,8 +333,52 @@ def health_check():
         return False
 
 
+def run_daily_email(workers=1, run_id=None):
+    """Run (or join) the daily email run with several worker processes."""
+    import os
+    import subprocess
+    import main_enhanced
+    from work_queue import work_queue
+    
+    run_id = run_id or main_enhanced.daily_run_id()
+    print(f"📬 Daily email run {run_id} with {workers} worker{'s' if workers != 1 else ''}")
+    print("=" * 50)
+    
+    # Helpers claim units from the same run; this process works on it too
+    helpers = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), '--quiet', 'daily-run', '--run-id', run_id])
+        for _ in range(workers - 1)
+    ]
+    error = None
+    try:
+        main_enhanced.send_daily_email_enhanced(run_id=run_id)
+    except Exception as e:
+        error = e
+    finally:
+        for helper in helpers:
+            helper.wait()
+    
+    run = work_queue.get_run(run_id)
+    if run is None:
+        print("❌ Run was not created")
+        sys.exit(1)
+    print(f"Stage: {run['stage']}")
+    for stage, counts in run['units'].items():
+        print(f"   {stage}: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    if run['finished_at']:
+        print(f"⏱️  Finished in {run['finished_at'] - run['created_at']:.2f}s")
+    if error is not None:
+        print(f"❌ Daily email run failed: {error}")
+        sys.exit(1)
+
+
 def run_enhanced_scheduler():
     """Run the enhanced scheduler."""
+    import main_enhanced
+    
+    # The long-running scheduler also logs to the rotating log file
+    main_enhanced.setup_logging()
+    
     print("🚀 Starting Enhanced Sale Tracker Scheduler")
     print("=" * 50)
     
@@ -334,12 +407,15 @@ Examples:
   %(prog)s test-scraping                    # Test all retailers
   %(prog)s test-scraping --retailer nike    # Test only Nike
   %(prog)s test-scraping --no-cache         # Test without cache
+  %(prog)s --trace test-scraping            # Write a timeline to data/traces
+  %(prog)s --profile sampling test-scraping # Write a profile to data/profiles
   %(prog)s send-test --recipients user@example.com
   %(prog)s config                           # Show configuration
   %(prog)s retailers                        # Show retailer info
   %(prog)s recipients list                  # List recipients
   %(prog)s recipients add user@example.com  # Add recipient
   %(prog)s health                           # Health check
+  %(prog)s daily-run --workers 4            # Send today's emails with 4 worker processes
   %(prog)s run                              # Start scheduler
         """
     )
@@ -347,6 +423,8 @@ Examples:
     # Global options
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbose output')
     parser.add_argument('--quiet', '-q', action='store_true', help='Quiet output (errors only)')
+    parser.add_argument('--trace', action='store_true', help='Write a Chrome trace file of scrape/email runs')
+    parser.add_argument('--profile', choices=['deterministic', 'sampling'], help='Profile the command (data/profiles)')
     
     # Subcommands
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
@@ -374,6 +452,11 @@ Examples:
     # Health check command
     subparsers.add_parser('health', help='Perform system health check')
     
+    # Daily email run command
+    daily_parser = subparsers.add_parser('daily-run', help="Run or join today's daily email run")
+    daily_parser.add_argument('--workers', type=int, default=1, help='Worker processes (default: 1)')
+    daily_parser.add_argument('--run-id', help="Run to create or join (default: today's)")
+    
     # Run scheduler command
     subparsers.add_parser('run', help='Start the enhanced scheduler')
     
@@ -382,8 +465,23 @@ Examples:
     
     # Set up logging
     setup_logging(args.verbose, args.quiet)
+    if args.trace:
+        config.PERFORMANCE_SETTINGS["enable_tracing"] = True
+    if args.profile:
+        config.PERFORMANCE_SETTINGS["enable_profiling"] = True
+        config.PERFORMANCE_SETTINGS["profiling_mode"] = args.profile
+    
+    # The scheduler profiles each job separately
+    if args.command == 'run':
+        run_enhanced_scheduler()
+        return
     
-    # Execute commands
+    with profiler.profile(f"cli-{args.command}"):
+        run_command(parser, args)
+
+
+def run_command(parser, args):
+    """Execute a CLI subcommand."""
     if args.command == 'test-scraping':
         test_enhanced_scraping(
             retailer_filter=args.retailer,
@@ -397,11 +495,11 @@ Examples:
         show_retailer_info()
     elif args.command == 'recipients':
         manage_recipients(args.action, args.email)
+    elif args.command == 'daily-run':
+        run_daily_email(max(1, args.workers), args.run_id)
     elif args.command == 'health':
         success = health_check()
         sys.exit(0 if success else 1)
-    elif args.command == 'run':
-        run_enhanced_scheduler()
     else:
         parser.print_help()
         sys.exit(1)
@@ -17,7 +17,9 @@ PRODUCT_LINKS = {
 EMAIL_SETTINGS = {
     "smtp_server": "smtp.gmail.com",
     "smtp_port": 587,
-    "schedule_time": "21:00"  # 9 PM
+    "schedule_time": "21:00",  # 9 PM
+    "transport": "smtp",  # smtp, smtp_pool, maildir, mbox or file (EMAIL_TRANSPORT overrides)
+    "outbox_path": "data/outbox"  # Where maildir/mbox/file transports write messages
 }
 
 # Scraping settings
@@ -6,6 +6,11 @@ import os
 from typing import Dict, List, Any
 from datetime import datetime
 
+VERSION = "2.1.0"
+
+# When this configuration was loaded (reported as last_updated)
+LOADED_AT = datetime.now().isoformat()
+
 # Product links to track (organized by retailer)
 PRODUCT_LINKS = {
     "lululemon": [
@@ -23,7 +28,24 @@ EMAIL_SETTINGS = {
     "smtp_port": 587,
     "schedule_time": "21:00",  # 9 PM
     "max_retries": 3,
-    "retry_delay": 5  # seconds
+    "retry_delay": 5,  # seconds
+    "transport": "smtp",             # smtp, smtp_pool, maildir, mbox or file (EMAIL_TRANSPORT overrides)
+    "pool_size": 2,                  # Connections kept open by smtp_pool
+    "pool_max_messages": 100,        # Messages per pooled connection before reconnecting
+    "outbox_path": "data/outbox",    # Where maildir/mbox/file transports write messages
+    "max_message_bytes": 100000,     # Body size budget; products beyond it are left out (0 = no limit)
+    "currency_symbol": "$"           # Shown before prices the emails format themselves (e.g. "Was $120.00")
+}
+
+# Outbound email pacing (defaults suit a personal Gmail account)
+OUTBOUND_SETTINGS = {
+    "max_per_minute": 20,     # Fastest send rate
+    "min_per_minute": 1,      # Slowest rate after repeated throttling
+    "max_per_day": 500,       # Provider's rolling 24-hour cap
+    "send_window": 0,         # Spread a daily run's emails over this many seconds (0 = as fast as allowed)
+    "backoff_factor": 0.5,    # Rate multiplier after a 4xx throttling reply
+    "recovery_step": 0.5,     # Emails/minute regained per delivered email
+    "throttle_pause": 30      # Seconds to pause all sending after a throttling reply
 }
 
 # Enhanced scraping settings
@@ -45,7 +67,81 @@ PERFORMANCE_SETTINGS = {
     "max_log_file_size": 10 * 1024 * 1024,  # 10MB
     "log_retention_days": 30,
     "health_check_interval": 300,  # 5 minutes
-    "enable_profiling": False  # Set to True for performance analysis
+    "enable_profiling": False,  # Profile scheduler jobs, CLI commands and web requests (data/profiles)
+    "profiling_mode": "deterministic",  # "deterministic" (cProfile, .pstats) or "sampling" (.collapsed stacks)
+    "profiling_interval": 0.005,  # Seconds between stack samples in sampling mode
+    "profiling_keep": 50,  # Newest profiles to keep
+    "enable_tracing": False,  # Write a Chrome trace file (data/traces) for every scrape/email run
+    "metrics_flush_interval": 15  # Seconds between per-process /metrics snapshots
+}
+
+# Price-drop alert settings
+ALERT_SETTINGS = {
+    "enabled": True,  # When False, everyone gets the full daily update instead
+    # Defaults applied to subscriptions without their own rules (None disables a rule)
+    "default_rules": {
+        "min_drop": 0.01,        # Absolute drop vs. last known price
+        "min_drop_pct": None,    # Percent drop vs. last known price
+        "target_price": None,    # Alert when price is at or below this
+        "all_time_low": True     # Alert when price beats every recorded price
+    }
+}
+
+# Incremental refresh settings (spreads scraping over the day)
+REFRESH_SETTINGS = {
+    "enabled": True,
+    "batch_size": 5,               # Products fetched per refresh tick
+    "tick_interval": 600,          # Seconds between refresh ticks
+    "max_interval": 24 * 3600,     # Slowest refresh for products whose price never moves
+    "max_staleness": 6 * 3600,     # Oldest snapshot the daily email may use
+    "volatility_window_days": 14,  # History used to estimate how often prices change
+    "default_volatility": 0.5,     # Assumed change rate for products without history
+    "unsubscribed_multiplier": 3.0  # Slow-down for products nobody subscribes to
+}
+
+# Background job settings (web app scrape/email work)
+JOB_SETTINGS = {
+    "workers": 2,              # Worker threads per web process
+    "retention_days": 7,       # Finished jobs are pruned after this many days
+    "heartbeat_interval": 30,  # Seconds between heartbeats of a process's active jobs
+    "heartbeat_timeout": 120   # Active jobs without a heartbeat this long are failed instead of joined
+}
+
+# Scheduler settings (daily email, refresh, health checks)
+SCHEDULER_SETTINGS = {
+    "workers": 4,                   # Worker threads running due jobs
+    "catch_up_window": 12 * 3600    # Missed runs later than this are skipped on restart
+}
+
+# Daily run sharding (worker processes/nodes sharing data/work.db split the run)
+DAILY_RUN_SETTINGS = {
+    "fetch_unit_size": 10,     # Product URLs per fetch unit
+    "email_unit_size": 25,     # Recipients per email unit
+    "lease_seconds": 300,      # A crashed worker's unit is taken over after this long
+    "max_attempts": 3,         # Claims per unit before it is marked failed
+    "retry_backoff": 60,       # Wait before retrying a failed unit, doubling with each attempt
+    "max_retry_wait": 300,     # Longer waits for a retry end this worker's turn (rerun to resume)
+    "poll_interval": 1.0,      # Wait while other workers finish the current stage
+    "retention_days": 7        # Finished runs are pruned after this many days
+}
+
+# Product image proxy and thumbnail cache (data/images, served at /images/<key>)
+IMAGE_SETTINGS = {
+    "enabled": True,
+    "public_base_url": "",                  # Web app URL for email images (PUBLIC_BASE_URL overrides); empty hot-links
+    "thumbnail_size": 300,                  # Longest side in pixels (needs Pillow)
+    "thumbnail_quality": 80,                # JPEG quality
+    "max_cache_bytes": 200 * 1024 * 1024,   # Least recently served images are evicted beyond this
+    "max_download_bytes": 5 * 1024 * 1024,  # Larger source images are refused
+    "timeout": 10,                          # Download timeout in seconds
+    "retry_after": 3600,                    # Wait before retrying an image that failed to download
+    "cache_max_age": 30 * 86400             # Cache-Control max-age of served images
+}
+
+# Paginated listings (GET /api/subscriptions, scrape results in /api/status and /api/enhanced/metrics)
+API_SETTINGS = {
+    "page_size": 50,       # Items per page when no limit is given
+    "max_page_size": 500   # Largest limit a client may ask for
 }
 
 # Security settings
@@ -65,7 +161,8 @@ STORAGE_SETTINGS = {
     "data_directory": "data",
     "backup_enabled": True,
     "backup_interval": 24 * 3600,  # 24 hours
-    "compression_enabled": True
+    "compression_enabled": True,
+    "enable_price_history": True  # Record every scrape outcome in data/price_history.db
 }
 
 # Feature flags
@@ -112,16 +209,32 @@ def get_config() -> Dict[str, Any]:
     return {
         "product_links": PRODUCT_LINKS,
         "email": EMAIL_SETTINGS,
+        "outbound": OUTBOUND_SETTINGS,
         "scraping": SCRAPING_SETTINGS,
         "performance": PERFORMANCE_SETTINGS,
         "security": SECURITY_SETTINGS,
         "storage": STORAGE_SETTINGS,
         "features": FEATURE_FLAGS,
         "retailers": RETAILER_SETTINGS,
-        "version": "2.1.0",
-        "last_updated": datetime.now().isoformat()
+        "alerts": ALERT_SETTINGS,
+        "refresh": REFRESH_SETTINGS,
+        "jobs": JOB_SETTINGS,
+        "scheduler": SCHEDULER_SETTINGS,
+        "daily_run": DAILY_RUN_SETTINGS,
+        "images": IMAGE_SETTINGS,
+        "api": API_SETTINGS,
+        "version": VERSION,
+        "last_updated": LOADED_AT
     }
 
+
+def config_fingerprint() -> str:
+    """Get a short hash of the effective configuration (changes when a setting is changed at runtime)."""
+    import hashlib
+    import json
+    encoded = json.dumps(get_config(), sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
 def get_retailer_config(retailer_name: str) -> Dict[str, Any]:
     """Get configuration for a specific retailer."""
     retailer_config = RETAILER_SETTINGS.get(retailer_name, {})
@@ -132,12 +245,25 @@ def get_retailer_config(retailer_name: str) -> Dict[str, Any]:
     
     return config
 
+_env_loaded = False
+
+def load_env():
+    """Load variables from a .env file into the environment (once per process)."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv  # Deferred: only needed once credentials are
+        load_dotenv()
+        _env_loaded = True
+
 def validate_config() -> List[str]:
     """Validate configuration and return list of issues."""
+    load_env()
     issues = []
     
     # Validate required settings
-    required_env_vars = ["SENDER_EMAIL", "EMAIL_PASSWORD"]
+    # Local email sinks (maildir/mbox/file) don't log in to a mail server
+    transport = os.getenv("EMAIL_TRANSPORT") or EMAIL_SETTINGS.get("transport", "smtp")
+    required_env_vars = ["SENDER_EMAIL", "EMAIL_PASSWORD"] if transport.startswith("smtp") else []
     for var in required_env_vars:
         if not os.getenv(var):
             issues.append(f"Missing required environment variable: {var}")
@@ -149,6 +275,8 @@ def validate_config() -> List[str]:
     # Validate email settings
     if EMAIL_SETTINGS.get("smtp_port", 0) not in [25, 587, 465]:
         issues.append("Invalid SMTP port configuration")
+    if transport not in ("smtp", "smtp_pool", "maildir", "mbox", "file"):
+        issues.append(f"Unknown email transport: {transport}")
     
     # Validate scraping settings
     if SCRAPING_SETTINGS.get("timeout", 0) < 5:
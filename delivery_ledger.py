@@ -0,0 +1,107 @@
+"""
+Delivery ledger for daily emails.
+
+Every email delivered by a daily run is recorded under (run date, recipient,
+content hash). A retried or resumed run checks the ledger before sending, so
+recipients who already got that exact email are skipped, while a recipient
+whose content changed (e.g. a new price drop) still gets the new email.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+import config_enhanced as config
+
+logger = logging.getLogger(__name__)
+
+LEDGER_DB = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "deliveries.db"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    run_date TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    delivered_at REAL NOT NULL,
+    PRIMARY KEY (run_date, recipient, content_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_delivered ON deliveries (delivered_at);
+"""
+
+
+class DeliveryError(Exception):
+    """Raised when some recipients of a ledger-tracked email could not be reached."""
+
+
+def content_hash(subject: str, products: List[Dict[str, Any]]) -> str:
+    """Hash what a recipient sees: the subject and each product's url, name and prices.
+
+    Timestamps and other per-run details are left out so the same email
+    rendered by a different worker hashes the same.
+    """
+    content = [subject] + [
+        [product.get('url'), product.get('name'), product.get('price'),
+         product.get('previous_price'), product.get('success')]
+        for product in products
+    ]
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+class DeliveryLedger:
+    """SQLite record of delivered emails."""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.db_path or LEDGER_DB
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            retention = config.DAILY_RUN_SETTINGS.get("retention_days", 7) * 86400
+            conn.execute("DELETE FROM deliveries WHERE delivered_at < ?", (time.time() - retention,))
+            self._conn = conn
+        return self._conn
+
+    def delivered(self, run_date: str, recipient: str, digest: str) -> bool:
+        """Check whether this email already went to the recipient for the run date."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT 1 FROM deliveries WHERE run_date = ? AND recipient = ? AND content_hash = ?",
+                (run_date, recipient, digest)
+            ).fetchone()
+        return row is not None
+
+    def record(self, run_date: str, recipient: str, digest: str):
+        """Record a delivered email."""
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR IGNORE INTO deliveries (run_date, recipient, content_hash, delivered_at) "
+                "VALUES (?, ?, ?, ?)",
+                (run_date, recipient, digest, time.time())
+            )
+
+    def count(self, run_date: str) -> int:
+        """Count the emails delivered for a run date."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT COUNT(*) FROM deliveries WHERE run_date = ?", (run_date,)
+            ).fetchone()
+        return row[0]
+
+
+# Global delivery ledger (connects on first use)
+ledger = DeliveryLedger()
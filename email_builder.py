@@ -0,0 +1,234 @@
+"""
+Email building.
+
+Turns product lists into compact multipart messages that every sender shares.
+Bodies are rendered from the Jinja templates in ``templates/email`` (an
+``.html`` and a ``.txt`` version of each), which are compiled once per
+process with autoescaping on for HTML:
+
+- The HTML part carries its styles as ``style`` attributes, because many
+  clients (Gmail among them) strip ``<style>`` blocks. Each template's
+  stylesheet is converted to minified attributes once per process.
+- A ``text/plain`` alternative goes first, for text-only clients and
+  spam filters that penalise HTML-only mail.
+- Bodies are kept under ``EMAIL_SETTINGS["max_message_bytes"]`` (Gmail clips
+  messages over about 100 KB). Products that don't fit are left out and
+  counted in a note at the end.
+
+A message is built once per distinct content; ``address`` re-targets it for
+each recipient without rendering again.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from email.charset import QP, Charset
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import config_enhanced as config
+import image_cache
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "email")
+
+# Quoted-printable keeps mostly-ASCII bodies close to their raw size (base64 adds a third)
+_UTF8 = Charset("utf-8")
+_UTF8.body_encoding = QP
+
+# Stylesheets per template. Templates use ``{{ s.<class> }}`` where the inline style goes.
+STYLESHEETS = {
+    "daily": """
+        .body { font-family: Arial, sans-serif; background-color: #f5f5f5; margin: 0; padding: 20px; }
+        .container { max-width: 800px; margin: 0 auto; background-color: #ffffff; padding: 20px; border-radius: 10px; }
+        .header { background-color: #2c3e50; color: #ffffff; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }
+        .metrics { background-color: #ecf0f1; padding: 15px; border-radius: 5px; margin: 20px 0; }
+        .card { border: 1px solid #dddddd; border-radius: 8px; padding: 15px; margin: 0 0 15px 0; background-color: #fafafa; }
+        .retailer { background-color: #3498db; color: #ffffff; padding: 5px 10px; border-radius: 15px; font-size: 12px; display: inline-block; }
+        .image { width: 100%; max-width: 200px; height: auto; border-radius: 5px; display: block; margin: 10px 0; }
+        .name { font-size: 16px; font-weight: bold; margin: 10px 0; color: #333333; }
+        .price { font-size: 18px; color: #e74c3c; font-weight: bold; }
+        .was { font-size: 13px; color: #7f8c8d; text-decoration: line-through; }
+        .link { color: #3498db; }
+        .muted { color: #7f8c8d; font-size: 12px; }
+        .errors { background-color: #ffeaa7; padding: 15px; border-radius: 5px; margin: 20px 0; }
+        .footer { text-align: center; margin-top: 30px; color: #7f8c8d; font-size: 12px; }
+    """,
+    "tracked": """
+        .body { font-family: Arial, sans-serif; margin: 0; padding: 10px; }
+        .card { border: 1px solid #cccccc; padding: 20px; margin: 0 auto 20px auto; max-width: 400px; border-radius: 8px; text-align: center; }
+        .link { text-decoration: none; color: inherit; }
+        .name { margin: 0 0 10px 0; color: #333333; }
+        .price { font-size: 18px; font-weight: bold; color: #e74c3c; margin: 10px 0; }
+        .retailer { font-size: 12px; color: #666666; margin: 5px 0; }
+        .image { width: 80%; max-width: 300px; height: auto; border-radius: 4px; }
+        .muted { color: #7f8c8d; font-size: 12px; }
+    """,
+}
+
+_RULE = re.compile(r"\.([\w-]+)\s*\{([^}]*)\}")
+
+
+@lru_cache(maxsize=None)
+def inline_styles(template: str) -> Dict[str, str]:
+    """Get a template's ``style="..."`` attributes by class name (computed once per template)."""
+    styles = {}
+    for name, body in _RULE.findall(STYLESHEETS[template]):
+        declarations = [part.strip() for part in body.split(";") if part.strip()]
+        minified = ";".join(re.sub(r"\s*:\s*", ":", decl, count=1) for decl in declarations)
+        styles[name] = f' style="{minified}"'
+    return styles
+
+
+@dataclass
+class EmailContent:
+    """A rendered email body."""
+    html: str
+    text: str
+    shown: int = 0
+    omitted: int = 0
+
+    @property
+    def size(self) -> int:
+        """Body size in bytes (both parts)."""
+        return len(self.html.encode("utf-8")) + len(self.text.encode("utf-8"))
+
+
+def max_message_bytes() -> int:
+    """Get the configured body size budget (0 means unlimited)."""
+    return config.EMAIL_SETTINGS.get("max_message_bytes", 0)
+
+
+def _fit(head: Tuple[str, str], items: List[Tuple[str, str]], tail: Tuple[str, str],
+         note, max_bytes: int) -> EmailContent:
+    """Join the head, as many items as fit in ``max_bytes`` and the tail.
+
+    Args:
+        head: HTML and text before the items
+        items: HTML and text per item, in priority order
+        tail: HTML and text after the items
+        note: ``note(omitted)`` returns the HTML and text telling the reader how many items were left out
+        max_bytes: Body size budget, 0 for no limit
+    """
+    html, text = [head[0]], [head[1]]
+    used = sum(len(part.encode("utf-8")) for part in head + tail)
+    reserve = sum(len(part.encode("utf-8")) for part in note(len(items)))
+    shown = 0
+    for index, (item_html, item_text) in enumerate(items):
+        size = len(item_html.encode("utf-8")) + len(item_text.encode("utf-8"))
+        last = index == len(items) - 1
+        # The last item needs no room for the note
+        if max_bytes and used + size + (0 if last else reserve) > max_bytes and shown:
+            break
+        html.append(item_html)
+        text.append(item_text)
+        used += size
+        shown += 1
+    omitted = len(items) - shown
+    if omitted:
+        note_html, note_text = note(omitted)
+        html.append(note_html)
+        text.append(note_text)
+    html.append(tail[0])
+    text.append(tail[1])
+    return EmailContent("".join(html), "".join(text), shown, omitted)
+
+
+@lru_cache(maxsize=None)
+def _environment():
+    """Get the Jinja environment for the email templates (created once per process)."""
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    class CompactLoader(FileSystemLoader):
+        """Strips indentation and line breaks from HTML templates before they are compiled."""
+
+        def get_source(self, environment, template):
+            source, filename, uptodate = super().get_source(environment, template)
+            if template.endswith(".html"):
+                source = "".join(line.strip() for line in source.splitlines())
+            return source, filename, uptodate
+
+    environment = Environment(
+        loader=CompactLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(["html"]),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=False
+    )
+    # Product images go through the web app's thumbnail cache when it has a public URL
+    environment.filters["thumbnail"] = lambda url: image_cache.images.thumbnail_url(url, absolute=True)
+    environment.filters["money"] = lambda amount: f"{config.EMAIL_SETTINGS.get('currency_symbol', '$')}{amount:.2f}"
+    return environment
+
+
+@lru_cache(maxsize=None)
+def _macros(name: str):
+    """Compile a template and bind its inline styles (once per process)."""
+    from markupsafe import Markup
+
+    stem = name.rsplit(".", 1)[0]
+    styles = {cls: Markup(attr) for cls, attr in inline_styles(stem).items()} if name.endswith(".html") else {}
+    return _environment().get_template(name).make_module({"s": styles})
+
+
+def _render(template: str, section: str, *args) -> Tuple[str, str]:
+    """Render one section of a template's HTML and text versions."""
+    return (str(getattr(_macros(template + ".html"), section)(*args)),
+            str(getattr(_macros(template + ".txt"), section)(*args)))
+
+
+def render_daily_email(products: List[Dict[str, Any]], cache_size: Optional[int] = None,
+                       max_bytes: Optional[int] = None) -> EmailContent:
+    """Render the daily product update.
+
+    Args:
+        products: Scraped products (successful ones are shown as cards, failed ones listed)
+        cache_size: Cached items to mention in the summary, if caching is on
+        max_bytes: Body size budget, defaults to ``max_message_bytes()``
+    """
+    successful = [p for p in products if p['success']]
+    failed = [p for p in products if not p['success']]
+    summary = (f"Total Products: {len(products)} | Successfully Updated: {len(successful)} | "
+               f"Failed: {len(failed)}")
+
+    items = [_render("daily", "product", product) for product in successful]
+    if failed:
+        items.append(_render("daily", "failed", failed))
+    return _fit(_render("daily", "head", datetime.now().strftime("%B %d, %Y"), summary, cache_size), items,
+                _render("daily", "tail", config.VERSION), lambda omitted: _render("daily", "note", omitted),
+                max_message_bytes() if max_bytes is None else max_bytes)
+
+
+def render_tracked_email(heading: str, products: List[Dict[str, Any]],
+                         max_bytes: Optional[int] = None) -> EmailContent:
+    """Render the simple tracked-products email used by the legacy senders.
+
+    Args:
+        heading: Title line
+        products: Dicts with ``name``, ``price``, ``image``, ``url`` and ``retailer``
+        max_bytes: Body size budget, defaults to ``max_message_bytes()``
+    """
+    items = [_render("tracked", "product", product) for product in products]
+    return _fit(_render("tracked", "head", heading), items, _render("tracked", "tail"),
+                lambda omitted: _render("tracked", "note", omitted),
+                max_message_bytes() if max_bytes is None else max_bytes)
+
+
+def build_message(sender: str, recipient: str, subject: str, content: EmailContent) -> MIMEMultipart:
+    """Build a ``multipart/alternative`` message (text first, HTML preferred)."""
+    message = MIMEMultipart("alternative")
+    message["From"] = sender
+    message["To"] = recipient
+    message["Subject"] = subject if subject.isascii() else Header(subject, "utf-8")
+    message.attach(MIMEText(content.text, "plain", _UTF8))
+    message.attach(MIMEText(content.html, "html", _UTF8))
+    return message
+
+
+def address(message: MIMEMultipart, recipient: str) -> MIMEMultipart:
+    """Point a built message at another recipient."""
+    message.replace_header("To", recipient)
+    return message
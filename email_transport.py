@@ -0,0 +1,265 @@
+"""
+Email transports.
+
+Every module that sends email hands finished messages to a transport chosen
+by ``EMAIL_SETTINGS["transport"]`` (or the ``EMAIL_TRANSPORT`` environment
+variable):
+
+- ``smtp``: a new SMTP connection (STARTTLS, or implicit TLS on port 465) per message
+- ``smtp_pool``: a pool of logged-in SMTP connections reused across messages and threads
+- ``maildir`` / ``mbox``: deliver into a local mailbox under ``outbox_path``
+- ``file``: write each message to its own ``.eml`` file under ``outbox_path``
+
+The local sinks need no mail server or credentials, so staging and
+benchmarks can run the whole daily pipeline offline.
+"""
+
+import os
+import queue
+import smtplib
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from email.message import Message
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX = os.path.join("data", "outbox")
+
+# Sender address used by the local sinks when SENDER_EMAIL isn't set
+LOCAL_SENDER = "sale-tracker@localhost"
+
+
+class EmailTransport(ABC):
+    """Delivers finished messages. Transports are safe to share between threads."""
+
+    requires_credentials = False
+
+    @abstractmethod
+    def send(self, sender: str, recipient: str, message: Message):
+        """Deliver one message (raises on failure)."""
+        pass
+
+    def close(self):
+        """Release connections or files."""
+
+    def __enter__(self) -> "EmailTransport":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SMTPTransport(EmailTransport):
+    """Opens a new SMTP connection for every message."""
+
+    requires_credentials = True
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.port == 465:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            server.starttls()
+        if self.username:
+            server.login(self.username, self.password)
+        return server
+
+    @staticmethod
+    def _quit(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def send(self, sender: str, recipient: str, message: Message):
+        server = self._connect()
+        try:
+            server.sendmail(sender, recipient, message.as_string())
+        finally:
+            self._quit(server)
+
+
+class PooledSMTPTransport(SMTPTransport):
+    """Reuses up to ``pool_size`` logged-in SMTP connections.
+
+    A connection is retired after ``max_messages`` messages (providers cap
+    messages per session), and a connection the server closed while idle is
+    replaced transparently.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 timeout: float = 30, pool_size: int = 2, max_messages: int = 100):
+        super().__init__(host, port, username, password, timeout)
+        self.max_messages = max_messages
+        self._idle: "queue.LifoQueue[Tuple[smtplib.SMTP, int]]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def send(self, sender: str, recipient: str, message: Message):
+        payload = message.as_string()
+        with self._slots:
+            try:
+                server, sent = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                server, sent, reused = self._connect(), 0, False
+            try:
+                server.sendmail(sender, recipient, payload)
+            except smtplib.SMTPServerDisconnected:
+                if not reused:
+                    raise
+                # Idle connection was dropped by the server; retry once on a fresh one
+                server, sent = self._connect(), 0
+                try:
+                    server.sendmail(sender, recipient, payload)
+                except Exception:
+                    self._quit(server)
+                    raise
+            except Exception:
+                self._quit(server)
+                raise
+            sent += 1
+            if sent >= self.max_messages:
+                self._quit(server)
+            else:
+                self._idle.put((server, sent))
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(server)
+
+
+class MaildirTransport(EmailTransport):
+    """Delivers into a local Maildir (safe for concurrent writers)."""
+
+    def __init__(self, path: str):
+        import mailbox
+        self.path = path
+        self._box = mailbox.Maildir(path, create=True)
+        self._lock = threading.Lock()
+
+    def send(self, sender: str, recipient: str, message: Message):
+        with self._lock:
+            self._box.add(message)
+
+
+class MboxTransport(EmailTransport):
+    """Appends to a local mbox file, locking it against other processes."""
+
+    def __init__(self, path: str):
+        import mailbox
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._box = mailbox.mbox(path, create=True)
+        self._lock = threading.Lock()
+
+    def send(self, sender: str, recipient: str, message: Message):
+        with self._lock:
+            self._box.lock()
+            try:
+                self._box.add(message)
+                self._box.flush()
+            finally:
+                self._box.unlock()
+
+    def close(self):
+        self._box.close()
+
+
+class FileTransport(EmailTransport):
+    """Writes each message to its own ``.eml`` file."""
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def send(self, sender: str, recipient: str, message: Message):
+        with self._lock:
+            self._count += 1
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._count:06d}.eml"
+        with open(os.path.join(self.path, name), "wb") as f:
+            f.write(message.as_bytes())
+
+
+TRANSPORTS = ("smtp", "smtp_pool", "maildir", "mbox", "file")
+
+
+def transport_kind(settings: Dict[str, Any]) -> str:
+    """Get the configured transport name (``EMAIL_TRANSPORT`` overrides the settings)."""
+    return os.getenv("EMAIL_TRANSPORT") or settings.get("transport", "smtp")
+
+
+def needs_credentials(settings: Dict[str, Any]) -> bool:
+    """Check whether the configured transport logs in to a mail server."""
+    return transport_kind(settings).startswith("smtp")
+
+
+def create_transport(settings: Dict[str, Any], username: Optional[str] = None,
+                     password: Optional[str] = None) -> EmailTransport:
+    """Create the transport selected by an ``EMAIL_SETTINGS`` dict.
+
+    Args:
+        settings: Email settings (``transport``, ``smtp_server``, ``smtp_port``, ``outbox_path``, ...)
+        username: SMTP login
+        password: SMTP password
+    """
+    kind = transport_kind(settings)
+    host = settings.get("smtp_server", "smtp.gmail.com")
+    port = settings.get("smtp_port", 587)
+    timeout = settings.get("smtp_timeout", 30)
+    outbox = settings.get("outbox_path", DEFAULT_OUTBOX)
+
+    if kind == "smtp":
+        return SMTPTransport(host, port, username, password, timeout)
+    if kind == "smtp_pool":
+        return PooledSMTPTransport(host, port, username, password, timeout,
+                                   pool_size=settings.get("pool_size", 2),
+                                   max_messages=settings.get("pool_max_messages", 100))
+    if kind == "maildir":
+        return MaildirTransport(outbox)
+    if kind == "mbox":
+        return MboxTransport(os.path.join(outbox, "outbox.mbox"))
+    if kind == "file":
+        return FileTransport(outbox)
+    raise ValueError(f"Unknown email transport '{kind}' (expected one of: {', '.join(TRANSPORTS)})")
+
+
+_shared: Dict[Tuple, EmailTransport] = {}
+_shared_lock = threading.Lock()
+
+
+def get_transport(settings: Dict[str, Any], username: Optional[str] = None,
+                  password: Optional[str] = None) -> EmailTransport:
+    """Get a process-wide transport for these settings, so pooled connections are reused."""
+    key = (transport_kind(settings), settings.get("smtp_server"), settings.get("smtp_port"),
+           settings.get("outbox_path", DEFAULT_OUTBOX), username, password)
+    with _shared_lock:
+        transport = _shared.get(key)
+        if transport is None:
+            transport = _shared[key] = create_transport(settings, username, password)
+        return transport
+
+
+def close_transports():
+    """Close every shared transport (e.g. at the end of a run or in tests)."""
+    with _shared_lock:
+        transports = list(_shared.values())
+        _shared.clear()
+    for transport in transports:
+        transport.close()
@@ -0,0 +1,336 @@
+"""
+Product image proxy and thumbnail cache.
+
+Retailer images (``og:image``) are full-size and hot-linked, so every email
+open and dashboard view pulls hundreds of KB from the retailer's CDN. Instead,
+product images are referenced through the web app as ``/images/<key>``, where
+the key is derived from the image's canonical URL:
+
+- The first request for a key downloads the image once and stores a small
+  thumbnail (longest side ``thumbnail_size`` px, when Pillow is installed;
+  otherwise the image as downloaded). Later requests are served from disk
+  with long-lived cache headers.
+- Files are content-addressed (named by the SHA-256 of their bytes), so the
+  same picture behind several URLs is stored once.
+- Once the cache grows past ``max_cache_bytes``, the least recently served
+  images are evicted and fetched again on their next request.
+
+Only URLs that were registered by the app itself (scrape results, emails)
+are fetched, so the route can't be used as an open proxy.
+"""
+
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import config_enhanced as config
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DIR = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "images"
+)
+
+_KEY = re.compile(r"^[0-9a-f]{32}$")
+
+# Keys remembered as registered before the memo is reset (they're re-inserted with INSERT OR IGNORE)
+_REGISTERED_MEMO_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    digest TEXT,
+    content_type TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    fetched_at REAL,
+    last_access REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_images_access ON images (last_access);
+CREATE INDEX IF NOT EXISTS idx_images_digest ON images (digest);
+"""
+
+
+def canonical_image_url(url: str) -> str:
+    """Normalise an image URL (lower-case scheme/host, sorted query, no fragment)."""
+    parsed = urlparse(url.strip())
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(),
+                           query=query, fragment="").geturl()
+
+
+def image_key(url: str) -> str:
+    """Get the cache key for an image URL."""
+    return hashlib.sha256(canonical_image_url(url).encode("utf-8")).hexdigest()[:32]
+
+
+class ImageCache:
+    """On-disk, content-addressed cache of product thumbnails."""
+
+    def __init__(self, directory: Optional[str] = None, settings: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            directory: Cache directory (files and index); defaults to ``data/images``
+            settings: Overrides for ``config.IMAGE_SETTINGS``
+        """
+        self.directory = directory or IMAGE_DIR
+        self.settings = dict(config.IMAGE_SETTINGS)
+        self.settings.update(settings or {})
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._registered = set()
+        # Key -> [lock, number of requests holding or waiting for it]; dropped when the last one leaves
+        self._fetch_locks: Dict[str, List[Any]] = {}
+        self._fetch_locks_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, "index.db"), check_same_thread=False,
+                                   timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    # URLs
+
+    def register(self, url: str) -> Optional[str]:
+        """Allow an image URL to be served through the cache.
+
+        Returns:
+            The image's key, or None for empty or non-HTTP URLs
+        """
+        if not url or urlparse(url).scheme not in ("http", "https"):
+            return None
+        key = image_key(url)
+        if key not in self._registered:
+            with self._db_lock:
+                self._connection().execute("INSERT OR IGNORE INTO images (key, url) VALUES (?, ?)", (key, url))
+            if len(self._registered) >= _REGISTERED_MEMO_SIZE:
+                self._registered.clear()
+            self._registered.add(key)
+        return key
+
+    def thumbnail_url(self, url: str, absolute: bool = False) -> str:
+        """Get the URL to show instead of a product image.
+
+        Args:
+            url: Original image URL
+            absolute: Prefix ``public_base_url`` (for emails). Without one configured the
+                original URL is returned, as the mail client couldn't reach a relative link.
+
+        Returns:
+            ``/images/<key>`` (or its absolute form), or ``url`` unchanged when the cache is off
+        """
+        base = (os.getenv("PUBLIC_BASE_URL") or self.settings.get("public_base_url") or "").rstrip("/")
+        if not self.settings.get("enabled", True) or (absolute and not base):
+            return url
+        key = self.register(url)
+        if key is None:
+            return url
+        return f"{base if absolute else ''}/images/{key}"
+
+    # Serving
+
+    def get(self, key: str) -> Optional[Tuple[str, str, str]]:
+        """Get a registered image, downloading it on first use.
+
+        Returns:
+            ``(path, content_type, digest)``, or None if the key is unknown or the image can't be fetched
+        """
+        if not _KEY.match(key):
+            return None
+        row = self._row(key)
+        if row is None:
+            return None
+        if row['digest'] is None or not os.path.exists(self._path(row['digest'])):
+            # One download per key at a time; concurrent requests wait for it
+            with self._fetch_lock(key):
+                row = self._row(key)
+                if row['digest'] is None or not os.path.exists(self._path(row['digest'])):
+                    retry_after = self.settings.get("retry_after", 3600)
+                    if row['error'] and row['fetched_at'] and time.time() - row['fetched_at'] < retry_after:
+                        return None
+                    row = self._fetch(key, row['url'])
+                    if row is None:
+                        return None
+        now = time.time()
+        if row['last_access'] is None or now - row['last_access'] > 60:
+            with self._db_lock:
+                self._connection().execute("UPDATE images SET last_access = ? WHERE key = ?", (now, key))
+        return self._path(row['digest']), row['content_type'], row['digest']
+
+    @contextmanager
+    def _fetch_lock(self, key: str) -> Iterator[None]:
+        """Hold the download lock for ``key``, forgetting it once no request needs it."""
+        with self._fetch_locks_lock:
+            entry = self._fetch_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._fetch_locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._fetch_locks[key]
+
+    def _row(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            cursor = self._connection().execute(
+                "SELECT url, digest, content_type, fetched_at, last_access, error FROM images WHERE key = ?", (key,)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(('url', 'digest', 'content_type', 'fetched_at', 'last_access', 'error'), row))
+
+    def _fetch(self, key: str, url: str) -> Optional[Dict[str, Any]]:
+        """Download, shrink and store an image, recording failures so they aren't retried straight away."""
+        try:
+            data, content_type = self._download(url)
+            data, content_type = self._thumbnail(data, content_type)
+        except Exception as e:
+            logger.warning(f"Failed to fetch product image {url}: {e}")
+            with self._db_lock:
+                self._connection().execute("UPDATE images SET error = ?, fetched_at = ? WHERE key = ?",
+                                           (str(e), time.time(), key))
+            return None
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+        now = time.time()
+        with self._db_lock:
+            self._connection().execute(
+                "UPDATE images SET digest = ?, content_type = ?, size = ?, fetched_at = ?, last_access = ?, "
+                "error = NULL WHERE key = ?",
+                (digest, content_type, len(data), now, now, key)
+            )
+        logger.debug(f"Cached product image {url} ({len(data)} bytes)")
+        self.evict()
+        return {'url': url, 'digest': digest, 'content_type': content_type, 'fetched_at': now,
+                'last_access': now, 'error': None}
+
+    def _download(self, url: str) -> Tuple[bytes, str]:
+        import requests  # Deferred: only needed on a cache miss
+
+        limit = self.settings.get("max_download_bytes", 5 * 1024 * 1024)
+        response = requests.get(url, timeout=self.settings.get("timeout", 10), stream=True,
+                                headers={"User-Agent": config.SCRAPING_SETTINGS["user_agent"]})
+        try:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if not content_type.startswith("image/"):
+                raise ValueError(f"Not an image ({content_type or 'no content type'})")
+            chunks, size = [], 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > limit:
+                    raise ValueError(f"Image larger than {limit} bytes")
+                chunks.append(chunk)
+        finally:
+            response.close()
+        return b"".join(chunks), content_type
+
+    def _thumbnail(self, data: bytes, content_type: str) -> Tuple[bytes, str]:
+        """Shrink an image to ``thumbnail_size`` (JPEG, or PNG if it has transparency).
+
+        Without Pillow, or for formats it can't read (e.g. SVG), the image is kept as downloaded.
+        """
+        try:
+            from PIL import Image
+        except ImportError:
+            return data, content_type
+
+        size = self.settings.get("thumbnail_size", 300)
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.thumbnail((size, size))
+                out = io.BytesIO()
+                if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+                    image.save(out, "PNG", optimize=True)
+                    thumbnail = out.getvalue(), "image/png"
+                else:
+                    image.convert("RGB").save(out, "JPEG", quality=self.settings.get("thumbnail_quality", 80),
+                                              optimize=True, progressive=True)
+                    thumbnail = out.getvalue(), "image/jpeg"
+        except Exception as e:
+            logger.debug(f"Keeping image as downloaded, couldn't make a thumbnail: {e}")
+            return data, content_type
+        # Already small images may not shrink any further
+        return thumbnail if len(thumbnail[0]) < len(data) else (data, content_type)
+
+    # Maintenance
+
+    def evict(self) -> int:
+        """Drop the least recently served images until the cache fits ``max_cache_bytes``.
+
+        Returns:
+            Number of images evicted
+        """
+        limit = self.settings.get("max_cache_bytes", 200 * 1024 * 1024)
+        with self._db_lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT digest, MAX(size), MAX(COALESCE(last_access, 0)) FROM images "
+                "WHERE digest IS NOT NULL GROUP BY digest ORDER BY 3"
+            ).fetchall()
+            total = sum(row[1] for row in rows)
+            if total <= limit:
+                return 0
+            target = limit * 0.9  # Leave some headroom so every new image doesn't evict again
+            evicted = []
+            for digest, size, _ in rows:
+                if total <= target:
+                    break
+                conn.execute("UPDATE images SET digest = NULL, size = 0 WHERE digest = ?", (digest,))
+                evicted.append(digest)
+                total -= size
+        for digest in evicted:
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+        logger.info(f"Evicted {len(evicted)} product images from the cache")
+        return len(evicted)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the number of registered and stored images and the bytes on disk."""
+        with self._db_lock:
+            registered, stored, total = self._connection().execute(
+                "SELECT COUNT(*), COUNT(DISTINCT digest), "
+                "(SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM images "
+                "WHERE digest IS NOT NULL GROUP BY digest)) FROM images"
+            ).fetchone()
+        return {
+            'registered': registered,
+            'stored': stored,
+            'bytes': total,
+            'max_bytes': self.settings.get("max_cache_bytes", 200 * 1024 * 1024)
+        }
+
+
+# Global image cache (connects on first use)
+images = ImageCache()
@@ -0,0 +1,496 @@
+"""
+Background job queue for long-running scrape and email work.
+
+Jobs run on a small pool of in-process worker threads so web requests can
+return immediately. Every job is also written to a SQLite job table, which
+lets any web process report its status and lets concurrent requests for the
+same work (e.g. two scrapes, or a retried cron call) share one running job.
+Per-item results are appended to their own table as they land, so a job
+with thousands of results doesn't rewrite all of them for each new one.
+"""
+
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import config_enhanced as config
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "jobs.db"
+)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    total INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    results TEXT,
+    result TEXT,
+    error TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_key_status ON jobs (key, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+_COLUMNS = ("id", "kind", "key", "owner", "status", "created_at", "started_at", "finished_at",
+            "total", "done", "results", "result", "error", "heartbeat_at")
+
+
+def _owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: str) -> bool:
+    """Check whether the process that owns a job is still running."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True  # Can't tell for other hosts; assume alive
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _interrupted(owner: str, heartbeat_at: Optional[float], now: float) -> Optional[str]:
+    """Tell why an active job can no longer finish, or None if its owner may still be running it.
+
+    Owners refresh ``heartbeat_at`` while a job is queued or running, so a job
+    whose heartbeat is older than ``JOB_SETTINGS["heartbeat_timeout"]`` is
+    given up on even when its owner's host is gone (e.g. a redeployed
+    container) or its PID has been reused.
+    """
+    if heartbeat_at is None or heartbeat_at < now - config.JOB_SETTINGS.get("heartbeat_timeout", 120):
+        return "Interrupted (worker stopped responding)"
+    if not _owner_alive(owner):
+        return "Interrupted (worker exited)"
+    return None
+
+
+class Job:
+    """A unit of background work and its progress."""
+
+    def __init__(self, manager: "JobManager", job_id: str, kind: str, key: Optional[str],
+                 fn: Callable[["Job"], Any]):
+        self.manager = manager
+        self.id = job_id
+        self.kind = kind
+        self.key = key
+        self.fn = fn
+        self.owner = _owner_id()
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.total = 0
+        self.done = 0
+        self.results: List[Dict[str, Any]] = []
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.lock = threading.Lock()
+        # Bumped on every change so followers can wait without polling
+        self.version = 0
+        self.changed = threading.Condition()
+
+    def _notify(self):
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def wait_for_change(self, seen_version: int, timeout: float) -> int:
+        """Block until the job changes after ``seen_version`` (or timeout); returns the new version."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != seen_version, timeout=timeout)
+            return self.version
+
+    def set_total(self, total: int):
+        """Set the number of items (e.g. URLs) this job will process."""
+        with self.lock:
+            self.total = total
+        self.manager._save(self)
+        self._notify()
+
+    def add_result(self, result: Dict[str, Any]):
+        """Record one per-item result (e.g. a scraped product) as it completes."""
+        item = {
+            'url': result.get('url'),
+            'retailer': result.get('retailer'),
+            'name': result.get('name'),
+            'price': result.get('price'),
+            'image': result.get('image', ''),
+            'timestamp': result.get('timestamp'),
+            'success': result.get('success', False)
+        }
+        with self.lock:
+            self.results.append(item)
+            self.done = len(self.results)
+            self.total = max(self.total, self.done)
+            seq, done, total = self.done - 1, self.done, self.total
+        self.manager._append_result(self, seq, item, done, total)
+        self._notify()
+
+    def to_row(self) -> Tuple:
+        """Get the job table row; results are stored separately, in ``job_results``."""
+        with self.lock:
+            return (self.id, self.kind, self.key, self.owner, self.status, self.created_at, self.started_at,
+                    self.finished_at, self.total, self.done, None,
+                    json.dumps(self.result, default=str), self.error, time.time())  # Every save is a heartbeat
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            results = list(self.results)
+        return _row_to_dict(self.to_row(), results)
+
+
+def _row_to_dict(row: Tuple, results: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    job = dict(zip(_COLUMNS, row))
+    if results is None:
+        # Jobs saved before results had their own table kept them in the row
+        results = json.loads(job['results']) if job['results'] else []
+    job['results'] = results
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    end = job['finished_at'] or (time.time() if job['started_at'] else None)
+    job['duration'] = round(end - job['started_at'], 3) if job['started_at'] and end else None
+    job['progress'] = {
+        'done': job.pop('done'),
+        'total': job.pop('total')
+    }
+    job.pop('owner')
+    job.pop('heartbeat_at')
+    return job
+
+
+class JobManager:
+    """In-process job queue with a persisted job table."""
+
+    def __init__(self, db_path: Optional[str] = None, workers: Optional[int] = None):
+        self.db_path = db_path
+        self.workers = workers or config.JOB_SETTINGS.get("workers", 2)
+        self._queue: "queue.Queue[Job]" = queue.Queue()
+        self._jobs: Dict[str, Job] = {}
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.db_path or JOBS_DB
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            if "heartbeat_at" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")  # Files from before heartbeats
+            self._conn = conn
+            self._recover_orphans()
+        return self._conn
+
+    def _recover_orphans(self):
+        """Fail jobs left active by processes that exited or stopped sending heartbeats."""
+        rows = self._conn.execute(
+            "SELECT id, owner, heartbeat_at FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES
+        ).fetchall()
+        self._fail_interrupted(self._conn, rows)
+
+    @staticmethod
+    def _fail_interrupted(conn: sqlite3.Connection, rows: List[Tuple[str, str, Optional[float]]]) -> List[str]:
+        """Mark the interrupted jobs among (id, owner, heartbeat_at) rows as failed; returns their ids."""
+        now = time.time()
+        interrupted = []
+        for job_id, owner, heartbeat_at in rows:
+            reason = _interrupted(owner, heartbeat_at, now)
+            if reason:
+                interrupted.append((reason, now, job_id))
+        if interrupted:
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?", interrupted
+            )
+            logger.warning(f"Marked {len(interrupted)} interrupted jobs as failed")
+        return [job_id for _, _, job_id in interrupted]
+
+    def _beat(self):
+        """Refresh the heartbeat of this process's queued and running jobs."""
+        while True:
+            time.sleep(config.JOB_SETTINGS.get("heartbeat_interval", 30))
+            with self._lock:
+                job_ids = list(self._jobs)
+            if not job_ids:
+                continue
+            try:
+                with self._db_lock:
+                    self._connection().executemany(
+                        "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status IN (?, ?)",
+                        [(time.time(), job_id, *ACTIVE_STATUSES) for job_id in job_ids]
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to refresh job heartbeats: {e}")
+
+    def _save(self, job: Job):
+        row = job.to_row()
+        with self._db_lock:
+            self._connection().execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                row
+            )
+
+    def _append_result(self, job: Job, seq: int, item: Dict[str, Any], done: int, total: int):
+        """Store one new result and the job's progress, without rewriting earlier results."""
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT OR REPLACE INTO job_results (job_id, seq, result) VALUES (?, ?, ?)",
+                             (job.id, seq, json.dumps(item)))
+                conn.execute("UPDATE jobs SET done = ?, total = ? WHERE id = ?", (done, total, job.id))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _stored_dict(self, row: Tuple) -> Dict[str, Any]:
+        """Build a job dict from its table row plus its rows in ``job_results`` (call holding ``_db_lock``)."""
+        results = [json.loads(result) for (result,) in self._connection().execute(
+            "SELECT result FROM job_results WHERE job_id = ? ORDER BY seq", (row[0],)
+        )]
+        return _row_to_dict(row, results or None)
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+                self._heartbeat.start()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job):
+        with job.lock:
+            job.status = "running"
+            job.started_at = time.time()
+        self._save(job)
+        logger.info(f"Job {job.id} ({job.kind}) started")
+
+        try:
+            result = job.fn(job)
+            with job.lock:
+                job.result = result
+                job.status = "succeeded"
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            with job.lock:
+                job.error = str(e)
+                job.status = "failed"
+        finally:
+            with job.lock:
+                job.finished_at = time.time()
+            self._save(job)
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            job._notify()
+            logger.info(f"Job {job.id} ({job.kind}) {job.status} in {job.finished_at - job.started_at:.2f}s")
+
+    def submit(self, kind: str, fn: Callable[[Job], Any], key: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """Queue work, or join an identical job that is already queued or running.
+
+        Args:
+            kind: Job type, e.g. "scrape" or "daily_email"
+            fn: Work to run; receives the Job to report progress
+            key: Coalescing key; defaults to ``kind``
+
+        Returns:
+            Tuple of (job status dict, created) where created is False when an
+            existing active job with the same key was returned instead
+        """
+        key = key or kind
+        job = Job(self, uuid.uuid4().hex, kind, key, fn)
+
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY created_at",
+                    (key, *ACTIVE_STATUSES)
+                ).fetchall()
+                interrupted = self._fail_interrupted(conn, [
+                    (row[0], row[_COLUMNS.index("owner")], row[_COLUMNS.index("heartbeat_at")]) for row in rows
+                ])
+                for row in rows:
+                    if row[0] not in interrupted:
+                        existing = self._stored_dict(row)
+                        conn.execute("COMMIT")
+                        return existing, False
+
+                conn.execute(
+                    f"INSERT OR REPLACE INTO jobs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    job.to_row()
+                )
+                cutoff = time.time() - config.JOB_SETTINGS.get("retention_days", 7) * 86400
+                conn.execute(
+                    "DELETE FROM job_results WHERE job_id IN "
+                    "(SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?)",
+                    (cutoff,)
+                )
+                conn.execute(
+                    "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                    (cutoff,)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        with self._lock:
+            self._jobs[job.id] = job
+        self._ensure_workers()
+        self._queue.put(job)
+        logger.info(f"Job {job.id} ({kind}) queued")
+        return job.to_dict(), True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job's status, progress, duration and per-item results."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        with self._db_lock:
+            row = self._connection().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            return self._stored_dict(row) if row else None
+
+    def get_results(self, job_id: str, start: int = 0) -> List[Dict[str, Any]]:
+        """Get a job's per-item results from position ``start`` on, without loading earlier ones."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            with job.lock:
+                return job.results[start:]
+        with self._db_lock:
+            conn = self._connection()
+            results = [json.loads(result) for (result,) in conn.execute(
+                "SELECT result FROM job_results WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, start)
+            )]
+            if results:
+                return results
+            # Jobs saved before results had their own table kept them in the row
+            row = conn.execute("SELECT results FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return json.loads(row[0])[start:] if row and row[0] else []
+
+    def _status(self, job_id: str) -> Optional[str]:
+        """Get just a job's status (None if there is no such job)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            with job.lock:
+                return job.status
+        with self._db_lock:
+            row = self._connection().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return row[0] if row else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until a job finishes (mainly for CLI use and tests)."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] not in ACTIVE_STATUSES:
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return job
+            time.sleep(0.05)
+
+    def follow(self, job_id: str, poll_interval: float = 0.5,
+               timeout: Optional[float] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield a job's per-item results as they land, then its final state.
+
+        Jobs running in this process wake followers as soon as a result is
+        added; jobs owned by another process are followed by polling the job
+        table. Late followers first receive every result recorded so far.
+        Each wake reads only the job's status and the results past those
+        already yielded; the full job is loaded once, when it ends.
+
+        Yields:
+            ("result", item) for each per-item result, then ("done", job)
+            once the job finishes, or ("timeout", job) if ``timeout`` passes
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        sent = 0
+        version = -1
+        while True:
+            with self._lock:
+                local = self._jobs.get(job_id)
+            if local is not None:
+                version = local.version
+            # Read the status first so a finished job's results are all in by the time they're read
+            status = self._status(job_id)
+            if status is None:
+                return
+
+            for item in self.get_results(job_id, sent):
+                yield "result", item
+                sent += 1
+
+            if status not in ACTIVE_STATUSES:
+                yield "done", self.get(job_id)
+                return
+            if deadline is not None and time.time() >= deadline:
+                yield "timeout", self.get(job_id)
+                return
+
+            if local is not None:
+                local.wait_for_change(version, poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+    def list_recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """List the most recent jobs, newest first."""
+        with self._db_lock:
+            rows = self._connection().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+            return [self._stored_dict(row) for row in rows]
+
+
+# Global job manager (connects and starts workers on first use)
+job_manager = JobManager()
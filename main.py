@@ -1,6 +1,3 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
 import schedule
@@ -9,6 +6,8 @@ import requests
 from bs4 import BeautifulSoup
 import json
 import sys
+import email_builder
+import email_transport
 
 load_dotenv()  # Load EMAIL credentials from .env file
 
@@ -66,58 +65,26 @@ def send_combined_email():
                 name, price, image = scrape_lululemon(link)
             elif company == "nike":
                 name, price, image = scrape_nike(link)
-            all_products_info.append((name, price, image, link))
+            all_products_info.append((name, price, image, link, company))
             prices_for_subject.append(price.replace("USD", "").strip())
 
     # Compose email
-    message = MIMEMultipart()
-    message['From'] = sender_email
-    message['To'] = ", ".join(recipient_emails)
-
     subject_prices = f"{prices_for_subject[0]}/228, {prices_for_subject[1]}/168, {prices_for_subject[2]}/110" 
-    message['Subject'] = f"{subject_prices} – Your Tracked Products"
-
-    # Build email body
-    html_lines = [
-    "<html><body>",
-    "<h2>Here are your tracked products:</h2>"
-    ]
-
-    for name, price, image, link in all_products_info:
-        # Try to get product image from link preview (via Open Graph)
-        card = f"""
-        <div style="width: 100%; text-align: center;">
-            <div style="
-                display: inline-block;
-                border: 1px solid #ccc;
-                padding: 20px;
-                margin-bottom: 20px;
-                max-width: 400px;     
-            ">
-                <a href="{link}" target="_blank"; style="text-decoration: none;">
-                    <h2>{name}</h2>
-                    <p>{price}</p>
-                    <img src="{image}" alt="{name}" style="width: 50%; height: 50%; border: none;" />
-                </a>
-            </div>
-        </div>
-        """
-
-        html_lines.append(card)
-
-    html_lines.append("</body></html>")
-    html_body = "\n".join(html_lines)
-    message.attach(MIMEText(html_body, 'html'))
+    content = email_builder.render_tracked_email(
+        "Here are your tracked products:",
+        [{'name': name, 'price': price, 'image': image, 'url': link, 'retailer': company}
+         for name, price, image, link, company in all_products_info]
+    )
+    message = email_builder.build_message(sender_email, ", ".join(recipient_emails),
+                                          f"{subject_prices} – Your Tracked Products", content)
 
 
     # Send email
     try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        for recipient in recipient_emails:
-            server.sendmail(sender_email, recipient, message.as_string())
-        server.quit()
+        settings = {"smtp_server": "smtp.gmail.com", "smtp_port": 587}
+        with email_transport.create_transport(settings, sender_email, sender_password) as transport:
+            for recipient in recipient_emails:
+                transport.send(sender_email, recipient, message)
         print("Combined email sent successfully.")
     except Exception as e:
         print("Failed to send combined email:", e)
@@ -2,26 +2,33 @@
 Enhanced Sale Tracker with new retailer framework and performance improvements.
 """
 
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
-from dotenv import load_dotenv
-import schedule
 import time
 import sys
 import logging
-from datetime import datetime
-from typing import List, Tuple, Optional, Dict, Any
+from datetime import date, datetime
+from typing import List, Tuple, Optional, Dict, Any, Callable
 import json
 
 # Import the new retailer framework
-from retailers import registry
+from retailers import registry, LatencyHistogram, tracer
+from retailers.metrics import ThreadShards
 import config_enhanced as config
 import recipients_store
 import subscriptions_store
+import price_history
+import price_alerts
+import refresh_scheduler
+import openmetrics
+import delivery_ledger
+import outbound
+import email_builder
+import email_transport
+import image_cache
+from profiling import profiler
+from work_queue import work_queue, DONE_STAGE, LeaseLost, RunIncomplete
 
-# Set up enhanced logging
+# Set up enhanced logging (called by entry points, not on import)
 def setup_logging():
     """Set up enhanced logging with rotation and structured format."""
     log_level = getattr(logging, config.PERFORMANCE_SETTINGS.get("log_level", "INFO"))
@@ -63,60 +70,85 @@ def setup_logging():
         force=True
     )
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 # Performance tracking
 class PerformanceMetrics:
-    """Simple performance metrics tracking."""
+    """Simple performance metrics tracking.
+    
+    Safe for concurrent use: each thread counts into its own accumulator and
+    the accumulators are only summed when metrics are read, so recording never
+    contends on a shared lock. A thread's counts are folded into a retired
+    total when it exits. Scrape durations go into a latency histogram,
+    so recording is O(1) and percentiles cover every scrape, not a window.
+    """
+    
+    COUNTERS = ('scrapes_total', 'scrapes_successful', 'scrapes_failed', 'emails_sent', 'cache_hits', 'cache_misses')
     
     def __init__(self):
-        self.metrics = {
-            'scrapes_total': 0,
-            'scrapes_successful': 0,
-            'scrapes_failed': 0,
-            'emails_sent': 0,
-            'cache_hits': 0,
-            'cache_misses': 0,
-            'avg_scrape_time': 0.0,
-            'last_updated': datetime.now()
-        }
-        self.scrape_times = []
+        self._accumulators: ThreadShards[Dict[str, float]] = ThreadShards(
+            lambda: dict.fromkeys(self.COUNTERS, 0), lambda a, b: {name: a[name] + b[name] for name in a})
+        self.scrape_times = LatencyHistogram()
+        self.last_updated = datetime.now()
+    
+    def _counts(self) -> Dict[str, float]:
+        """Get the calling thread's accumulator, creating it on first use."""
+        return self._accumulators.local()
     
     def record_scrape(self, success: bool, duration: float):
         """Record a scraping operation."""
-        self.metrics['scrapes_total'] += 1
+        counts = self._counts()
+        counts['scrapes_total'] += 1
         if success:
-            self.metrics['scrapes_successful'] += 1
+            counts['scrapes_successful'] += 1
         else:
-            self.metrics['scrapes_failed'] += 1
-        
-        self.scrape_times.append(duration)
-        # Keep only last 100 measurements for rolling average
-        if len(self.scrape_times) > 100:
-            self.scrape_times.pop(0)
+            counts['scrapes_failed'] += 1
         
-        self.metrics['avg_scrape_time'] = sum(self.scrape_times) / len(self.scrape_times)
-        self.metrics['last_updated'] = datetime.now()
+        self.scrape_times.record(duration)
+        self.last_updated = datetime.now()
     
     def record_email_sent(self):
         """Record an email sent."""
-        self.metrics['emails_sent'] += 1
-        self.metrics['last_updated'] = datetime.now()
+        self._counts()['emails_sent'] += 1
+        self.last_updated = datetime.now()
     
     def get_metrics(self) -> Dict[str, Any]:
         """Get current metrics."""
-        return self.metrics.copy()
+        accumulators = self._accumulators.snapshot()
+        result = {name: sum(counts[name] for counts in accumulators) for name in self.COUNTERS}
+        latency = self.scrape_times.summary()
+        result['avg_scrape_time'] = latency['mean'] or 0.0
+        result['scrape_latency'] = latency
+        result['last_updated'] = self.last_updated
+        return result
 
 # Global metrics instance
 metrics = PerformanceMetrics() if config.PERFORMANCE_SETTINGS.get("enable_metrics") else None
 
+# Chrome trace files for runs recorded with PERFORMANCE_SETTINGS["enable_tracing"]
+TRACE_DIRECTORY = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "traces"
+)
+
+
+def trace_run(name: str):
+    """Record a run's spans to a Chrome trace file when tracing is enabled.
+    
+    Use as ``with trace_run("daily_email") as run: ...``; ``run.path`` is the
+    written trace file, or None when tracing is off.
+    """
+    return tracer.recording(name, TRACE_DIRECTORY, enabled=config.PERFORMANCE_SETTINGS.get("enable_tracing", False))
+
+
+# Exports this process's metrics for /metrics (merged across processes)
+exporter = openmetrics.MetricsExporter(performance=metrics)
+
 
 def get_email_credentials() -> Tuple[str, str, List[str]]:
     """Get email credentials from environment variables with fallbacks."""
+    config.load_env()
     sender_email = os.getenv("SENDER_EMAIL")
     email_password = os.getenv("EMAIL_PASSWORD")
     
@@ -140,8 +172,15 @@ def get_email_credentials() -> Tuple[str, str, List[str]]:
     return sender_email, email_password, recipients
 
 
-def scrape_products_enhanced(product_links: Optional[Dict[str, List[str]]] = None) -> List[Dict[str, Any]]:
-    """Enhanced product scraping using the new retailer framework."""
+@tracer.traced()
+def scrape_products_enhanced(product_links: Optional[Dict[str, List[str]]] = None,
+                             on_result: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+    """Enhanced product scraping using the new retailer framework.
+    
+    Args:
+        product_links: Product URLs grouped by retailer, defaults to config.PRODUCT_LINKS
+        on_result: Called with each product result as soon as it is scraped
+    """
     if product_links is None:
         product_links = config.PRODUCT_LINKS
     
@@ -153,25 +192,34 @@ def scrape_products_enhanced(product_links: Optional[Dict[str, List[str]]] = Non
     
     logger.info(f"Scraping {len(all_urls)} products using enhanced retailer framework")
     
+    def add_thumbnail(result: Dict[str, Any]):
+        # Dashboards show the cached thumbnail instead of the retailer's full-size image
+        result['thumbnail'] = image_cache.images.thumbnail_url(result.get('image', ''))
+        if on_result:
+            on_result(result)
+    
     # Use the retailer registry to scrape all products
     start_time = time.time()
     results = registry.scrape_multiple(
         all_urls,
         use_cache=config.SCRAPING_SETTINGS.get("enable_cache", True),
-        delay=config.SCRAPING_SETTINGS.get("rate_limit_delay", 1.0)
+        delay=config.SCRAPING_SETTINGS.get("rate_limit_delay", 1.0),
+        on_result=add_thumbnail
     )
     end_time = time.time()
     
     # Record metrics
     if metrics:
-        total_duration = end_time - start_time
-        successful = sum(1 for r in results if r['success'])
-        failed = len(results) - successful
-        
-        for _ in range(successful):
-            metrics.record_scrape(True, total_duration / len(results))
-        for _ in range(failed):
-            metrics.record_scrape(False, total_duration / len(results))
+        for result in results:
+            metrics.record_scrape(result['success'], result.get('duration', 0.0))
+    
+    # Keep every outcome in the price history
+    if config.STORAGE_SETTINGS.get("enable_price_history", True):
+        try:
+            with tracer.span("record_price_history", results=len(results)):
+                price_history.history.record_results(results)
+        except Exception as e:
+            logger.warning(f"Failed to record price history: {e}")
     
     logger.info(f"Scraping completed in {end_time - start_time:.2f}s. "
                 f"Success: {sum(1 for r in results if r['success'])}, "
@@ -185,105 +233,182 @@ def scrape_products_enhanced(product_links: Optional[Dict[str, List[str]]] = Non
     return results
 
 
-def create_enhanced_email_content(products: List[Dict[str, Any]], recipient: str) -> str:
-    """Create enhanced HTML email content."""
-    current_date = datetime.now().strftime("%B %d, %Y")
-    successful_products = [p for p in products if p['success']]
-    failed_products = [p for p in products if not p['success']]
-    
-    html_content = f"""
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }}
-            .container {{ max-width: 800px; margin: 0 auto; background-color: white; padding: 20px; border-radius: 10px; }}
-            .header {{ background-color: #2c3e50; color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }}
-            .product-grid {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); gap: 20px; margin: 20px 0; }}
-            .product-card {{ border: 1px solid #ddd; border-radius: 8px; padding: 15px; background-color: #fafafa; }}
-            .product-image {{ width: 100%; max-width: 200px; height: auto; border-radius: 5px; }}
-            .product-name {{ font-size: 16px; font-weight: bold; margin: 10px 0; color: #333; }}
-            .product-price {{ font-size: 18px; color: #e74c3c; font-weight: bold; }}
-            .product-retailer {{ background-color: #3498db; color: white; padding: 5px 10px; border-radius: 15px; font-size: 12px; display: inline-block; margin-top: 5px; }}
-            .footer {{ text-align: center; margin-top: 30px; color: #7f8c8d; font-size: 12px; }}
-            .metrics {{ background-color: #ecf0f1; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-            .error-section {{ background-color: #ffeaa7; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🛍️ Your Daily Product Updates</h1>
-                <p>{current_date}</p>
-            </div>
-            
-            <p>Hi there! Here's your daily product price update.</p>
-            
-            <div class="metrics">
-                <h3>📊 Summary</h3>
-                <p><strong>Total Products:</strong> {len(products)} | <strong>Successfully Updated:</strong> {len(successful_products)} | <strong>Failed:</strong> {len(failed_products)}</p>
-                {f"<p><strong>Cache Hits:</strong> {registry.get_cache_stats()['size']} items cached</p>" if registry.get_cache_stats()['enabled'] else ""}
-            </div>
+def collect_product_links() -> Dict[str, List[str]]:
+    """Merge the configured product links with every subscribed product URL."""
+    product_links = {retailer: list(urls) for retailer, urls in config.PRODUCT_LINKS.items()}
+    seen = {registry.canonical_url(url) for urls in product_links.values() for url in urls}
+    
+    for entries in subscriptions_store.list_all_subscriptions().values():
+        for entry in entries:
+            url = entry.get('url')
+            if not url or registry.canonical_url(url) in seen:
+                continue
+            seen.add(registry.canonical_url(url))
+            product_links.setdefault(entry.get('company') or 'other', []).append(url)
+    
+    return product_links
+
+
+def _scrape_urls(urls: List[str]) -> List[Dict[str, Any]]:
+    """Scrape a flat list of URLs through the enhanced pipeline."""
+    return scrape_products_enhanced({'refresh': urls})
+
+
+# Global incremental refresh scheduler
+refresher = refresh_scheduler.RefreshScheduler(scrape_fn=_scrape_urls)
+
+
+def sync_refresh_schedule() -> int:
+    """Point the refresh scheduler at every configured, subscribed or historical product."""
+    product_links = collect_product_links()
+    
+    # Configured products are watched by every recipient without subscriptions
+    subscriber_counts: Dict[str, int] = {}
+    for urls in config.PRODUCT_LINKS.values():
+        for url in urls:
+            subscriber_counts[registry.canonical_url(url)] = 1
+    for entries in subscriptions_store.list_all_subscriptions().values():
+        for entry in entries:
+            product_id = registry.canonical_url(entry.get('url', ''))
+            subscriber_counts[product_id] = subscriber_counts.get(product_id, 0) + 1
+    
+    # Products nobody watches any more keep a slow refresh so their history continues
+    if config.STORAGE_SETTINGS.get("enable_price_history", True):
+        known = {registry.canonical_url(url) for urls in product_links.values() for url in urls}
+        for product in price_history.history.list_products():
+            if product['product_id'] not in known:
+                product_links.setdefault(product.get('retailer') or 'other', []).append(product['url'])
+    
+    return refresher.sync(product_links, subscriber_counts)
+
+
+def refresh_due_products() -> List[Dict[str, Any]]:
+    """Scheduler tick: fetch the next small batch of due products."""
+    try:
+        with trace_run("refresh"):
+            sync_refresh_schedule()
+            return refresher.run_batch()
+    except Exception as e:
+        logger.error(f"Incremental refresh failed: {e}")
+        return []
+
+
+@tracer.traced()
+def gather_products(product_links: Optional[Dict[str, List[str]]] = None,
+                    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    sync: bool = True) -> List[Dict[str, Any]]:
+    """Get current results for all products, reusing fresh incremental snapshots.
+    
+    Only products without a recent enough snapshot are scraped now.
+    
+    Args:
+        product_links: Product URLs grouped by retailer, defaults to config.PRODUCT_LINKS
+        on_result: Called with each product result as it becomes available
+        sync: Resync the refresh schedule first (skipped for later shards of a run)
     """
+    if product_links is None:
+        product_links = config.PRODUCT_LINKS
+    if not config.REFRESH_SETTINGS.get("enabled", True):
+        return scrape_products_enhanced(product_links, on_result=on_result)
+    
+    if sync:
+        sync_refresh_schedule()
+    urls = [url for urls in product_links.values() for url in urls]
+    fresh, stale = refresher.collect(urls)
+    logger.info(f"Using {len(fresh)} fresh snapshots, scraping {len(stale)} stale products")
+    
+    results = list(fresh)
+    for result in fresh:
+        if 'thumbnail' not in result:
+            # Snapshots read back from the price history were fetched by another process
+            result['thumbnail'] = image_cache.images.thumbnail_url(result.get('image', ''))
+        if on_result:
+            on_result(result)
+    if stale:
+        scraped = scrape_products_enhanced({'stale': stale}, on_result=on_result)
+        refresher.remember(scraped)
+        results.extend(scraped)
+    
+    # Keep the configured product order
+    order = {registry.canonical_url(url): i for i, url in enumerate(urls)}
+    results.sort(key=lambda r: order.get(r.get('product_id') or registry.canonical_url(r['url']), len(order)))
+    return results
+
+
+def create_enhanced_email_content(products: List[Dict[str, Any]],
+                                  recipient: Optional[str] = None) -> email_builder.EmailContent:
+    """Render the daily update email (the same for every recipient).
+    
+    Returns:
+        HTML and plain-text bodies
+    """
+    cache_stats = registry.get_cache_stats()
+    content = email_builder.render_daily_email(products, cache_size=cache_stats['size'] if cache_stats['enabled'] else None)
+    if content.omitted:
+        logger.warning(f"Left {content.omitted} of {len(products)} products out of the email to stay under "
+                       f"{email_builder.max_message_bytes()} bytes")
+    return content
+
+
+@tracer.traced()
+def send_enhanced_email(products: List[Dict[str, Any]], recipients: List[str], subject: Optional[str] = None,
+                        run_date: Optional[str] = None,
+                        keep_alive: Optional[Callable[[], None]] = None) -> List[str]:
+    """Send enhanced email with product information.
+    
+    Args:
+        products: Products to include
+        recipients: Email addresses
+        subject: Subject line, defaults to an update summary
+        run_date: Daily run date; recipients who already got this exact email
+            for the date (per the delivery ledger) are skipped, and any
+            failed delivery raises ``DeliveryError`` so the run is retried
+        keep_alive: Called between recipients and while waiting for the send
+            budget, to renew the work unit's lease (raises ``LeaseLost`` once
+            another worker has taken the unit over)
     
-    if successful_products:
-        html_content += '<div class="product-grid">'
-        for product in successful_products:
-            html_content += f'''
-            <div class="product-card">
-                <div class="product-retailer">{product['retailer'].title()}</div>
-                {f'<img src="{product["image"]}" alt="Product Image" class="product-image" onerror="this.style.display=\'none\'">' if product.get('image') else ''}
-                <div class="product-name">{product['name']}</div>
-                <div class="product-price">{product['price']}</div>
-                <p><a href="{product['url']}" target="_blank" style="color: #3498db;">View Product →</a></p>
-                <small style="color: #7f8c8d;">Updated: {product['timestamp'][:16]}</small>
-            </div>
-            '''
-        html_content += '</div>'
-    
-    if failed_products:
-        html_content += f'''
-        <div class="error-section">
-            <h3>⚠️ Failed to Update ({len(failed_products)} products)</h3>
-            <ul>
-        '''
-        for product in failed_products:
-            html_content += f'<li><a href="{product["url"]}" target="_blank">{product["url"]}</a> - {product["name"]}</li>'
-        html_content += '</ul></div>'
-    
-    html_content += f'''
-            <div class="footer">
-                <p>This email was generated automatically by Sale Tracker v{config.get_config()["version"]}</p>
-                <p>Powered by Enhanced Retailer Framework</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    '''
-    
-    return html_content
-
-
-def send_enhanced_email(products: List[Dict[str, Any]], recipients: List[str]):
-    """Send enhanced email with product information."""
+    Returns:
+        Recipients the email could not be delivered to
+    """
+    import smtplib
+    
+    failed: List[str] = []
+    delivered: List[str] = []
+    # Only mail servers impose send limits; local sinks skip the shared budget
+    paced = email_transport.needs_credentials(config.EMAIL_SETTINGS)
     try:
-        sender_email, email_password, _ = get_email_credentials()
+        if paced:
+            sender_email, email_password, _ = get_email_credentials()
+        else:
+            # Local sinks (maildir/mbox/file) need no mail server login
+            config.load_env()
+            sender_email, email_password = os.getenv("SENDER_EMAIL") or email_transport.LOCAL_SENDER, None
+        transport = email_transport.get_transport(config.EMAIL_SETTINGS, sender_email, email_password)
         
         # Create subject line based on successful products
-        successful_products = [p for p in products if p['success']]
-        total_products = len(products)
-        subject = f"Daily Product Update - {len(successful_products)}/{total_products} products updated"
+        if subject is None:
+            successful_products = [p for p in products if p['success']]
+            total_products = len(products)
+            subject = f"Daily Product Update - {len(successful_products)}/{total_products} products updated"
+        digest = delivery_ledger.content_hash(subject, products) if run_date else None
+        
+        # Every recipient gets the same body, so it is rendered once
+        msg = None
         
         for recipient in recipients:
+            if keep_alive:
+                keep_alive()
+            if run_date and delivery_ledger.ledger.delivered(run_date, recipient, digest):
+                logger.info(f"Skipping {recipient}: already delivered for {run_date}")
+                delivered.append(recipient)
+                continue
             try:
-                msg = MIMEMultipart('alternative')
-                msg["From"] = sender_email
-                msg["To"] = recipient
-                msg["Subject"] = subject
-                
-                # Create enhanced HTML content
-                html_content = create_enhanced_email_content(products, recipient)
-                html_part = MIMEText(html_content, 'html')
-                msg.attach(html_part)
+                if msg is None:
+                    with tracer.span("render_email", products=len(products)):
+                        msg = email_builder.build_message(sender_email, recipient, subject,
+                                                          create_enhanced_email_content(products))
+                else:
+                    email_builder.address(msg, recipient)
                 
                 # Send email with retry logic
                 max_retries = config.EMAIL_SETTINGS.get("max_retries", 3)
@@ -291,33 +416,70 @@ def send_enhanced_email(products: List[Dict[str, Any]], recipients: List[str]):
                 
                 for attempt in range(max_retries):
                     try:
-                        with smtplib.SMTP(config.EMAIL_SETTINGS["smtp_server"], config.EMAIL_SETTINGS["smtp_port"]) as server:
-                            server.starttls()
-                            server.login(sender_email, email_password)
-                            server.sendmail(sender_email, recipient, msg.as_string())
+                        if paced:
+                            # Wait for a slot in the shared send budget
+                            with tracer.span("send_budget_wait"):
+                                outbound.budget.acquire(keep_alive)
+                        with tracer.span("smtp_send", recipient=recipient, attempt=attempt + 1):
+                            transport.send(sender_email, recipient, msg)
                         
                         logger.info(f"Enhanced email sent successfully to {recipient}")
+                        delivered.append(recipient)
+                        if paced:
+                            outbound.budget.record_sent()
+                        if run_date:
+                            delivery_ledger.ledger.record(run_date, recipient, digest)
                         if metrics:
                             metrics.record_email_sent()
                         break
                         
                     except smtplib.SMTPException as e:
+                        throttled = outbound.is_throttle_error(e)
+                        if throttled:
+                            # The budget pauses everyone and lowers the rate, so no extra wait here
+                            outbound.budget.record_throttled()
                         if attempt < max_retries - 1:
-                            logger.warning(f"Email attempt {attempt + 1} failed to {recipient}: {e}. Retrying in {retry_delay}s...")
-                            time.sleep(retry_delay)
+                            logger.warning(f"Email attempt {attempt + 1} failed to {recipient}: {e}. "
+                                           f"Retrying{'' if throttled else f' in {retry_delay}s'}...")
+                            if not throttled:
+                                with tracer.span("smtp_retry_wait", seconds=retry_delay):
+                                    time.sleep(retry_delay)
                         else:
                             logger.error(f"Failed to send email to {recipient} after {max_retries} attempts: {e}")
+                            failed.append(recipient)
                             
+            except outbound.BudgetExhausted as e:
+                # Later recipients can't be sent either; a retried run picks them up
+                logger.error(f"{e}; not sending to {len(recipients) - len(delivered)} remaining recipients")
+                if run_date:
+                    raise  # The daily run defers the unit until the budget frees up
+                failed = [r for r in recipients if r not in delivered]
+                break
+            except LeaseLost:
+                raise
             except Exception as e:
                 logger.error(f"Error preparing email for {recipient}: {e}")
-                
+                failed.append(recipient)
+    
+    except (LeaseLost, outbound.BudgetExhausted):
+        # Another worker owns these recipients now, or the run waits for the budget;
+        # either way the ledger stops what went out from being sent again
+        raise
     except Exception as e:
         logger.error(f"Error in send_enhanced_email: {e}")
+        failed = [recipient for recipient in recipients if recipient not in delivered]
+    
+    if failed and run_date:
+        raise delivery_ledger.DeliveryError(f"Failed to deliver to {len(failed)} of {len(recipients)} recipients")
+    return failed
 
 
 def run_enhanced_scheduler():
     """Enhanced scheduler with error handling and metrics."""
+    from scheduler import Scheduler
+    
     logger.info("Starting Enhanced Sale Tracker with new retailer framework")
+    exporter.ensure_started()
     logger.info(f"Configuration: {len(config.PRODUCT_LINKS)} retailers, "
                 f"{sum(len(urls) for urls in config.PRODUCT_LINKS.values())} total products")
     logger.info(f"Cache enabled: {config.SCRAPING_SETTINGS.get('enable_cache')}")
@@ -333,57 +495,255 @@ def run_enhanced_scheduler():
             logger.error("Cannot continue without required environment variables")
             return
     
+    scheduler = Scheduler()
+    
     # Schedule daily email
-    schedule.every().day.at(config.EMAIL_SETTINGS["schedule_time"]).do(send_daily_email_enhanced)
+    scheduler.add("daily_email", profiler.wrap("daily_email", _scheduled_daily_email),
+                  at=config.EMAIL_SETTINGS["schedule_time"], pass_fire_time=True)
     logger.info(f"Scheduled daily emails at {config.EMAIL_SETTINGS['schedule_time']}")
     
-    # Health check scheduling
+    # Health check scheduling (a missed check isn't worth catching up on)
     if config.PERFORMANCE_SETTINGS.get("health_check_interval"):
-        schedule.every(config.PERFORMANCE_SETTINGS["health_check_interval"]).seconds.do(health_check)
+        scheduler.add("health_check", profiler.wrap("health_check", health_check),
+                      every=config.PERFORMANCE_SETTINGS["health_check_interval"], catch_up=False)
+    
+    # Incremental refresh spreads scraping over the day
+    if config.REFRESH_SETTINGS.get("enabled", True):
+        scheduler.add("refresh", profiler.wrap("refresh", refresh_due_products),
+                      every=config.REFRESH_SETTINGS["tick_interval"])
+        logger.info(f"Incremental refresh every {config.REFRESH_SETTINGS['tick_interval']}s "
+                    f"in batches of {config.REFRESH_SETTINGS['batch_size']}")
     
-    # Main scheduler loop
+    # Downsample old price history once a day
+    if config.STORAGE_SETTINGS.get("enable_price_history", True):
+        scheduler.add("price_history_retention",
+                      profiler.wrap("price_history_retention", price_history.history.apply_retention),
+                      every=24 * 3600)
+    
+    # Sleeps until the next job is due; returns on Ctrl+C
     try:
-        while True:
-            schedule.run_pending()
-            time.sleep(60)  # Check every minute
-            
-    except KeyboardInterrupt:
-        logger.info("Scheduler stopped by user")
+        scheduler.run_forever()
     except Exception as e:
         logger.error(f"Scheduler error: {e}")
 
 
-def send_daily_email_enhanced():
-    """Enhanced daily email function."""
-    logger.info("Starting enhanced daily email process")
+def daily_run_id(day: Optional[date] = None) -> str:
+    """Get the id shared by every worker taking part in a day's email run."""
+    return f"daily-{(day or date.today()).isoformat()}"
+
+
+def _scheduled_daily_email(fire_time: float):
+    """Scheduler entry point. The run is keyed on the day it was scheduled for, so a
+    missed run caught up after midnight doesn't take the next day's run id."""
+    send_daily_email_enhanced(run_date=date.fromtimestamp(fire_time))
+
+
+def send_daily_email_enhanced(on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                              run_id: Optional[str] = None, run_date: Optional[date] = None):
+    """Enhanced daily email function.
+    
+    The run is split into product-fetch units and recipient-email units in
+    ``data/work.db``. Every process that calls this for the same run (the
+    scheduler on each node, extra ``cli_enhanced.py daily-run`` workers)
+    claims units until the run is done, so more workers finish sooner.
+    
+    Args:
+        on_result: Called with each product result as it becomes available
+        run_id: Run to create or join, defaults to the run for ``run_date``
+        run_date: Day the email is for (deliveries are recorded against it), defaults to today
+    """
+    run_date = run_date or date.today()
+    with trace_run("daily_email"):
+        _run_daily_email(on_result, run_id or daily_run_id(run_date), run_date)
+
+
+def _plan_daily_run(run_id: str, run_date: date) -> bool:
+    """Create the run's product-fetch units unless another worker already has."""
+    alerts_enabled = config.ALERT_SETTINGS.get("enabled", True)
+    product_links = collect_product_links() if alerts_enabled else config.PRODUCT_LINKS
+    urls = [url for urls in product_links.values() for url in urls]
+    size = config.DAILY_RUN_SETTINGS.get("fetch_unit_size", 10)
+    
+    started = time.time()
+    before = None
+    if alerts_enabled and config.REFRESH_SETTINGS.get("enabled", True):
+        # Snapshots may predate this run, so compare against prices as of the last delivery
+        previous = work_queue.last_finished_run("daily-")
+        before = (previous['meta'].get('started') if previous else None) or refresher.last_delivery \
+            or started - 24 * 3600
+    
+    meta = {'started': started, 'date': run_date.isoformat(), 'alerts': alerts_enabled, 'before': before}
+    return work_queue.create_run(run_id, "fetch", [urls[i:i + size] for i in range(0, len(urls), size)], meta)
+
+
+def _plan_email_units(run_id: str, run: Dict[str, Any]) -> bool:
+    """Split the recipients into email units once every product has been fetched.
+    
+    With alerts, recipients getting identical emails share units and units
+    with the biggest price drops come first, so they go out first when the
+    send budget runs short. Recipients without alerts get no unit at all.
+    """
+    config.load_env()
+    env_recipients = [r for r in (os.getenv("RECIPIENT_EMAIL"), os.getenv("RECIPIENT_EMAIL2")) if r]
+    all_recipients = sorted(set(env_recipients + recipients_store.load_recipients()))
+    if not all_recipients:
+        logger.warning("No recipients found. Email not sent.")
+    
+    if run['meta'].get('alerts') and all_recipients:
+        alerts = price_alerts.detect_price_drops(_run_products(run_id), all_recipients,
+                                                 before=run['meta'].get('before'))
+        groups = [batch_recipients for _, batch_recipients in _alert_batches(alerts)]
+    else:
+        groups = [all_recipients] if all_recipients else []
+    
+    size = config.DAILY_RUN_SETTINGS.get("email_unit_size", 25)
+    units = [group[i:i + size] for group in groups for i in range(0, len(group), size)]
+    advanced = work_queue.advance(run_id, "fetch", "email", units)
+    if advanced and email_transport.needs_credentials(config.EMAIL_SETTINGS):
+        outbound.budget.spread(sum(len(unit) for unit in units))
+    return advanced
+
+
+def _run_products(run_id: str) -> List[Dict[str, Any]]:
+    """Get every product fetched for a run, in fetch order."""
+    return [product for results in work_queue.results(run_id, "fetch") for product in results]
+
+
+def _run_daily_email(on_result: Optional[Callable[[Dict[str, Any]], None]], run_id: str, run_date: date):
+    logger.info(f"Starting enhanced daily email process ({run_id})")
     
     try:
-        # Scrape all products
-        products = scrape_products_enhanced()
+        if not _plan_daily_run(run_id, run_date):
+            run = work_queue.get_run(run_id)
+            if run['stage'] == DONE_STAGE:
+                logger.info(f"Daily email run {run_id} already completed")
+                return
+            logger.info(f"Joining daily email run {run_id} at the {run['stage']} stage")
+            # A rerun resumes units that ran out of attempts last time
+            work_queue.retry_failed(run_id)
         
-        # Get recipients from both environment and storage
-        try:
-            _, _, env_recipients = get_email_credentials()
-        except ValueError:
-            env_recipients = []
-        
-        # Get recipients from storage
-        storage_recipients = recipients_store.load_recipients()
+        reported = set()
+        products: Optional[List[Dict[str, Any]]] = None
+        synced = False
+        poll_interval = config.DAILY_RUN_SETTINGS.get("poll_interval", 1.0)
         
-        # Combine and deduplicate recipients
-        all_recipients = list(set(env_recipients + storage_recipients))
-        
-        if not all_recipients:
-            logger.warning("No recipients found. Email not sent.")
-            return
+        def report(result: Dict[str, Any]):
+            reported.add(result.get('product_id') or registry.canonical_url(result['url']))
+            if on_result:
+                on_result(result)
         
-        # Send enhanced emails
-        send_enhanced_email(products, all_recipients)
+        while True:
+            run = work_queue.get_run(run_id)
+            stage = run['stage']
+            if stage == DONE_STAGE:
+                break
+            
+            unit = work_queue.claim(run_id, stage)
+            if unit is not None:
+                # Sending can wait on the shared budget far longer than a lease lasts
+                keep_alive = work_queue.keep_alive(unit)
+                try:
+                    if stage == "fetch":
+                        def report_and_renew(result: Dict[str, Any]):
+                            report(result)
+                            keep_alive()
+                        
+                        result = gather_products({'shard': unit.payload}, on_result=report_and_renew,
+                                                 sync=not synced)
+                        synced = True
+                    else:
+                        if products is None:
+                            products = _run_products(run_id)
+                            # Products fetched by other workers are reported once they're all in
+                            for product in products:
+                                if (product.get('product_id') or registry.canonical_url(product['url'])) not in reported:
+                                    report(product)
+                        # Retried units skip recipients the ledger shows were already emailed
+                        run_date = run['meta'].get('date')
+                        if run['meta'].get('alerts'):
+                            sent = send_price_alert_emails(products, unit.payload, before=run['meta'].get('before'),
+                                                           run_date=run_date, keep_alive=keep_alive)
+                        else:
+                            send_enhanced_email(products, unit.payload, run_date=run_date, keep_alive=keep_alive)
+                            sent = len(unit.payload)
+                        result = {'sent': sent}
+                    work_queue.complete(unit, result)
+                except LeaseLost as e:
+                    logger.warning(f"Stopped working on daily email {stage} unit {unit.seq}: {e}")
+                except outbound.BudgetExhausted as e:
+                    # Not the unit's fault, so it doesn't count as an attempt
+                    logger.warning(f"Deferring daily email {stage} unit {unit.seq} for {e.retry_after:.0f}s: {e}")
+                    work_queue.defer(unit, e.retry_after, str(e))
+                except Exception as e:
+                    logger.error(f"Daily email {stage} unit {unit.seq} failed: {e}")
+                    work_queue.fail(unit, str(e))
+                continue
+            
+            if work_queue.stage_finished(run_id, stage):
+                failed = work_queue.failed_units(run_id, stage)
+                if failed:
+                    # Left out of "done", so rerunning retries them instead of skipping these recipients
+                    raise RunIncomplete(f"{failed} {stage} units of run {run_id} failed; rerun to retry them")
+                if stage == "fetch":
+                    _plan_email_units(run_id, run)
+                else:
+                    work_queue.advance(run_id, stage, DONE_STAGE)
+                continue
+            
+            retry_at = work_queue.next_retry(run_id, stage)
+            if retry_at is not None and retry_at - time.time() > config.DAILY_RUN_SETTINGS.get("max_retry_wait", 300):
+                raise RunIncomplete(f"Run {run_id} is waiting to retry units until "
+                                    f"{datetime.fromtimestamp(retry_at):%H:%M}; rerun after that to resume")
+            
+            # Other workers hold the remaining leases, or failed units are backing off
+            time.sleep(poll_interval)
         
-        logger.info(f"Enhanced daily email process completed. Sent to {len(all_recipients)} recipients.")
+        refresher.last_delivery = run['meta'].get('started')
+        sent_to = sum(result.get('sent', 0) for result in work_queue.results(run_id, "email"))
+        logger.info(f"Enhanced daily email process completed. Sent to {sent_to} recipients.")
         
     except Exception as e:
+        # Re-raised so the scheduler, background job or CLI records the run as failed
         logger.error(f"Error in enhanced daily email process: {e}")
+        raise
+
+
+def _alert_batches(alerts: Dict[str, List[Dict[str, Any]]]) -> List[Tuple[List[Dict[str, Any]], List[str]]]:
+    """Group recipients with identical alerts into one batch each, biggest price drop first."""
+    batches: Dict[Tuple[str, ...], Tuple[List[Dict[str, Any]], List[str]]] = {}
+    for recipient, items in alerts.items():
+        key = tuple(item['product_id'] for item in items)
+        batches.setdefault(key, (items, []))[1].append(recipient)
+    return sorted(batches.values(),
+                  key=lambda batch: -max((item.get('price_drop_pct') or 0.0) for item in batch[0]))
+
+
+@tracer.traced()
+def send_price_alert_emails(products: List[Dict[str, Any]], recipients: List[str],
+                            before: Optional[float] = None, run_date: Optional[str] = None,
+                            keep_alive: Optional[Callable[[], None]] = None) -> int:
+    """Email each recipient only the products that triggered their alert rules.
+    
+    Args:
+        products: Current product results
+        recipients: Email addresses to check for alerts
+        before: Compare against prices as of this time
+        run_date: Daily run date, for skipping emails already delivered
+        keep_alive: Renews the work unit's lease (see ``send_enhanced_email``)
+    
+    Returns:
+        Number of recipients emailed (0 on a no-change day)
+    """
+    alerts = price_alerts.detect_price_drops(products, recipients, before=before)
+    if not alerts:
+        logger.info("No price drops detected. Skipping email.")
+        return 0
+    
+    for items, batch_recipients in _alert_batches(alerts):
+        subject = f"Price drop alert - {len(items)} product{'s' if len(items) != 1 else ''} on sale"
+        send_enhanced_email(items, batch_recipients, subject=subject, run_date=run_date, keep_alive=keep_alive)
+    
+    return len(alerts)
 
 
 def health_check():
@@ -417,6 +777,7 @@ def health_check():
 
 
 if __name__ == '__main__':
+    setup_logging()
     try:
         run_enhanced_scheduler()
     except Exception as e:
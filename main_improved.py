@@ -1,10 +1,5 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
-import schedule
-import time
 import requests
 from bs4 import BeautifulSoup
 import json
@@ -15,6 +10,9 @@ from typing import List, Tuple, Optional
 import config
 import recipients_store
 import subscriptions_store
+import email_builder
+import email_transport
+from scheduler import Scheduler
 
 # Set up logging
 logging.basicConfig(
@@ -157,57 +155,21 @@ def send_combined_email() -> None:
             return
 
         # Compose email
-        message = MIMEMultipart()
-        message['From'] = sender_email
-        message['To'] = ", ".join(recipient_emails)
-
-        # Create dynamic subject line
         subject_prices = ", ".join(prices_for_subject)
-        message['Subject'] = f"{subject_prices} – Your Tracked Products ({datetime.now().strftime('%Y-%m-%d')})"
-
-        # Build email body
-        html_lines = [
-            "<html><body>",
-            f"<h2>Here are your tracked products for {datetime.now().strftime('%B %d, %Y')}:</h2>"
-        ]
-
-        for name, price, image, link, company in all_products_info:
-            card = f"""
-            <div style="width: 100%; text-align: center;">
-                <div style="
-                    display: inline-block;
-                    border: 1px solid #ccc;
-                    padding: 20px;
-                    margin-bottom: 20px;
-                    max-width: 400px;
-                    border-radius: 8px;
-                    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                ">
-                    <a href="{link}" target="_blank" style="text-decoration: none; color: inherit;">
-                        <h3 style="margin: 0 0 10px 0; color: #333;">{name}</h3>
-                        <p style="font-size: 18px; font-weight: bold; color: #e74c3c; margin: 10px 0;">{price}</p>
-                        <p style="font-size: 12px; color: #666; margin: 5px 0;">{company.upper()}</p>
-                        {f'<img src="{image}" alt="{name}" style="width: 80%; max-width: 300px; height: auto; border-radius: 4px;" />' if image else ''}
-                    </a>
-                </div>
-            </div>
-            """
-            html_lines.append(card)
-
-        html_lines.append("</body></html>")
-        html_body = "\n".join(html_lines)
-        message.attach(MIMEText(html_body, 'html'))
+        subject = f"{subject_prices} – Your Tracked Products ({datetime.now().strftime('%Y-%m-%d')})"
+        content = email_builder.render_tracked_email(
+            f"Here are your tracked products for {datetime.now().strftime('%B %d, %Y')}:",
+            [{'name': name, 'price': price, 'image': image, 'url': link, 'retailer': company}
+             for name, price, image, link, company in all_products_info]
+        )
+        message = email_builder.build_message(sender_email, ", ".join(recipient_emails), subject, content)
 
         # Send email
-        server = smtplib.SMTP(config.EMAIL_SETTINGS["smtp_server"], config.EMAIL_SETTINGS["smtp_port"])
-        server.starttls()
-        server.login(sender_email, sender_password)
-        
-        for recipient in recipient_emails:
-            server.sendmail(sender_email, recipient, message.as_string())
-            logger.info(f"Email sent successfully to {recipient}")
+        with email_transport.create_transport(config.EMAIL_SETTINGS, sender_email, sender_password) as transport:
+            for recipient in recipient_emails:
+                transport.send(sender_email, recipient, message)
+                logger.info(f"Email sent successfully to {recipient}")
             
-        server.quit()
         logger.info("Combined email sent successfully to all recipients")
         
     except Exception as e:
@@ -220,9 +182,7 @@ def send_personalized_emails() -> None:
         sender_email, sender_password, recipient_emails = get_email_credentials()
         all_subs = subscriptions_store.list_all_subscriptions()
 
-        server = smtplib.SMTP(config.EMAIL_SETTINGS["smtp_server"], config.EMAIL_SETTINGS["smtp_port"])
-        server.starttls()
-        server.login(sender_email, sender_password)
+        transport = email_transport.create_transport(config.EMAIL_SETTINGS, sender_email, sender_password)
 
         for recipient in set(recipient_emails):
             products = all_subs.get(recipient.lower(), [])
@@ -255,45 +215,19 @@ def send_personalized_emails() -> None:
                 continue
 
             # Compose email
-            message = MIMEMultipart()
-            message['From'] = sender_email
-            message['To'] = recipient
             subject_prices_str = ", ".join(subject_prices)
-            message['Subject'] = f"{subject_prices_str} – Your Tracked Products ({datetime.now().strftime('%Y-%m-%d')})"
-
-            html_lines = [
-                "<html><body>",
-                f"<h2>Your tracked products for {datetime.now().strftime('%B %d, %Y')}:</h2>"
-            ]
-            for name, price, image, link, company in collected:
-                card = f"""
-                <div style=\"width: 100%; text-align: center;\">
-                    <div style=\"
-                        display: inline-block;
-                        border: 1px solid #ccc;
-                        padding: 20px;
-                        margin-bottom: 20px;
-                        max-width: 400px;
-                        border-radius: 8px;
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                    \">
-                        <a href=\"{link}\" target=\"_blank\" style=\"text-decoration: none; color: inherit;\">
-                            <h3 style=\"margin: 0 0 10px 0; color: #333;\">{name}</h3>
-                            <p style=\"font-size: 18px; font-weight: bold; color: #e74c3c; margin: 10px 0;\">{price}</p>
-                            <p style=\"font-size: 12px; color: #666; margin: 5px 0;\">{company.upper()}</p>
-                            {f'<img src="{image}" alt="{name}" style="width: 80%; max-width: 300px; height: auto; border-radius: 4px;" />' if image else ''}
-                        </a>
-                    </div>
-                </div>
-                """
-                html_lines.append(card)
-            html_lines.append("</body></html>")
-            message.attach(MIMEText("\n".join(html_lines), 'html'))
-
-            server.sendmail(sender_email, recipient, message.as_string())
+            subject = f"{subject_prices_str} – Your Tracked Products ({datetime.now().strftime('%Y-%m-%d')})"
+            content = email_builder.render_tracked_email(
+                f"Your tracked products for {datetime.now().strftime('%B %d, %Y')}:",
+                [{'name': name, 'price': price, 'image': image, 'url': link, 'retailer': company}
+                 for name, price, image, link, company in collected]
+            )
+            message = email_builder.build_message(sender_email, recipient, subject, content)
+
+            transport.send(sender_email, recipient, message)
             logger.info(f"Personalized email sent to {recipient}")
 
-        server.quit()
+        transport.close()
     except Exception as e:
         logger.error(f"Failed to send personalized emails: {e}")
 
@@ -311,21 +245,17 @@ def run_scheduler() -> None:
     logger.info(f"Emails will be sent daily at {config.EMAIL_SETTINGS['schedule_time']}")
     
     # Use personalized emails when available
-    schedule.every().day.at(config.EMAIL_SETTINGS["schedule_time"]).do(send_personalized_emails)
+    scheduler = Scheduler()
+    scheduler.add("personalized_email", send_personalized_emails, at=config.EMAIL_SETTINGS["schedule_time"])
     
     # Send immediately for testing (uncomment the next line to test)
     # send_combined_email()
     
-    while True:
-        try:
-            schedule.run_pending()
-            time.sleep(60)  # Check every minute instead of every second
-        except KeyboardInterrupt:
-            logger.info("Scheduler stopped by user")
-            break
-        except Exception as e:
-            logger.error(f"Scheduler error: {e}")
-            time.sleep(60)  # Wait before retrying
+    # Sleeps until the email is due instead of checking every minute; returns on Ctrl+C
+    try:
+        scheduler.run_forever()
+    except Exception as e:
+        logger.error(f"Scheduler error: {e}")
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,312 @@
+"""
+OpenMetrics (Prometheus) exposition of scrape, cache and email metrics.
+
+Every process (each gunicorn worker, the scheduler) periodically writes a
+snapshot of its own counters, gauges and histograms to a file in the metrics
+directory. ``/metrics`` merges the snapshots of all processes, so any worker
+can answer for the whole deployment. Series are per retailer and stage, never
+per product, so rendering cost doesn't grow with the number of products.
+
+When a process exits (or is found to have exited), its counters and
+histograms are folded into ``retired.json`` and its snapshot is deleted, so
+totals survive worker restarts without a file per process ever started.
+"""
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: no forked workers to coordinate with
+    fcntl = None
+
+import config_enhanced as config
+from retailers import registry, latency
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "metrics"
+)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Summed counters and histograms of exited processes
+RETIRED_FILE = "retired.json"
+
+# Upper bounds (seconds) of the exported latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help)
+METRICS = {
+    "sale_tracker_scrapes": ("counter", "Products scraped, by result"),
+    "sale_tracker_emails_sent": ("counter", "Emails sent"),
+    "sale_tracker_scrape_duration_seconds": ("histogram", "Time to scrape one product"),
+    "sale_tracker_stage_duration_seconds": ("histogram", "Scrape stage latency by retailer and stage"),
+    "sale_tracker_cache_lookups": ("counter", "Registry cache lookups, by result"),
+    "sale_tracker_cache_entries": ("gauge", "Products held in registry caches"),
+    "sale_tracker_fetches": ("counter", "Retailer fetches started"),
+    "sale_tracker_fetches_saved": ("counter", "Duplicate fetches avoided by request coalescing"),
+    "sale_tracker_fetches_in_flight": ("gauge", "Retailer fetches currently running"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OverflowError):
+        return True
+    return True
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _merge(snapshots: List[Dict[str, Any]]) -> Tuple[Dict[Tuple[str, Labels], float], Dict[Tuple[str, Labels], list]]:
+    """Sum the counters and histograms of several snapshots, keyed by (name, labels)."""
+    counters: Dict[Tuple[str, Labels], float] = {}
+    histograms: Dict[Tuple[str, Labels], list] = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get('counters', []):
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, count, total in snapshot.get('histograms', []):
+            if len(buckets) != len(LATENCY_BUCKETS):
+                continue  # Written with different bucket bounds
+            key = (name, tuple(sorted(labels.items())))
+            merged = histograms.setdefault(key, [[0] * len(LATENCY_BUCKETS), 0, 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += count
+            merged[2] += total
+    return counters, histograms
+
+
+def _load(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path: str, data: Dict[str, Any]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """Collects this process's metrics and renders all processes' metrics."""
+
+    def __init__(self, performance=None, directory: Optional[str] = None,
+                 flush_interval: Optional[float] = None):
+        """
+        Args:
+            performance: ``PerformanceMetrics`` with scrape/email counters (optional)
+            directory: Where per-process snapshots are written, defaults to METRICS_DIR
+            flush_interval: Seconds between snapshots, defaults to config
+        """
+        self.performance = performance
+        self.directory = directory
+        self.flush_interval = flush_interval or config.PERFORMANCE_SETTINGS.get("metrics_flush_interval", 15)
+        self._started_pid: Optional[int] = None
+        self._closed_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _dir(self) -> str:
+        return self.directory or METRICS_DIR
+
+    def collect(self) -> Dict[str, Any]:
+        """Snapshot this process's metrics as JSON-serialisable samples."""
+        counters: List[list] = []
+        gauges: List[list] = []
+        histograms: List[list] = []
+
+        if self.performance is not None:
+            current = self.performance.get_metrics()
+            counters.append(["sale_tracker_scrapes", {"result": "success"}, current['scrapes_successful']])
+            counters.append(["sale_tracker_scrapes", {"result": "failure"}, current['scrapes_failed']])
+            counters.append(["sale_tracker_emails_sent", {}, current['emails_sent']])
+            buckets, count, total = self.performance.scrape_times.cumulative(LATENCY_BUCKETS)
+            histograms.append(["sale_tracker_scrape_duration_seconds", {}, buckets, count, total])
+
+        for (retailer_name, stage), histogram in latency.items():
+            buckets, count, total = histogram.cumulative(LATENCY_BUCKETS)
+            histograms.append(["sale_tracker_stage_duration_seconds",
+                               {"retailer": retailer_name, "stage": stage}, buckets, count, total])
+
+        if registry.cache:
+            counters.append(["sale_tracker_cache_lookups", {"result": "hit"}, registry.cache.hits])
+            counters.append(["sale_tracker_cache_lookups", {"result": "miss"}, registry.cache.misses])
+            gauges.append(["sale_tracker_cache_entries", {}, registry.cache.size()])
+
+        coalescing = registry.get_coalescing_stats()
+        counters.append(["sale_tracker_fetches", {}, coalescing['fetches']])
+        counters.append(["sale_tracker_fetches_saved", {}, coalescing['fetches_saved']])
+        gauges.append(["sale_tracker_fetches_in_flight", {}, coalescing['in_flight']])
+
+        return {
+            'pid': os.getpid(),
+            'written_at': time.time(),
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms
+        }
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self._dir(), f"{pid}.json")
+
+    def flush(self):
+        """Write this process's snapshot for other processes to merge."""
+        snapshot = self.collect()
+        os.makedirs(self._dir(), exist_ok=True)
+        _write(self._path(snapshot['pid']), snapshot)
+
+    @contextmanager
+    def _retired_lock(self) -> Iterator[None]:
+        """Hold the lock that serialises reading and folding into the retired totals across processes."""
+        os.makedirs(self._dir(), exist_ok=True)
+        with open(os.path.join(self._dir(), "retired.lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file is closed
+            yield
+
+    def _retire(self, snapshots: List[Dict[str, Any]]):
+        """Fold exited processes' snapshots into the retired totals and delete their files.
+
+        Call while holding ``_retired_lock``.
+        """
+        path = os.path.join(self._dir(), RETIRED_FILE)
+        counters, histograms = _merge([_load(path) or {}] + snapshots)
+        _write(path, {
+            'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, dict(labels), buckets, count, total]
+                           for (name, labels), (buckets, count, total) in histograms.items()]
+        })
+        for snapshot in snapshots:
+            try:
+                os.remove(self._path(snapshot['pid']))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Fold this process's metrics into the retired totals and remove its snapshot (runs at exit)."""
+        pid = os.getpid()
+        if self._started_pid != pid or self._closed_pid == pid:
+            return
+        self._closed_pid = pid
+        with self._retired_lock():
+            self._retire([self.collect()])
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._closed_pid == os.getpid():
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Failed to write metrics snapshot: {e}")
+
+    def ensure_started(self):
+        """Start periodic snapshots in this process (safe to call often, and after fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            self._started_pid = pid
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+            atexit.register(self.close)
+
+    def _snapshots(self) -> List[Dict[str, Any]]:
+        """Load the retired totals and every running process's snapshot, with this process's taken fresh.
+
+        Snapshots of processes that have exited are retired on the way.
+        """
+        own = self.collect()
+        snapshots = [own]
+        with self._retired_lock():
+            exited = []
+            for path in glob.glob(os.path.join(self._dir(), "*.json")):
+                if os.path.basename(path) == RETIRED_FILE:
+                    continue
+                snapshot = _load(path)
+                if snapshot is None or snapshot.get('pid') == own['pid']:
+                    continue
+                (snapshots if _process_alive(snapshot['pid']) else exited).append(snapshot)
+            if exited:
+                try:
+                    self._retire(exited)
+                except OSError as e:
+                    logger.warning(f"Failed to retire metrics of exited processes: {e}")
+                    snapshots.extend(exited)
+            retired = _load(os.path.join(self._dir(), RETIRED_FILE))
+        if retired is not None:
+            snapshots.append(retired)
+        return snapshots
+
+    def render(self) -> str:
+        """Render all processes' metrics in OpenMetrics text format.
+
+        Counters and histograms are summed over every process that has ever
+        written a snapshot (so totals survive worker restarts); gauges only
+        over processes that are still running.
+        """
+        snapshots = self._snapshots()
+        counters, histograms = _merge(snapshots)
+        gauges: Dict[Tuple[str, Labels], float] = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot.get('gauges', []):  # Retired totals have none
+                key = (name, tuple(sorted(labels.items())))
+                gauges[key] = gauges.get(key, 0) + value
+
+        samples: Dict[str, List[str]] = {name: [] for name in METRICS}
+        for (name, labels), value in sorted(counters.items()):
+            samples[name].append(f"{name}_total{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), value in sorted(gauges.items()):
+            samples[name].append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (buckets, count, total) in sorted(histograms.items()):
+            lines = samples[name]
+            for bound, cumulative in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        output = []
+        for name, (metric_type, help_text) in METRICS.items():
+            if not samples[name]:
+                continue
+            output.append(f"# TYPE {name} {metric_type}")
+            output.append(f"# HELP {name} {help_text}.")
+            output.extend(samples[name])
+        output.append("# EOF")
+        return "\n".join(output) + "\n"
@@ -0,0 +1,221 @@
+"""
+Outbound email pacing.
+
+Mail providers cap how fast an account may send (Gmail: per minute and per
+day) and answer bursts with 4xx "try again later" replies. Every sender asks
+the shared ``SendBudget`` for a slot before each message. Slots are handed
+out from a single schedule in SQLite, so all workers of a sharded run
+together stay inside the budget:
+
+- Consecutive slots are at least ``60 / rate`` seconds apart, and further
+  apart when a run asks to be spread across a send window.
+- The rate adapts: a 4xx reply halves it and pauses sending for a moment,
+  and every delivered message nudges it back up towards ``max_per_minute``,
+  so throughput settles just under the provider's real limit.
+- Once ``max_per_day`` messages went out in the last 24 hours, no more slots
+  are given until the oldest ones age out.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Optional
+
+import config_enhanced as config
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_DB = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "outbound.db"
+)
+
+# SMTP reply codes that mean "slow down / try later" rather than a permanent failure
+THROTTLE_CODES = (421, 450, 451, 452, 454)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pacing (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    next_slot REAL NOT NULL,
+    rate REAL NOT NULL,
+    spread_interval REAL NOT NULL DEFAULT 0,
+    spread_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sends (
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sends_sent ON sends (sent_at);
+"""
+
+
+class BudgetExhausted(Exception):
+    """Raised when the daily send cap has been reached.
+
+    Attributes:
+        retry_after: Seconds until enough of the day's sends age out for another one
+    """
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """Check whether an SMTP error is a transient throttling reply."""
+    return getattr(error, "smtp_code", None) in THROTTLE_CODES
+
+
+class SendBudget:
+    """Rate budget for outgoing email shared by every worker."""
+
+    def __init__(self, db_path: Optional[str] = None, settings: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            db_path: Shared SQLite file; defaults to ``data/outbound.db``
+            settings: Overrides for ``config.OUTBOUND_SETTINGS``
+        """
+        self.db_path = db_path
+        self.settings = dict(config.OUTBOUND_SETTINGS)
+        self.settings.update(settings or {})
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.db_path or OUTBOUND_DB
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO pacing (id, next_slot, rate) VALUES (0, 0, ?)",
+                         (float(self.settings["max_per_minute"]),))
+            self._conn = conn
+        return self._conn
+
+    def _transaction(self, fn):
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def spread(self, count: int, window: Optional[float] = None):
+        """Pace the next ``count`` messages evenly across the send window.
+
+        Args:
+            count: Messages the run is about to send
+            window: Seconds to spread them over, defaults to ``send_window`` (0 sends as fast as allowed)
+        """
+        window = self.settings.get("send_window", 0) if window is None else window
+        if not window or count <= 0:
+            return
+        interval = window / count
+
+        def spread(conn):
+            conn.execute("UPDATE pacing SET spread_interval = ?, spread_until = ? WHERE id = 0",
+                         (interval, time.time() + window))
+
+        self._transaction(spread)
+        logger.info(f"Spreading {count} emails over {window:.0f}s ({interval:.2f}s apart at most)")
+
+    def reserve(self) -> float:
+        """Reserve the next send slot.
+
+        Returns:
+            Seconds to wait before sending
+
+        Raises:
+            BudgetExhausted: The daily cap is used up
+        """
+        def reserve(conn):
+            now = time.time()
+            sent_today = conn.execute("SELECT COUNT(*) FROM sends WHERE sent_at > ?", (now - 86400,)).fetchone()[0]
+            if sent_today >= self.settings["max_per_day"]:
+                # The next slot opens when the send that takes the count back under the cap ages out
+                oldest = conn.execute(
+                    "SELECT sent_at FROM sends WHERE sent_at > ? ORDER BY sent_at LIMIT 1 OFFSET ?",
+                    (now - 86400, int(sent_today - self.settings["max_per_day"]))
+                ).fetchone()
+                raise BudgetExhausted(f"Daily send cap of {self.settings['max_per_day']} reached",
+                                      retry_after=max(0.0, oldest[0] + 86400 - now) if oldest else 0.0)
+            next_slot, rate, spread_interval, spread_until = conn.execute(
+                "SELECT next_slot, rate, spread_interval, spread_until FROM pacing WHERE id = 0"
+            ).fetchone()
+            interval = 60.0 / min(rate, self.settings["max_per_minute"])
+            if now < spread_until:
+                interval = max(interval, spread_interval)
+            slot = max(now, next_slot)
+            conn.execute("UPDATE pacing SET next_slot = ? WHERE id = 0", (slot + interval,))
+            return slot - now
+
+        return self._transaction(reserve)
+
+    def acquire(self, keep_alive: Optional[Callable[[], None]] = None):
+        """Block until this worker may send one message (raises ``BudgetExhausted``).
+
+        Args:
+            keep_alive: Called at least every ``keep_alive.interval`` seconds (30 by default)
+                while waiting, e.g. to renew a work unit's lease; may raise to stop waiting
+        """
+        wait = self.reserve()
+        if keep_alive is None:
+            if wait > 0:
+                time.sleep(wait)
+            return
+        step = getattr(keep_alive, "interval", 30)
+        deadline = time.monotonic() + wait
+        while True:
+            keep_alive()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, step))
+
+    def record_sent(self):
+        """Count a delivered message and let the rate recover towards the maximum."""
+        def record(conn):
+            now = time.time()
+            conn.execute("INSERT INTO sends (sent_at) VALUES (?)", (now,))
+            conn.execute("DELETE FROM sends WHERE sent_at < ?", (now - 86400,))
+            conn.execute("UPDATE pacing SET rate = MIN(?, rate + ?) WHERE id = 0",
+                         (float(self.settings["max_per_minute"]), self.settings["recovery_step"]))
+
+        self._transaction(record)
+
+    def record_throttled(self):
+        """Slow down after a 4xx throttling reply."""
+        def throttle(conn):
+            rate = conn.execute("SELECT rate FROM pacing WHERE id = 0").fetchone()[0]
+            rate = max(self.settings["min_per_minute"], rate * self.settings["backoff_factor"])
+            conn.execute("UPDATE pacing SET rate = ?, next_slot = MAX(next_slot, ?) WHERE id = 0",
+                         (rate, time.time() + self.settings["throttle_pause"]))
+            return rate
+
+        rate = self._transaction(throttle)
+        logger.warning(f"Mail server is throttling, slowing down to {rate:.1f} emails/minute")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the current rate and today's send count."""
+        with self._db_lock:
+            conn = self._connection()
+            rate, next_slot = conn.execute("SELECT rate, next_slot FROM pacing WHERE id = 0").fetchone()
+            sent_today = conn.execute("SELECT COUNT(*) FROM sends WHERE sent_at > ?",
+                                      (time.time() - 86400,)).fetchone()[0]
+        return {
+            'rate_per_minute': round(rate, 2),
+            'sent_last_24h': sent_today,
+            'max_per_day': self.settings["max_per_day"],
+            'next_slot_in': round(max(0.0, next_slot - time.time()), 2)
+        }
+
+
+# Global send budget (connects on first use)
+budget = SendBudget()
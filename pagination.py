@@ -0,0 +1,122 @@
+"""
+Cursor pagination for list endpoints.
+
+Listings that grow with the user base (subscriptions, scrape results) are
+returned a page at a time. Each page ends with an opaque ``next_cursor`` that
+encodes where the page stopped (the sort key of its last item), so the next
+page is found with an index lookup instead of skipping over everything
+before it, and pages stay the same size however much data there is.
+"""
+
+import base64
+import binascii
+import heapq
+import json
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import islice
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import config_enhanced as config
+
+
+def encode_cursor(*values: Any) -> str:
+    """Encode a page position (the last item's sort key) as an opaque URL-safe token."""
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, types: Sequence[type]) -> List[Any]:
+    """Decode a cursor made by ``encode_cursor``.
+
+    Args:
+        token: Cursor from a previous page
+        types: Expected type of each value
+
+    Raises:
+        ValueError: The cursor is malformed or wasn't issued for this listing
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(values, types))):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_limit(value: Optional[str]) -> int:
+    """Parse a ``limit`` argument, defaulting to ``API_SETTINGS["page_size"]`` (raises ValueError)."""
+    settings = config.API_SETTINGS
+    if value in (None, ""):
+        return settings.get("page_size", 50)
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be a whole number")
+    maximum = settings.get("max_page_size", 500)
+    if not 1 <= limit <= maximum:
+        raise ValueError(f"limit must be between 1 and {maximum}")
+    return limit
+
+
+def parse_fields(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Parse a comma-separated ``fields`` argument (None means every field)."""
+    if not value:
+        return None
+    return tuple(field.strip() for field in value.split(",") if field.strip()) or None
+
+
+def parse_bool(value: Optional[str]) -> Optional[bool]:
+    """Parse a ``true``/``false`` filter argument (None when not given, raises ValueError)."""
+    if value in (None, ""):
+        return None
+    lowered = value.lower()
+    if lowered in ("1", "true", "yes"):
+        return True
+    if lowered in ("0", "false", "no"):
+        return False
+    raise ValueError(f"Expected true or false, got '{value}'")
+
+
+def select_fields(items: Iterable[Dict[str, Any]], fields: Optional[Sequence[str]]) -> List[Dict[str, Any]]:
+    """Keep only the requested fields of each item (all of them when ``fields`` is None)."""
+    if fields is None:
+        return list(items)
+    return [{field: item[field] for field in fields if field in item} for item in items]
+
+
+class ListIndex:
+    """Positions of a list's items grouped by a key, for paging through filtered views.
+
+    Built once per list; a page of the items whose key matches a filter costs
+    a binary search and ``limit`` steps per matching group.
+    """
+
+    def __init__(self, items: Sequence[Any], key: Callable[[Any], Hashable]):
+        self.items = items
+        self._groups: Dict[Hashable, List[int]] = defaultdict(list)
+        for position, item in enumerate(items):
+            self._groups[key(item)].append(position)
+
+    def _matching(self, match: Optional[Callable[[Hashable], bool]]) -> List[List[int]]:
+        return [positions for key, positions in self._groups.items() if match is None or match(key)]
+
+    def count(self, match: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Count the items whose key matches."""
+        return sum(len(positions) for positions in self._matching(match))
+
+    def page(self, limit: int, after: int = -1,
+             match: Optional[Callable[[Hashable], bool]] = None) -> Tuple[List[int], bool]:
+        """Get the positions of up to ``limit`` matching items after position ``after``.
+
+        Returns:
+            ``(positions, more)``, where ``more`` tells whether further matches follow
+        """
+        tails = []
+        for positions in self._matching(match):
+            start = bisect_right(positions, after)
+            tails.append(map(positions.__getitem__, range(start, len(positions))))
+        found = list(islice(heapq.merge(*tails), limit + 1))
+        return found[:limit], len(found) > limit
@@ -0,0 +1,141 @@
+"""
+Price-drop detection for fresh scrape results.
+
+Fresh prices are compared against the last known and all-time low price from
+the price history for every (recipient, product) subscription at once with
+NumPy, and only the triggered products are handed to the email pipeline.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config_enhanced as config
+import price_history
+import subscriptions_store
+from retailers import registry
+
+logger = logging.getLogger(__name__)
+
+
+def _threshold(rules: Dict[str, Any], key: str) -> float:
+    """Get a numeric rule threshold, NaN when the rule is disabled."""
+    value = rules.get(key)
+    return float("nan") if value is None else float(value)
+
+
+def build_watchlist(recipients: List[str], product_ids: List[str],
+                    subscriptions: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                    default_rules: Optional[Dict[str, Any]] = None) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Expand recipients into (recipient, product_id, rules) rows.
+
+    Recipients with subscriptions watch their subscribed products with their
+    own rules layered over the defaults; everyone else watches ``product_ids``
+    with the default rules.
+    """
+    if subscriptions is None:
+        subscriptions = subscriptions_store.list_all_subscriptions()
+    if default_rules is None:
+        default_rules = config.ALERT_SETTINGS.get("default_rules", {})
+
+    watchlist = []
+    for recipient in recipients:
+        entries = subscriptions.get(recipient.lower(), [])
+        if entries:
+            for entry in entries:
+                rules = dict(default_rules)
+                rules.update(entry.get("rules") or {})
+                watchlist.append((recipient, registry.canonical_url(entry.get("url", "")), rules))
+        else:
+            watchlist.extend((recipient, product_id, default_rules) for product_id in product_ids)
+    return watchlist
+
+
+def detect_price_drops(products: List[Dict[str, Any]], recipients: List[str],
+                       subscriptions: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                       store: Optional[price_history.PriceHistoryStore] = None,
+                       default_rules: Optional[Dict[str, Any]] = None,
+                       before: Optional[float] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Find the products that trigger an alert for each recipient.
+
+    Args:
+        products: Fresh results from ``scrape_products_enhanced``
+        recipients: Email addresses to evaluate
+        subscriptions: Subscriptions by email, defaults to the subscriptions store
+        store: Price history to compare against, defaults to the global history
+        default_rules: Rules for products without their own, defaults to config
+        before: Compare against prices recorded before this epoch timestamp,
+            defaults to the oldest result timestamp (i.e. before this run)
+
+    Returns:
+        Dict mapping recipient to the triggered product dicts, each extended with
+        previous_price, lowest_price, price_drop, price_drop_pct and alert_reasons.
+        Recipients with nothing triggered are omitted.
+    """
+    store = store or price_history.history
+
+    fresh = {}
+    for product in products:
+        if not product.get('success'):
+            continue
+        product_id = product.get('product_id') or registry.canonical_url(product['url'])
+        price = price_history.parse_price(product.get('price'))
+        if product_id not in fresh and not np.isnan(price):
+            fresh[product_id] = (product, price)
+
+    if not fresh or not recipients:
+        return {}
+
+    product_ids = list(fresh)
+    current = np.array([fresh[pid][1] for pid in product_ids], dtype=np.float64)
+
+    # Only compare against points recorded before this run's results
+    if before is None:
+        before = min(price_history.result_timestamp(fresh[pid][0]) for pid in product_ids)
+    last, lowest = store.get_baselines(product_ids, before=before)
+
+    position = {pid: i for i, pid in enumerate(product_ids)}
+    watchlist = [
+        (recipient, position[pid], rules)
+        for recipient, pid, rules in build_watchlist(recipients, product_ids, subscriptions, default_rules)
+        if pid in position
+    ]
+    if not watchlist:
+        return {}
+
+    idx = np.fromiter((row[1] for row in watchlist), dtype=np.intp, count=len(watchlist))
+    min_drop = np.array([_threshold(row[2], "min_drop") for row in watchlist], dtype=np.float64)
+    min_drop_pct = np.array([_threshold(row[2], "min_drop_pct") for row in watchlist], dtype=np.float64)
+    target = np.array([_threshold(row[2], "target_price") for row in watchlist], dtype=np.float64)
+    want_low = np.array([bool(row[2].get("all_time_low")) for row in watchlist], dtype=bool)
+
+    cur, prev, low = current[idx], last[idx], lowest[idx]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drop = prev - cur
+        drop_pct = np.where(prev > 0, drop / prev * 100.0, np.nan)
+        # Comparisons against NaN (missing history or disabled rule) are False
+        hits = {
+            "price_drop": drop >= min_drop,
+            "percent_drop": drop_pct >= min_drop_pct,
+            "below_target": cur <= target,
+            "all_time_low": want_low & (cur < low),
+        }
+    triggered = np.logical_or.reduce(list(hits.values()))
+
+    alerts: Dict[str, List[Dict[str, Any]]] = {}
+    for row in np.flatnonzero(triggered):
+        recipient, i, _ = watchlist[row]
+        item = dict(fresh[product_ids[i]][0])
+        item.update({
+            'previous_price': None if np.isnan(prev[row]) else float(prev[row]),
+            'lowest_price': None if np.isnan(low[row]) else float(low[row]),
+            'price_drop': None if np.isnan(drop[row]) else float(drop[row]),
+            'price_drop_pct': None if np.isnan(drop_pct[row]) else float(drop_pct[row]),
+            'alert_reasons': [reason for reason, hit in hits.items() if hit[row]]
+        })
+        alerts.setdefault(recipient, []).append(item)
+
+    logger.info(f"Price alerts: {int(triggered.sum())} triggered across {len(alerts)} recipients "
+                f"({len(watchlist)} watched products evaluated)")
+    return alerts
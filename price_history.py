@@ -0,0 +1,382 @@
+"""
+Price history store: a per-product time series of every scrape outcome.
+
+Results are appended to a SQLite table indexed on (product_id, ts), where the
+product id is the canonical product URL. Range queries return NumPy arrays so
+callers can run vectorised comparisons over the series.
+
+The store also keeps each product's latest successful scrape and its refresh
+schedule, so any process can reuse snapshots the refresh scheduler fetched.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import config_enhanced as config
+
+logger = logging.getLogger(__name__)
+
+PRICE_HISTORY_DB = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "price_history.db"
+)
+
+SECONDS_PER_DAY = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    retailer TEXT,
+    name TEXT,
+    updated_at REAL,
+    price_text TEXT,
+    image TEXT
+);
+CREATE TABLE IF NOT EXISTS refresh_state (
+    product_id TEXT PRIMARY KEY,
+    last_fetched REAL,
+    next_due REAL NOT NULL,
+    retry_after REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS prices (
+    product_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    price REAL,
+    success INTEGER NOT NULL,
+    downsampled INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_prices_product_ts ON prices (product_id, ts);
+"""
+
+_PRICE_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def parse_price(price: Optional[str]) -> float:
+    """Parse a scraped price string such as "$120USD" into a float.
+
+    Returns NaN when no number can be found (e.g. "Price not found").
+    """
+    if not price:
+        return float("nan")
+    match = _PRICE_PATTERN.search(str(price))
+    if not match:
+        return float("nan")
+    try:
+        return float(match.group(0).replace(",", ""))
+    except ValueError:
+        return float("nan")
+
+
+def result_timestamp(result: Dict[str, Any]) -> float:
+    """Get the epoch timestamp of a scrape result, defaulting to now."""
+    stamp = result.get("timestamp")
+    if stamp:
+        try:
+            return datetime.fromisoformat(stamp).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return time.time()
+
+
+class PriceHistoryStore:
+    """Append-only price time series backed by SQLite.
+
+    The connection is opened lazily on first use, so creating the module-level
+    instance costs nothing until history is actually recorded or queried.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.db_path or PRICE_HISTORY_DB
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+            for column in ("price_text", "image"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE products ADD COLUMN {column} TEXT")  # Files from before snapshots
+            self._conn = conn
+        return self._conn
+
+    def record_results(self, results: Iterable[Dict[str, Any]]) -> int:
+        """Append scrape results (as produced by ``scrape_multiple``) to the history.
+
+        Returns:
+            Number of price points written
+        """
+        rows = []
+        products = []
+        for result in results:
+            product_id = result.get("product_id") or result.get("url")
+            if not product_id:
+                continue
+            ts = result_timestamp(result)
+            success = bool(result.get("success"))
+            price = parse_price(result.get("price")) if success else float("nan")
+            rows.append((product_id, ts, None if np.isnan(price) else price, int(success)))
+            if success:
+                products.append((product_id, result.get("url", product_id), result.get("retailer"), result.get("name"), ts,
+                                 result.get("price"), result.get("image", "")))
+
+        if not rows:
+            return 0
+
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO prices (product_id, ts, price, success) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                conn.executemany(
+                    "INSERT INTO products (product_id, url, retailer, name, updated_at, price_text, image) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(product_id) DO UPDATE SET url=excluded.url, retailer=excluded.retailer, "
+                    "name=excluded.name, updated_at=excluded.updated_at, price_text=excluded.price_text, "
+                    "image=excluded.image",
+                    products
+                )
+        logger.debug(f"Recorded {len(rows)} price points")
+        return len(rows)
+
+    def get_range(self, product_id: str, days: Optional[float] = None,
+                  start: Optional[float] = None, end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the price series for a product.
+
+        Args:
+            product_id: Canonical product URL
+            days: Only return the last ``days`` days (ignored if ``start`` is given)
+            start: Epoch seconds lower bound (inclusive)
+            end: Epoch seconds upper bound (inclusive), defaults to now
+
+        Returns:
+            Tuple of (timestamps, prices) as float64 arrays; failed scrapes are NaN
+        """
+        end = time.time() if end is None else end
+        if start is None:
+            start = end - days * SECONDS_PER_DAY if days is not None else 0.0
+
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT ts, price FROM prices WHERE product_id = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+                (product_id, start, end)
+            ).fetchall()
+
+        if not rows:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+        data = np.array(rows, dtype=np.float64)  # NULL prices become NaN
+        return data[:, 0], data[:, 1]
+
+    def get_baselines(self, product_ids: List[str], before: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the last known and all-time low price for many products in one pass.
+
+        Args:
+            product_ids: Canonical product URLs
+            before: Only consider points strictly before this epoch timestamp
+
+        Returns:
+            Tuple of (last_prices, lowest_prices) aligned with ``product_ids``;
+            products without a successful price point are NaN
+        """
+        last = np.full(len(product_ids), np.nan, dtype=np.float64)
+        lowest = np.full(len(product_ids), np.nan, dtype=np.float64)
+        if not product_ids:
+            return last, lowest
+
+        before = time.time() if before is None else before
+        positions: Dict[str, List[int]] = {}
+        for i, product_id in enumerate(product_ids):
+            positions.setdefault(product_id, []).append(i)
+
+        unique_ids = list(positions)
+        rows = []
+        with self._lock:
+            conn = self._connection()
+            # Stay well below SQLite's bound-parameter limit
+            for offset in range(0, len(unique_ids), 500):
+                chunk = unique_ids[offset:offset + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(conn.execute(
+                    "SELECT product_id, "
+                    "(SELECT q.price FROM prices q WHERE q.product_id = p.product_id AND q.price IS NOT NULL "
+                    " AND q.ts < ? ORDER BY q.ts DESC LIMIT 1), "
+                    "MIN(price) "
+                    f"FROM prices p WHERE product_id IN ({placeholders}) AND ts < ? AND price IS NOT NULL "
+                    "GROUP BY product_id",
+                    (before, *chunk, before)
+                ).fetchall())
+
+        for product_id, last_price, low_price in rows:
+            for i in positions[product_id]:
+                last[i] = last_price
+                lowest[i] = low_price
+        return last, lowest
+
+    def get_change_rates(self, product_ids: List[str], days: float = 14, now: Optional[float] = None) -> np.ndarray:
+        """Get how often each product's price changed between consecutive successful scrapes.
+
+        Returns:
+            Float64 array aligned with ``product_ids`` holding the fraction of
+            consecutive observations where the price changed (NaN without data)
+        """
+        rates = np.full(len(product_ids), np.nan, dtype=np.float64)
+        if not product_ids:
+            return rates
+
+        now = time.time() if now is None else now
+        position: Dict[str, int] = {}
+        for i, product_id in enumerate(product_ids):
+            position.setdefault(product_id, i)
+        unique_ids = list(position)
+        rows = []
+        with self._lock:
+            conn = self._connection()
+            for offset in range(0, len(unique_ids), 500):
+                chunk = unique_ids[offset:offset + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(conn.execute(
+                    f"SELECT product_id, price FROM prices WHERE product_id IN ({placeholders}) "
+                    "AND ts >= ? AND price IS NOT NULL ORDER BY product_id, ts",
+                    (*chunk, now - days * SECONDS_PER_DAY)
+                ).fetchall())
+        if len(rows) < 2:
+            return rates
+
+        codes = np.fromiter((position[r[0]] for r in rows), dtype=np.intp, count=len(rows))
+        prices = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+        same = codes[1:] == codes[:-1]
+        changed = same & (prices[1:] != prices[:-1])
+        pairs = np.bincount(codes[1:][same], minlength=len(product_ids))
+        changes = np.bincount(codes[1:][changed], minlength=len(product_ids))
+
+        observed = pairs > 0
+        rates[observed] = changes[observed] / pairs[observed]
+        # Duplicate ids share the rate of their first position
+        for i, product_id in enumerate(product_ids):
+            rates[i] = rates[position[product_id]]
+        return rates
+
+    def _select_chunked(self, query: str, product_ids: List[str], *params: Any) -> List[Tuple]:
+        """Run ``query`` (with ``{ids}`` for the id placeholders) over product ids in chunks."""
+        rows = []
+        with self._lock:
+            conn = self._connection()
+            for offset in range(0, len(product_ids), 500):
+                chunk = product_ids[offset:offset + 500]
+                rows.extend(conn.execute(query.format(ids=",".join("?" * len(chunk))), (*chunk, *params)).fetchall())
+        return rows
+
+    def get_snapshots(self, product_ids: List[str], since: float) -> Dict[str, Dict[str, Any]]:
+        """Get the latest successful scrape of each product scraped at or after ``since``.
+
+        Returns:
+            Scrape result dicts (as from ``scrape_multiple``) by product id
+        """
+        rows = self._select_chunked(
+            "SELECT product_id, url, retailer, name, updated_at, price_text, image FROM products "
+            "WHERE product_id IN ({ids}) AND updated_at >= ? AND price_text IS NOT NULL",
+            list(dict.fromkeys(product_ids)), since
+        )
+        return {
+            product_id: {
+                'url': url,
+                'product_id': product_id,
+                'name': name,
+                'price': price_text,
+                'image': image or "",
+                'retailer': retailer,
+                'timestamp': datetime.fromtimestamp(updated_at).isoformat(),
+                'success': True
+            }
+            for product_id, url, retailer, name, updated_at, price_text, image in rows
+        }
+
+    def get_refresh_state(self, product_ids: List[str]) -> Dict[str, Tuple[Optional[float], float, float]]:
+        """Get the saved (last_fetched, next_due, retry_after) of each product."""
+        rows = self._select_chunked(
+            "SELECT product_id, last_fetched, next_due, retry_after FROM refresh_state WHERE product_id IN ({ids})",
+            list(dict.fromkeys(product_ids))
+        )
+        return {product_id: (last_fetched, next_due, retry_after)
+                for product_id, last_fetched, next_due, retry_after in rows}
+
+    def save_refresh_state(self, states: Iterable[Tuple[str, Optional[float], float, float]]):
+        """Save (product_id, last_fetched, next_due, retry_after) rows of the refresh schedule."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO refresh_state (product_id, last_fetched, next_due, retry_after) "
+                    "VALUES (?, ?, ?, ?)", list(states)
+                )
+
+    def list_products(self) -> List[Dict[str, Any]]:
+        """List products that have at least one successful price point."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT product_id, url, retailer, name, updated_at FROM products ORDER BY product_id"
+            ).fetchall()
+        return [
+            {"product_id": r[0], "url": r[1], "retailer": r[2], "name": r[3], "updated_at": r[4]}
+            for r in rows
+        ]
+
+    def apply_retention(self, retention_days: Optional[int] = None, now: Optional[float] = None) -> int:
+        """Downsample points older than the retention window to one point per product per day.
+
+        The daily point keeps the lowest successful price of that day, so sale
+        lows survive downsampling. Whole days are processed at once, which keeps
+        repeated runs from producing more than one point per day.
+
+        Returns:
+            Number of raw points removed
+        """
+        if retention_days is None:
+            retention_days = config.PERFORMANCE_SETTINGS.get("log_retention_days", 30)
+        now = time.time() if now is None else now
+        cutoff = (int(now - retention_days * SECONDS_PER_DAY) // SECONDS_PER_DAY) * SECONDS_PER_DAY
+
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO prices (product_id, ts, price, success, downsampled) "
+                    "SELECT product_id, MAX(ts), MIN(price), MAX(success), 1 FROM prices "
+                    "WHERE ts < ? AND downsampled = 0 "
+                    "GROUP BY product_id, CAST(ts / ? AS INTEGER)",
+                    (cutoff, SECONDS_PER_DAY)
+                )
+                removed = conn.execute(
+                    "DELETE FROM prices WHERE ts < ? AND downsampled = 0", (cutoff,)
+                ).rowcount
+
+        if removed:
+            logger.info(f"Price history retention: downsampled {removed} points older than {retention_days} days")
+        return removed
+
+    def close(self):
+        """Close the underlying connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Global history instance (connects on first use)
+history = PriceHistoryStore()
@@ -0,0 +1,209 @@
+"""
+On-demand profiling of scheduler jobs, CLI commands and web requests.
+
+When ``PERFORMANCE_SETTINGS["enable_profiling"]`` is on, each wrapped run is
+profiled and written to the profile directory:
+
+- ``deterministic`` mode uses cProfile and writes ``<run>.pstats`` (load with
+  ``python -m pstats`` or snakeviz) plus a ``<run>.txt`` summary.
+- ``sampling`` mode samples the run's stack every ``profiling_interval``
+  seconds and writes ``<run>.collapsed`` (one ``frame;frame;frame count``
+  line per stack, the input format of flamegraph.pl and speedscope). It is
+  much cheaper than cProfile for long runs.
+
+Only the newest ``profiling_keep`` profiles are kept.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import config_enhanced as config
+
+logger = logging.getLogger(__name__)
+
+PROFILES_DIR = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "profiles"
+)
+
+PROFILE_EXTENSIONS = (".pstats", ".collapsed", ".txt")
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Sampler:
+    """Samples one thread's call stack on a background thread."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Dict[str, int]:
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+
+class Profiler:
+    """Profiles named runs when profiling is enabled in config."""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._local = threading.local()
+
+    def _dir(self) -> str:
+        return self.directory or PROFILES_DIR
+
+    @property
+    def enabled(self) -> bool:
+        return bool(config.PERFORMANCE_SETTINGS.get("enable_profiling", False))
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """Profile the enclosed block as a run called ``name``.
+
+        Does nothing when profiling is disabled or when this thread is already
+        inside a profiled run (the outer run covers it).
+        """
+        if not self.enabled or getattr(self._local, "active", False):
+            yield
+            return
+
+        mode = config.PERFORMANCE_SETTINGS.get("profiling_mode", "deterministic")
+        self._local.active = True
+        started = time.perf_counter()
+        if mode == "sampling":
+            collector: Any = _Sampler(threading.get_ident(), config.PERFORMANCE_SETTINGS.get("profiling_interval", 0.005))
+            collector.start()
+        else:
+            collector = cProfile.Profile()
+            collector.enable()
+        try:
+            yield
+        finally:
+            if mode == "sampling":
+                result = collector.stop()
+            else:
+                collector.disable()
+                result = collector
+            self._local.active = False
+            try:
+                self._write(name, result, time.perf_counter() - started)
+            except Exception as e:
+                logger.warning(f"Failed to write profile for {name}: {e}")
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        """Wrap a callable (e.g. a scheduler job) so each call is profiled."""
+        def profiled(*args, **kwargs):
+            with self.profile(name):
+                return fn(*args, **kwargs)
+        profiled.__name__ = getattr(fn, "__name__", name)
+        profiled.__doc__ = getattr(fn, "__doc__", None)
+        return profiled
+
+    def _write(self, name: str, result: Any, duration: float) -> str:
+        directory = self._dir()
+        os.makedirs(directory, exist_ok=True)
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "run"
+        base = os.path.join(
+            directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}-{safe_name}"
+        )
+
+        if isinstance(result, dict):
+            path = f"{base}.collapsed"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(result.items(), key=lambda item: -item[1]):
+                    f.write(f"{stack} {count}\n")
+        else:
+            path = f"{base}.pstats"
+            result.dump_stats(path)
+            summary = io.StringIO()
+            summary.write(f"{name}: {duration:.3f}s\n\n")
+            pstats.Stats(result, stream=summary).sort_stats("cumulative").print_stats(40)
+            with open(f"{base}.txt", "w", encoding="utf-8") as f:
+                f.write(summary.getvalue())
+
+        logger.info(f"Profiled {name} in {duration:.2f}s -> {path}")
+        self._prune()
+        return path
+
+    def _prune(self):
+        """Keep only the newest ``profiling_keep`` profiles."""
+        keep = config.PERFORMANCE_SETTINGS.get("profiling_keep", 50)
+        runs: Dict[str, List[str]] = {}
+        for filename in os.listdir(self._dir()):
+            stem, ext = os.path.splitext(filename)
+            if ext in PROFILE_EXTENSIONS:
+                runs.setdefault(stem, []).append(filename)
+        for stem in sorted(runs, reverse=True)[keep:]:
+            for filename in runs[stem]:
+                try:
+                    os.remove(os.path.join(self._dir(), filename))
+                except OSError:
+                    pass
+
+    def list_profiles(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """List the newest profile files, newest first."""
+        directory = self._dir()
+        if not os.path.isdir(directory):
+            return []
+        profiles = []
+        for filename in sorted(os.listdir(directory), reverse=True):
+            stem, ext = os.path.splitext(filename)
+            if ext not in (".pstats", ".collapsed"):
+                continue
+            path = os.path.join(directory, filename)
+            date, clock, micros, pid, run = (stem.split("-", 4) + [""] * 5)[:5]
+            profiles.append({
+                'file': filename,
+                'run': run,
+                'pid': pid,
+                'format': ext.lstrip("."),
+                'summary': f"{stem}.txt" if os.path.exists(os.path.join(directory, f"{stem}.txt")) else None,
+                'size': os.path.getsize(path),
+                'created': datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+            })
+            if len(profiles) >= limit:
+                break
+        return profiles
+
+    def profile_path(self, filename: str) -> Optional[str]:
+        """Resolve a profile file name inside the profile directory (None if invalid)."""
+        if os.path.basename(filename) != filename or os.path.splitext(filename)[1] not in PROFILE_EXTENSIONS:
+            return None
+        path = os.path.join(self._dir(), filename)
+        return path if os.path.isfile(path) else None
+
+
+# Global profiler
+profiler = Profiler()
@@ -0,0 +1,286 @@
+"""
+Incremental refresh scheduling.
+
+Instead of re-scraping every product at email time, each tracked product gets
+its own ``next_due`` time. The refresh interval starts from the retailer's
+``cache_ttl`` and stretches towards ``max_interval`` for products whose price
+rarely changes and for products nobody subscribes to. Small batches of due
+products are fetched on every tick, and products that would otherwise be
+stale when the daily email goes out are slotted into the hours before it, so
+the email is built almost entirely from snapshots that are already fresh.
+
+Refresh times are saved in the price history store, and snapshots are read
+back from it, so a daily run started in another process (a web worker or a
+``daily-run`` worker) or after a restart still reuses what was fetched. This
+needs ``STORAGE_SETTINGS["enable_price_history"]``; without it, only the
+process that fetched a snapshot can reuse it.
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config_enhanced as config
+import price_history
+from retailers import registry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RefreshEntry:
+    """Refresh state for one canonical product."""
+    product_id: str
+    url: str
+    retailer: str
+    subscribers: int = 0
+    interval: float = 0.0
+    next_due: float = 0.0
+    last_fetched: Optional[float] = None
+    retry_after: float = 0.0
+    result: Optional[Dict[str, Any]] = None
+
+
+class RefreshScheduler:
+    """Tracks per-product refresh times and fetches due products in batches."""
+
+    def __init__(self, scrape_fn: Callable[[List[str]], List[Dict[str, Any]]],
+                 store: Optional[price_history.PriceHistoryStore] = None,
+                 settings: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            scrape_fn: Scrapes a list of URLs and returns result dicts
+                (recording metrics and history is left to this function)
+            store: Price history used to estimate price volatility
+            settings: Overrides for ``config.REFRESH_SETTINGS``
+        """
+        self.scrape_fn = scrape_fn
+        self.store = store or price_history.history
+        self.settings = dict(config.REFRESH_SETTINGS)
+        self.settings.update(settings or {})
+        self.entries: Dict[str, RefreshEntry] = {}
+        self.last_delivery: Optional[float] = None
+        self._lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+
+    def _next_email_time(self, now: float) -> float:
+        """Get the next daily email time after ``now`` as an epoch timestamp."""
+        hour, minute = (int(part) for part in config.EMAIL_SETTINGS.get("schedule_time", "21:00").split(":"))
+        current = datetime.fromtimestamp(now)
+        email_at = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if email_at.timestamp() <= now:
+            email_at += timedelta(days=1)
+        return email_at.timestamp()
+
+    def _next_due(self, entry: RefreshEntry, now: float) -> float:
+        """Get when a fetched product should be fetched next."""
+        last = entry.last_fetched
+        due = last + entry.interval
+
+        # Guarantee a snapshot no older than max_staleness when the email is built.
+        # Products are spread across that window by a stable hash of their id.
+        max_staleness = self.settings["max_staleness"]
+        email_at = self._next_email_time(now)
+        window_start = email_at - max_staleness
+        if due > email_at and last < window_start and entry.subscribers > 0:
+            offset = (zlib.crc32(entry.product_id.encode("utf-8")) % 1000) / 1000.0
+            lead = min(self.settings["tick_interval"] * 2, max_staleness / 2)
+            due = window_start + offset * (max_staleness - lead)
+        return max(due, now, entry.retry_after)
+
+    def _compute_intervals(self, entries: List[RefreshEntry], now: float) -> np.ndarray:
+        """Compute refresh intervals for many products at once."""
+        product_ids = [entry.product_id for entry in entries]
+        volatility = self.store.get_change_rates(product_ids, days=self.settings["volatility_window_days"], now=now)
+        volatility = np.where(np.isnan(volatility), self.settings["default_volatility"], volatility)
+
+        min_interval = np.array(
+            [config.get_retailer_config(entry.retailer).get("cache_ttl", 3600) for entry in entries],
+            dtype=np.float64
+        )
+        max_interval = np.maximum(float(self.settings["max_interval"]), min_interval)
+        subscribed = np.array([entry.subscribers > 0 for entry in entries], dtype=bool)
+
+        # Volatile products refresh at cache_ttl, stable ones at max_interval
+        intervals = max_interval - (max_interval - min_interval) * np.clip(volatility, 0.0, 1.0)
+        intervals = np.where(subscribed, intervals, intervals * self.settings["unsubscribed_multiplier"])
+        return intervals
+
+    def sync(self, product_links: Dict[str, List[str]], subscriber_counts: Dict[str, int],
+             now: Optional[float] = None) -> int:
+        """Update the tracked product set and recompute refresh intervals.
+
+        Args:
+            product_links: Products to track, grouped by retailer
+            subscriber_counts: Number of subscribers per canonical product id
+            now: Current epoch timestamp
+
+        Returns:
+            Number of tracked products
+        """
+        now = time.time() if now is None else now
+        wanted: Dict[str, Tuple[str, str]] = {}
+        for retailer_name, urls in product_links.items():
+            for url in urls:
+                retailer = registry.get_retailer_for_url(url)
+                wanted.setdefault(registry.canonical_url(url), (url, retailer.name if retailer else retailer_name))
+
+        with self._lock:
+            for product_id in list(self.entries):
+                if product_id not in wanted:
+                    del self.entries[product_id]
+
+            new_entries = []
+            for product_id, (url, retailer_name) in wanted.items():
+                entry = self.entries.get(product_id)
+                if entry is None:
+                    entry = RefreshEntry(product_id=product_id, url=url, retailer=retailer_name)
+                    self.entries[product_id] = entry
+                    new_entries.append(entry)
+                entry.subscribers = subscriber_counts.get(product_id, 0)
+
+            entries = list(self.entries.values())
+
+        if not entries:
+            return 0
+
+        intervals = self._compute_intervals(entries, now)
+        # Products another process or an earlier run already fetched keep their schedule
+        restored = self._load_state([entry.product_id for entry in new_entries])
+
+        with self._lock:
+            batch_size = max(1, self.settings["batch_size"])
+            tick = self.settings["tick_interval"]
+            for entry, interval in zip(entries, intervals):
+                entry.interval = float(interval)
+                if entry.last_fetched is not None:
+                    entry.next_due = self._next_due(entry, now)
+            for entry in new_entries:
+                if entry.product_id in restored:
+                    entry.last_fetched, entry.next_due, entry.retry_after = restored[entry.product_id]
+                    if entry.last_fetched is not None:
+                        entry.next_due = self._next_due(entry, now)
+            # Products seen for the first time are staggered over the next ticks
+            unseen = [entry for entry in new_entries if entry.product_id not in restored]
+            for position, entry in enumerate(unseen):
+                entry.next_due = now + (position // batch_size) * tick
+
+        logger.debug(f"Refresh scheduler tracking {len(entries)} products ({len(new_entries)} new)")
+        return len(entries)
+
+    def due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[RefreshEntry]:
+        """Get the products whose refresh is due, most overdue first."""
+        now = time.time() if now is None else now
+        limit = self.settings["batch_size"] if limit is None else limit
+        with self._lock:
+            due = [entry for entry in self.entries.values() if entry.next_due <= now]
+        due.sort(key=lambda entry: entry.next_due)
+        return due[:limit]
+
+    def _load_state(self, product_ids: List[str]) -> Dict[str, Tuple[Optional[float], float, float]]:
+        if not product_ids:
+            return {}
+        try:
+            return self.store.get_refresh_state(product_ids)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to load refresh schedule: {e}")
+            return {}
+
+    def remember(self, results: List[Dict[str, Any]], now: Optional[float] = None):
+        """Store fresh results and push back the products' next refresh."""
+        now = time.time() if now is None else now
+        states = []
+        with self._lock:
+            for result in results:
+                entry = self.entries.get(result.get('product_id') or registry.canonical_url(result['url']))
+                if entry is None:
+                    continue
+                if result.get('success'):
+                    entry.result = result
+                    entry.last_fetched = now
+                    entry.next_due = self._next_due(entry, now)
+                else:
+                    # Back off before retrying, keeping the last good snapshot
+                    entry.retry_after = now + min(entry.interval, self.settings["tick_interval"] * 3)
+                    entry.next_due = entry.retry_after
+                states.append((entry.product_id, entry.last_fetched, entry.next_due, entry.retry_after))
+        if states:
+            try:
+                self.store.save_refresh_state(states)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to save refresh schedule: {e}")
+
+    def run_batch(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Fetch one batch of due products.
+
+        Returns:
+            Results of the products fetched in this batch
+        """
+        if not self._batch_lock.acquire(blocking=False):
+            logger.debug("Refresh batch already running, skipping tick")
+            return []
+        try:
+            batch = self.due(now)
+            if not batch:
+                return []
+            logger.info(f"Refreshing {len(batch)} due products")
+            results = self.scrape_fn([entry.url for entry in batch])
+            self.remember(results)
+            return results
+        finally:
+            self._batch_lock.release()
+
+    def collect(self, urls: List[str], now: Optional[float] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Split products into already-fresh snapshots and URLs that need a scrape.
+
+        Returns:
+            Tuple of (fresh results, stale URLs)
+        """
+        now = time.time() if now is None else now
+        max_age = self.settings["max_staleness"]
+        fresh, missing = [], []
+        with self._lock:
+            for url in urls:
+                entry = self.entries.get(registry.canonical_url(url))
+                if entry and entry.result and entry.last_fetched is not None and now - entry.last_fetched <= max_age:
+                    fresh.append(entry.result)
+                else:
+                    missing.append(url)
+        if not missing:
+            return fresh, []
+
+        # Snapshots fetched by other processes (or before a restart)
+        try:
+            stored = self.store.get_snapshots([registry.canonical_url(url) for url in missing], since=now - max_age)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to load stored snapshots: {e}")
+            stored = {}
+        stale = []
+        for url in missing:
+            snapshot = stored.get(registry.canonical_url(url))
+            if snapshot is not None:
+                fresh.append(snapshot)
+            else:
+                stale.append(url)
+        return fresh, stale
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get refresh scheduler statistics."""
+        now = time.time()
+        with self._lock:
+            entries = list(self.entries.values())
+        fresh = sum(1 for e in entries if e.last_fetched is not None and now - e.last_fetched <= self.settings["max_staleness"])
+        return {
+            'tracked': len(entries),
+            'fresh': fresh,
+            'due': sum(1 for e in entries if e.next_due <= now),
+            'next_due': min((e.next_due for e in entries), default=None),
+            'last_delivery': self.last_delivery
+        }
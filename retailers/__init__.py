@@ -2,9 +2,26 @@
 Retailers package for extensible retailer support.
 """
 
+import importlib
+
 from .base import BaseRetailer
-from .lululemon import LululemonRetailer  
-from .nike import NikeRetailer
+from .metrics import LatencyHistogram, LatencyRecorder, latency
+from .tracing import Tracer, tracer
+from .plugins import RetailerSpec
 from .registry import RetailerRegistry, registry
 
-__all__ = ['BaseRetailer', 'LululemonRetailer', 'NikeRetailer', 'RetailerRegistry', 'registry']
\ No newline at end of file
+# Scraper classes are imported on first access, so importing the package doesn't load every retailer
+_LAZY = {
+    'LululemonRetailer': '.lululemon',
+    'NikeRetailer': '.nike',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['BaseRetailer', 'LululemonRetailer', 'NikeRetailer', 'RetailerRegistry', 'registry',
+           'LatencyHistogram', 'LatencyRecorder', 'latency', 'Tracer', 'tracer', 'RetailerSpec']
@@ -3,29 +3,52 @@ Base class for retailer scrapers.
 """
 
 from abc import ABC, abstractmethod
-from typing import Tuple, Dict, Any, Optional
-import requests
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING, Tuple, Dict, Any, Optional
+from urllib.parse import urlparse, parse_qsl, urlencode
 import logging
+import threading
 import time
 from datetime import datetime
 
+from .metrics import latency
+from .tracing import tracer
+
+# requests and BeautifulSoup are imported on first scrape: they dominate the
+# import time of the package, and most commands never scrape
+if TYPE_CHECKING:
+    import requests
+    from bs4 import BeautifulSoup
+
 logger = logging.getLogger(__name__)
 
 
 class BaseRetailer(ABC):
     """Abstract base class for retailer scrapers."""
     
+    # Query parameters that identify a distinct product variant; everything
+    # else (tracking ids, locale, size) is dropped from the canonical URL.
+    canonical_query_params: Tuple[str, ...] = ()
+    
     def __init__(self, name: str, user_agent: str = None, timeout: int = 10, retry_attempts: int = 3):
         self.name = name
         self.user_agent = user_agent or "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         self.timeout = timeout
         self.retry_attempts = retry_attempts
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": self.user_agent})
+        self._local = threading.local()
+    
+    @property
+    def session(self) -> "requests.Session":
+        """HTTP session for the calling thread (sessions are not shared across threads)."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            session.headers.update({"User-Agent": self.user_agent})
+            self._local.session = session
+        return session
     
     @abstractmethod
-    def extract_product_info(self, soup: BeautifulSoup, url: str) -> Tuple[str, str, str]:
+    def extract_product_info(self, soup: "BeautifulSoup", url: str) -> Tuple[str, str, str]:
         """Extract product name, price, and image URL from BeautifulSoup object.
         
         Args:
@@ -61,29 +84,64 @@ class BaseRetailer(ABC):
         if not self.is_supported_url(url):
             logger.warning(f"URL not supported by {self.name}: {url}")
             return "Unsupported URL", "Price not found", ""
-            
-        for attempt in range(self.retry_attempts):
-            try:
-                response = self.session.get(url, timeout=self.timeout)
-                response.raise_for_status()
-                
-                soup = BeautifulSoup(response.text, "html.parser")
-                name, price, image = self.extract_product_info(soup, url)
-                
-                logger.info(f"Successfully scraped {self.name} product: {name} - {price}")
-                return name, price, image
-                
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"{self.name} scraping attempt {attempt + 1} failed: {e}")
-                if attempt < self.retry_attempts - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                else:
-                    logger.error(f"Failed to scrape {self.name} product after {self.retry_attempts} attempts: {e}")
-                    return "Product name not found", "Price not found", ""
+        
+        import requests
+        from bs4 import BeautifulSoup
+        
+        with tracer.span("scrape_product", cat="retailer", retailer=self.name, url=url) as span:
+            for attempt in range(self.retry_attempts):
+                span.set(attempts=attempt + 1)
+                try:
+                    # Stream so connecting (up to the response headers) and
+                    # downloading the body are timed separately
+                    with latency.time(self.name, "connect"), tracer.span("connect", cat="retailer"):
+                        response = self.session.get(url, timeout=self.timeout, stream=True)
+                    try:
+                        response.raise_for_status()
+                        with latency.time(self.name, "download"), tracer.span("download", cat="retailer"):
+                            html = response.text
+                    finally:
+                        response.close()
+                    
+                    with latency.time(self.name, "parse"), tracer.span("parse", cat="retailer"):
+                        soup = BeautifulSoup(html, "html.parser")
+                    with latency.time(self.name, "extract"), tracer.span("extract_product_info", cat="retailer"):
+                        name, price, image = self.extract_product_info(soup, url)
                     
-            except Exception as e:
-                logger.error(f"Unexpected error scraping {self.name} product: {e}")
-                return "Product name not found", "Price not found", ""
+                    logger.info(f"Successfully scraped {self.name} product: {name} - {price}")
+                    return name, price, image
+                    
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"{self.name} scraping attempt {attempt + 1} failed: {e}")
+                    if attempt < self.retry_attempts - 1:
+                        with tracer.span("retry_backoff", cat="retailer", attempt=attempt + 1, error=str(e)):
+                            time.sleep(2 ** attempt)  # Exponential backoff
+                    else:
+                        logger.error(f"Failed to scrape {self.name} product after {self.retry_attempts} attempts: {e}")
+                        span.set(error=str(e))
+                        return "Product name not found", "Price not found", ""
+                        
+                except Exception as e:
+                    logger.error(f"Unexpected error scraping {self.name} product: {e}")
+                    span.set(error=str(e))
+                    return "Product name not found", "Price not found", ""
+    
+    def canonical_url(self, url: str) -> str:
+        """Normalise a product URL so that tracking variants map to one product.
+        
+        Args:
+            url: Product URL as entered or linked
+            
+        Returns:
+            Lower-cased scheme/host and path with only variant-defining query params
+        """
+        parsed = urlparse(url.strip())
+        kept = [(k, v) for k, v in parse_qsl(parsed.query) if k in self.canonical_query_params]
+        path = parsed.path.rstrip("/") or "/"
+        canonical = f"{parsed.scheme.lower()}://{parsed.netloc.lower()}{path}"
+        if kept:
+            canonical += "?" + urlencode(sorted(kept))
+        return canonical
     
     def get_cache_key(self, url: str) -> str:
         """Generate cache key for a URL."""
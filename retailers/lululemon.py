@@ -3,17 +3,21 @@ Lululemon retailer scraper.
 """
 
 import json
-from typing import Tuple
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING, Tuple
 import logging
 from .base import BaseRetailer
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
 logger = logging.getLogger(__name__)
 
 
 class LululemonRetailer(BaseRetailer):
     """Lululemon product scraper."""
     
+    canonical_query_params = ("color",)
+    
     def __init__(self, **kwargs):
         super().__init__(name="lululemon", **kwargs)
     
@@ -21,7 +25,7 @@ class LululemonRetailer(BaseRetailer):
         """Check if URL is a Lululemon product page."""
         return "shop.lululemon.com" in url
     
-    def extract_product_info(self, soup: BeautifulSoup, url: str) -> Tuple[str, str, str]:
+    def extract_product_info(self, soup: "BeautifulSoup", url: str) -> Tuple[str, str, str]:
         """Extract product information from Lululemon page."""
         try:
             # Try to find JSON-LD data first (primary method)
@@ -0,0 +1,239 @@
+"""
+Latency histograms for scraping, per retailer and per stage.
+"""
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+import math
+import threading
+import time
+import weakref
+
+# Stages timed for every scrape:
+#   connect      - DNS, TCP/TLS connect and waiting for the response headers
+#   download     - reading the response body
+#   parse        - building the BeautifulSoup tree
+#   extract      - retailer-specific extraction of name/price/image
+#   cache_lookup - registry cache check
+#   total        - one product end to end (cache hit or fetch incl. retries)
+STAGES = ("connect", "download", "parse", "extract", "cache_lookup", "total")
+
+PERCENTILES = (50, 95, 99)
+
+S = TypeVar('S')
+
+
+class _ShardOwner:
+    """Held only by a thread's local storage, so it is collected when the thread exits."""
+
+
+class ThreadShards(Generic[S]):
+    """Per-thread accumulators that are folded into a retired total when their thread exits.
+
+    Each thread updates its own shard without locking; readers sum the live
+    shards and the retired total. Short-lived threads (e.g. one per request)
+    therefore don't leave a shard behind for every thread ever seen.
+    """
+
+    def __init__(self, new: Callable[[], S], combine: Callable[[S, S], S]):
+        """
+        Args:
+            new: Makes an empty shard
+            combine: Makes a new shard holding the sum of two shards (neither is modified)
+        """
+        self._new = new
+        self._combine = combine
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live: List[S] = []
+        self._retired = new()
+
+    def local(self) -> S:
+        """Get the calling thread's shard, creating it on first use."""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._new()
+            owner = _ShardOwner()
+            self._local.shard, self._local.owner = shard, owner
+            weakref.finalize(owner, self._retire, shard)
+            with self._lock:
+                self._live = self._live + [shard]
+        return shard
+
+    def _retire(self, shard: S):
+        # Replaced rather than updated in place, so a reader's snapshot never counts the shard twice
+        with self._lock:
+            self._retired = self._combine(self._retired, shard)
+            self._live = [live for live in self._live if live is not shard]
+
+    def snapshot(self) -> List[S]:
+        """Get the retired total and every live thread's shard."""
+        with self._lock:
+            return [self._retired] + self._live
+
+
+class LatencyHistogram:
+    """Log-linear (HDR-style) latency histogram.
+
+    Values are bucketed by power of two with ``SUB_BUCKETS`` linear
+    sub-buckets each, which bounds the relative error of any reported
+    percentile to about 1/SUB_BUCKETS over 1µs..~2 minutes. Recording is O(1)
+    and lock-free: each thread counts into its own buckets, and the buckets
+    are merged when the histogram is read (see ``ThreadShards``).
+    """
+
+    SUB_BUCKETS = 16
+    MAX_EXPONENT = 28  # 2**27 µs ~ 134s; slower values land in the last bucket
+
+    def __init__(self):
+        # Each shard is [buckets, count, total, min, max]
+        self._shards: ThreadShards[list] = ThreadShards(self._new_shard, self._combine)
+
+    @classmethod
+    def _new_shard(cls) -> list:
+        return [[0] * (cls.MAX_EXPONENT * cls.SUB_BUCKETS), 0, 0.0, math.inf, 0.0]
+
+    @staticmethod
+    def _combine(a: list, b: list) -> list:
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2], min(a[3], b[3]), max(a[4], b[4])]
+
+    @classmethod
+    def _index(cls, seconds: float) -> int:
+        micros = seconds * 1e6
+        if micros < 1.0:
+            return 0
+        mantissa, exponent = math.frexp(micros)  # micros = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        if exponent > cls.MAX_EXPONENT:
+            return cls.MAX_EXPONENT * cls.SUB_BUCKETS - 1
+        return (exponent - 1) * cls.SUB_BUCKETS + int((mantissa * 2 - 1) * cls.SUB_BUCKETS)
+
+    @classmethod
+    def _value(cls, index: int) -> float:
+        """Get the midpoint of a bucket in seconds."""
+        exponent, sub = divmod(index, cls.SUB_BUCKETS)
+        return 2 ** exponent * (1 + (sub + 0.5) / cls.SUB_BUCKETS) / 1e6
+
+    def record(self, seconds: float):
+        """Record one duration in seconds."""
+        shard = self._shards.local()
+        shard[0][self._index(seconds)] += 1
+        shard[1] += 1
+        shard[2] += seconds
+        if seconds < shard[3]:
+            shard[3] = seconds
+        if seconds > shard[4]:
+            shard[4] = seconds
+
+    def _merged(self) -> Tuple[List[int], int, float, float, float]:
+        shards = self._shards.snapshot()
+        buckets = [0] * (self.MAX_EXPONENT * self.SUB_BUCKETS)
+        count, total, low, high = 0, 0.0, math.inf, 0.0
+        for shard in shards:
+            for i, n in enumerate(shard[0]):
+                if n:
+                    buckets[i] += n
+            count += shard[1]
+            total += shard[2]
+            low = min(low, shard[3])
+            high = max(high, shard[4])
+        return buckets, count, total, low, high
+
+    def cumulative(self, bounds: Tuple[float, ...]) -> Tuple[List[int], int, float]:
+        """Get cumulative counts at fixed upper bounds (seconds), plus count and sum.
+
+        Used to export Prometheus-style ``le`` buckets; each internal bucket is
+        counted at its midpoint, so boundaries are accurate to the bucket width.
+        """
+        buckets, count, total, _, _ = self._merged()
+        cumulative = [0] * len(bounds)
+        for i, n in enumerate(buckets):
+            if not n:
+                continue
+            value = self._value(i)
+            for j, bound in enumerate(bounds):
+                if value <= bound:
+                    cumulative[j] += n
+        return cumulative, count, total
+
+    @property
+    def count(self) -> int:
+        return sum(shard[1] for shard in self._shards.snapshot())
+
+    def summary(self, percentiles: Tuple[int, ...] = PERCENTILES) -> Dict[str, Optional[float]]:
+        """Get count, mean, min, max and percentiles (in seconds)."""
+        buckets, count, total, low, high = self._merged()
+        result: Dict[str, Optional[float]] = {'count': count}
+        if not count:
+            result.update({'mean': None, 'min': None, 'max': None})
+            result.update({f'p{p}': None for p in percentiles})
+            return result
+
+        result.update({'mean': total / count, 'min': low, 'max': high})
+        targets = sorted((max(1, math.ceil(p / 100 * count)), p) for p in percentiles)
+        seen, t = 0, 0
+        for i, n in enumerate(buckets):
+            if not n:
+                continue
+            seen += n
+            while t < len(targets) and seen >= targets[t][0]:
+                # Clamp to the observed range so tiny samples report exact values;
+                # the overflow bucket has no upper bound, so report the max
+                value = high if i == len(buckets) - 1 else self._value(i)
+                result[f'p{targets[t][1]}'] = min(max(value, low), high)
+                t += 1
+            if t == len(targets):
+                break
+        return result
+
+
+class LatencyRecorder:
+    """Latency histograms keyed by (retailer, stage)."""
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, retailer: str, stage: str) -> LatencyHistogram:
+        """Get (creating on first use) the histogram for a retailer and stage."""
+        key = (retailer, stage)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def record(self, retailer: str, stage: str, seconds: float):
+        """Record one duration in seconds."""
+        self.histogram(retailer, stage).record(seconds)
+
+    @contextmanager
+    def time(self, retailer: str, stage: str) -> Iterator[None]:
+        """Time the enclosed block into a retailer's stage histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(retailer, stage, time.perf_counter() - start)
+
+    def items(self) -> List[Tuple[Tuple[str, str], LatencyHistogram]]:
+        """Get ((retailer, stage), histogram) pairs."""
+        with self._lock:
+            return sorted(self._histograms.items(), key=lambda item: item[0])
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Optional[float]]]]:
+        """Get summaries as {retailer: {stage: {count, mean, min, max, p50, p95, p99}}}."""
+        with self._lock:
+            items = list(self._histograms.items())
+        result: Dict[str, Dict[str, Dict[str, Optional[float]]]] = {}
+        for (retailer, stage), histogram in sorted(items):
+            result.setdefault(retailer, {})[stage] = histogram.summary()
+        return result
+
+    def clear(self):
+        """Drop all recorded latencies."""
+        with self._lock:
+            self._histograms = {}
+
+
+# Global latency recorder shared by all retailers
+latency = LatencyRecorder()
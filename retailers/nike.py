@@ -3,11 +3,13 @@ Nike retailer scraper.
 """
 
 import json
-from typing import Tuple
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING, Tuple
 import logging
 from .base import BaseRetailer
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,7 +23,7 @@ class NikeRetailer(BaseRetailer):
         """Check if URL is a Nike product page."""
         return "nike.com" in url
     
-    def extract_product_info(self, soup: BeautifulSoup, url: str) -> Tuple[str, str, str]:
+    def extract_product_info(self, soup: "BeautifulSoup", url: str) -> Tuple[str, str, str]:
         """Extract product information from Nike page."""
         try:
             name = "Product name not found"
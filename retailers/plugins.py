@@ -0,0 +1,112 @@
+"""
+Static retailer declarations and plugin discovery.
+
+A retailer is declared by a ``RetailerSpec``: its name, the hosts it handles
+and the scraper class as a ``"module:Class"`` string. Routing only needs the
+spec, so a retailer's module is imported and its scraper instantiated the
+first time a URL for one of its hosts is seen.
+
+Besides the built-in retailers, specs are discovered from the
+``sale_tracker.retailers`` entry point group. A plugin package declares its
+spec in a lightweight module and registers it in its ``pyproject.toml``::
+
+    [project.entry-points."sale_tracker.retailers"]
+    adidas = "sale_tracker_adidas.spec:SPEC"
+
+where ``SPEC = RetailerSpec("adidas", ("adidas.com",), "sale_tracker_adidas.scraper:AdidasRetailer")``.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+import importlib
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "sale_tracker.retailers"
+
+
+@dataclass(frozen=True)
+class RetailerSpec:
+    """Static declaration of a retailer.
+
+    Attributes:
+        name: Retailer name (also the key for its settings)
+        hosts: Hostnames handled, each also matching its subdomains
+        target: Scraper class as ``"module:Class"``, imported on first use
+        settings: Keyword arguments for the scraper's constructor
+    """
+    name: str
+    hosts: Tuple[str, ...]
+    target: str
+    settings: Dict[str, Any] = field(default_factory=dict)
+
+    def load(self) -> type:
+        """Import the scraper class."""
+        module_name, _, class_name = self.target.partition(":")
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def create(self):
+        """Import and instantiate the scraper."""
+        return self.load()(**self.settings)
+
+
+BUILTIN_RETAILERS = (
+    RetailerSpec("lululemon", ("shop.lululemon.com",), "retailers.lululemon:LululemonRetailer"),
+    RetailerSpec("nike", ("nike.com",), "retailers.nike:NikeRetailer"),
+)
+
+
+def url_hosts(url: str) -> Iterator[str]:
+    """Yield a URL's hostname and each parent domain, most specific first.
+
+    ``https://www.nike.com/t/x`` yields ``www.nike.com``, ``nike.com``, ``com``.
+    """
+    try:
+        hostname = urlparse(url.strip()).hostname
+    except ValueError:
+        return
+    while hostname:
+        yield hostname
+        hostname = hostname.partition(".")[2]
+
+
+def discover(entry_points: bool = True) -> List[RetailerSpec]:
+    """Get the built-in specs followed by those registered by installed plugins.
+
+    Plugins that fail to load are logged and skipped.
+    """
+    specs = list(BUILTIN_RETAILERS)
+    if not entry_points:
+        return specs
+
+    from importlib.metadata import entry_points as installed_entry_points
+
+    if sys.version_info >= (3, 10):
+        found = installed_entry_points(group=ENTRY_POINT_GROUP)
+    else:
+        # Before 3.10 entry_points() takes no arguments and returns a dict of groups
+        found = installed_entry_points().get(ENTRY_POINT_GROUP, [])
+
+    for entry_point in found:
+        try:
+            spec = entry_point.load()
+        except Exception as e:
+            logger.warning(f"Failed to load retailer plugin {entry_point.name}: {e}")
+            continue
+        if not isinstance(spec, RetailerSpec):
+            logger.warning(f"Retailer plugin {entry_point.name} is not a RetailerSpec, skipping")
+            continue
+        specs.append(spec)
+    return specs
+
+
+def find_spec(specs_by_host: Dict[str, RetailerSpec], url: str) -> Optional[RetailerSpec]:
+    """Find the spec for a URL in a host -> spec index."""
+    for host in url_hosts(url):
+        spec = specs_by_host.get(host)
+        if spec is not None:
+            return spec
+    return None
@@ -2,121 +2,381 @@
 Retailer registry and scraping coordination.
 """
 
-from typing import Dict, List, Tuple, Optional
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Optional
 import logging
+import threading
 import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 import json
 import os
 from .base import BaseRetailer
-from .lululemon import LululemonRetailer
-from .nike import NikeRetailer
+from .metrics import latency
+from .plugins import RetailerSpec, discover, find_spec
+from .tracing import tracer
 
 logger = logging.getLogger(__name__)
 
 
 class SimpleCache:
-    """Simple in-memory cache with TTL."""
+    """Simple in-memory cache with TTL.
     
-    def __init__(self, default_ttl: int = 3600):  # 1 hour default TTL
+    Safe for concurrent use: each key's read-check-delete and write is done
+    under one of a fixed set of striped locks, so threads working on
+    different keys rarely contend.
+    """
+    
+    def __init__(self, default_ttl: int = 3600, stripes: int = 16):  # 1 hour default TTL
         self.cache = {}
         self.default_ttl = default_ttl
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        # Hit/miss counts per stripe, updated under that stripe's lock
+        self._hits = [0] * stripes
+        self._misses = [0] * stripes
+    
+    def _lock_for(self, key: str) -> threading.Lock:
+        return self._locks[hash(key) % len(self._locks)]
     
     def get(self, key: str) -> Optional[tuple]:
         """Get cached value if still valid."""
-        if key in self.cache:
-            value, expiry = self.cache[key]
-            if datetime.now() < expiry:
-                return value
-            else:
+        stripe = hash(key) % len(self._locks)
+        with self._locks[stripe]:
+            entry = self.cache.get(key)
+            if entry is not None:
+                value, expiry = entry
+                if datetime.now() < expiry:
+                    self._hits[stripe] += 1
+                    return value
                 del self.cache[key]
+            self._misses[stripe] += 1
         return None
     
+    @property
+    def hits(self) -> int:
+        return sum(self._hits)
+    
+    @property
+    def misses(self) -> int:
+        return sum(self._misses)
+    
     def set(self, key: str, value: tuple, ttl: Optional[int] = None):
         """Set cached value with TTL."""
         ttl = ttl or self.default_ttl
         expiry = datetime.now() + timedelta(seconds=ttl)
-        self.cache[key] = (value, expiry)
+        with self._lock_for(key):
+            self.cache[key] = (value, expiry)
     
     def clear(self):
         """Clear all cached values."""
-        self.cache.clear()
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self.cache.clear()
+        finally:
+            for lock in self._locks:
+                lock.release()
     
     def size(self) -> int:
         """Get number of cached items."""
         return len(self.cache)
 
 
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution.
+    
+    The first caller for a key runs the work; callers arriving while it is in
+    flight wait for and share its result (or exception). Thread and asyncio
+    callers join the same flight.
+    """
+    
+    def __init__(self):
+        self._flights: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.saved = 0
+    
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """Get the in-flight future for a key and whether the caller leads it."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.saved += 1
+                return future, False
+            future = self._flights[key] = Future()
+            self.executions += 1
+            return future, True
+    
+    def _run(self, key: str, future: Future, fn: Callable[[], Any]):
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                self._flights.pop(key, None)
+            future.set_exception(e)
+        else:
+            with self._lock:
+                self._flights.pop(key, None)
+            future.set_result(result)
+    
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run ``fn`` once for all concurrent callers with the same key."""
+        future, leader = self._join(key)
+        if leader:
+            self._run(key, future, fn)
+        return future.result()
+    
+    async def do_async(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Async variant of ``do``; blocking ``fn`` runs in the default executor."""
+        import asyncio  # Only async callers pay for importing asyncio
+        
+        future, leader = self._join(key)
+        if leader:
+            asyncio.get_running_loop().run_in_executor(None, self._run, key, future, fn)
+        return await asyncio.wrap_future(future)
+    
+    def in_flight(self) -> int:
+        """Get number of keys currently being fetched."""
+        with self._lock:
+            return len(self._flights)
+
+
+class _Retailers(Mapping):
+    """Every known retailer by name; a scraper is instantiated when its entry is read."""
+    
+    def __init__(self, registry: "RetailerRegistry"):
+        self._registry = registry
+    
+    def __getitem__(self, name: str) -> BaseRetailer:
+        retailer = self._registry.get_retailer(name)
+        if retailer is None:
+            raise KeyError(name)
+        return retailer
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._registry.get_supported_retailers())
+    
+    def __len__(self) -> int:
+        return len(self._registry.get_supported_retailers())
+    
+    def __contains__(self, name) -> bool:
+        return name in self._registry.get_supported_retailers()
+
+
 class RetailerRegistry:
-    """Registry and coordinator for retailer scrapers."""
+    """Registry and coordinator for retailer scrapers.
+    
+    Retailers are known by their specs (see ``plugins``); each scraper is
+    instantiated the first time it is needed, e.g. when a URL for one of its
+    hosts is routed. Scrapers can also be registered directly as instances.
+    """
     
-    def __init__(self, enable_cache: bool = True, cache_ttl: int = 3600):
-        self.retailers: Dict[str, BaseRetailer] = {}
+    def __init__(self, enable_cache: bool = True, cache_ttl: int = 3600,
+                 specs: Optional[List[RetailerSpec]] = None):
+        """
+        Args:
+            enable_cache: Cache scrape results
+            cache_ttl: Default cache TTL in seconds
+            specs: Retailers to route to, defaults to the built-in and plugin
+                retailers (discovered on first use)
+        """
+        # Instantiated scrapers by name
+        self._instances: Dict[str, BaseRetailer] = {}
+        self._specs: Optional[Dict[str, RetailerSpec]] = None
+        self._specs_by_host: Dict[str, RetailerSpec] = {}
+        self._register_lock = threading.Lock()
         self.enable_cache = enable_cache
         self.cache = SimpleCache(cache_ttl) if enable_cache else None
-        self._register_default_retailers()
+        self.flights = SingleFlight()
+        if specs is not None:
+            self._index_specs(specs)
+    
+    @property
+    def retailers(self) -> Mapping:
+        """Every known retailer by name (reading an entry instantiates that scraper)."""
+        return _Retailers(self)
+    
+    def get_loaded_retailers(self) -> List[str]:
+        """Get the names of the retailers whose scrapers have been instantiated."""
+        return list(self._instances)
+    
+    def _index_specs(self, specs: List[RetailerSpec]):
+        by_name: Dict[str, RetailerSpec] = {}
+        by_host: Dict[str, RetailerSpec] = {}
+        for spec in specs:
+            by_name[spec.name] = spec
+            for host in spec.hosts:
+                by_host[host.lower()] = spec
+        # Published together, host index first, so lookups never see a half-built index
+        self._specs_by_host = by_host
+        self._specs = by_name
+    
+    def _get_specs(self) -> Dict[str, RetailerSpec]:
+        """Get specs by name, discovering them on first use."""
+        if self._specs is None:
+            with self._register_lock:
+                if self._specs is None:
+                    self._index_specs(discover())
+        return self._specs
     
-    def _register_default_retailers(self):
-        """Register default retailers."""
-        self.register_retailer(LululemonRetailer())
-        self.register_retailer(NikeRetailer())
+    def register_spec(self, spec: RetailerSpec):
+        """Register (or replace) a retailer declaration; it is instantiated on first use."""
+        specs = self._get_specs()
+        with self._register_lock:
+            self._index_specs([s for s in specs.values() if s.name != spec.name] + [spec])
+            if spec.name in self._instances:
+                retailers = dict(self._instances)
+                del retailers[spec.name]
+                self._instances = retailers
+        logger.info(f"Registered retailer spec: {spec.name} ({', '.join(spec.hosts)})")
+    
+    def get_spec(self, name: str) -> Optional[RetailerSpec]:
+        """Get a retailer's static declaration by name."""
+        return self._get_specs().get(name)
     
     def register_retailer(self, retailer: BaseRetailer):
         """Register a new retailer."""
-        self.retailers[retailer.name] = retailer
+        # Copy-on-write so lookups can iterate the retailers without a lock
+        with self._register_lock:
+            retailers = dict(self._instances)
+            retailers[retailer.name] = retailer
+            self._instances = retailers
         logger.info(f"Registered retailer: {retailer.name}")
     
     def get_retailer(self, name: str) -> Optional[BaseRetailer]:
-        """Get retailer by name."""
-        return self.retailers.get(name)
+        """Get retailer by name, instantiating it from its spec on first use."""
+        retailer = self._instances.get(name)
+        if retailer is not None:
+            return retailer
+        
+        spec = self._get_specs().get(name)
+        if spec is None:
+            return None
+        with self._register_lock:
+            retailer = self._instances.get(name)
+            if retailer is None:
+                retailer = spec.create()
+                self._instances = {**self._instances, name: retailer}
+                logger.debug(f"Loaded retailer: {name}")
+        return retailer
+    
+    def get_retailer_name_for_url(self, url: str) -> Optional[str]:
+        """Find which retailer handles a URL, without instantiating it."""
+        specs = self._get_specs()
+        spec = find_spec(self._specs_by_host, url)
+        if spec is not None:
+            return spec.name
+        
+        # Retailers registered as instances route by their own URL check
+        for retailer in self._instances.values():
+            if retailer.name not in specs and retailer.is_supported_url(url):
+                return retailer.name
+        return None
     
     def get_retailer_for_url(self, url: str) -> Optional[BaseRetailer]:
         """Find appropriate retailer for a URL."""
-        for retailer in self.retailers.values():
-            if retailer.is_supported_url(url):
-                return retailer
-        return None
+        name = self.get_retailer_name_for_url(url)
+        return self.get_retailer(name) if name else None
     
-    def scrape_product(self, url: str, use_cache: bool = True) -> Tuple[str, str, str]:
-        """Scrape product using appropriate retailer."""
+    def canonical_url(self, url: str) -> str:
+        """Get the canonical product URL used as a stable product id."""
         retailer = self.get_retailer_for_url(url)
-        
         if not retailer:
-            logger.warning(f"No retailer found for URL: {url}")
-            return "Unsupported retailer", "Price not found", ""
-        
-        # Check cache first
+            return url.strip()
+        return retailer.canonical_url(url)
+    
+    def _cached(self, retailer: BaseRetailer, url: str, use_cache: bool) -> Optional[Tuple[str, str, str]]:
+        """Get a cached result for a URL if caching is on and it is still valid."""
         if use_cache and self.cache:
-            cache_key = retailer.get_cache_key(url)
-            cached_result = self.cache.get(cache_key)
+            with latency.time(retailer.name, "cache_lookup"):
+                cached_result = self.cache.get(retailer.get_cache_key(url))
             if cached_result:
                 logger.debug(f"Using cached result for {url}")
                 return cached_result
+        return None
+    
+    def _fetch(self, retailer: BaseRetailer, url: str, use_cache: bool) -> Tuple[str, str, str]:
+        """Scrape a URL and cache the result (runs once per in-flight canonical URL)."""
+        # A flight that finished just before this one started may have filled the cache
+        cached_result = self._cached(retailer, url, use_cache)
+        if cached_result:
+            return cached_result
         
-        # Scrape and cache result
         result = retailer.scrape_product(url)
         
         if use_cache and self.cache and result[0] != "Product name not found":
-            cache_key = retailer.get_cache_key(url)
-            self.cache.set(cache_key, result)
+            self.cache.set(retailer.get_cache_key(url), result)
             logger.debug(f"Cached result for {url}")
         
         return result
     
-    def scrape_multiple(self, urls: List[str], use_cache: bool = True, delay: float = 1.0) -> List[dict]:
-        """Scrape multiple products with rate limiting."""
+    def scrape_product(self, url: str, use_cache: bool = True) -> Tuple[str, str, str]:
+        """Scrape product using appropriate retailer.
+        
+        Concurrent calls for the same canonical URL share a single fetch.
+        """
+        retailer = self.get_retailer_for_url(url)
+        
+        if not retailer:
+            logger.warning(f"No retailer found for URL: {url}")
+            return "Unsupported retailer", "Price not found", ""
+        
+        with latency.time(retailer.name, "total"), tracer.span("registry.scrape_product", cat="registry", url=url) as span:
+            cached_result = self._cached(retailer, url, use_cache)
+            if cached_result:
+                span.set(cache="hit")
+                return cached_result
+            
+            return self.flights.do(retailer.canonical_url(url), lambda: self._fetch(retailer, url, use_cache))
+    
+    async def scrape_product_async(self, url: str, use_cache: bool = True) -> Tuple[str, str, str]:
+        """Async variant of ``scrape_product``; the fetch runs in the default executor."""
+        retailer = self.get_retailer_for_url(url)
+        
+        if not retailer:
+            logger.warning(f"No retailer found for URL: {url}")
+            return "Unsupported retailer", "Price not found", ""
+        
+        with latency.time(retailer.name, "total"):
+            cached_result = self._cached(retailer, url, use_cache)
+            if cached_result:
+                return cached_result
+            
+            return await self.flights.do_async(retailer.canonical_url(url), lambda: self._fetch(retailer, url, use_cache))
+    
+    def scrape_multiple(self, urls: List[str], use_cache: bool = True, delay: float = 1.0,
+                        on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+        """Scrape multiple products with rate limiting.
+        
+        Args:
+            urls: Product URLs to scrape
+            use_cache: Use cached results where available
+            delay: Seconds to wait between requests
+            on_result: Called with each result as soon as it is available
+        
+        Returns:
+            One result dict per URL, including the seconds spent on it as 'duration'
+        """
+        with tracer.span("scrape_multiple", cat="registry", urls=len(urls)):
+            return self._scrape_multiple(urls, use_cache, delay, on_result)
+    
+    def _scrape_multiple(self, urls: List[str], use_cache: bool, delay: float,
+                         on_result: Optional[Callable[[dict], None]]) -> List[dict]:
         results = []
         
         for i, url in enumerate(urls):
             if i > 0 and delay > 0:
-                time.sleep(delay)  # Rate limiting
+                with tracer.span("throttle", cat="registry", seconds=delay):
+                    time.sleep(delay)  # Rate limiting
             
+            started = time.perf_counter()
             try:
                 name, price, image = self.scrape_product(url, use_cache=use_cache)
                 retailer = self.get_retailer_for_url(url)
                 
                 results.append({
                     'url': url,
+                    'product_id': self.canonical_url(url),
                     'name': name,
                     'price': price,
                     'image': image,
@@ -128,6 +388,7 @@ class RetailerRegistry:
                 logger.error(f"Error scraping {url}: {e}")
                 results.append({
                     'url': url,
+                    'product_id': self.canonical_url(url),
                     'name': f"Error: {str(e)}",
                     'price': "N/A",
                     'image': "",
@@ -135,12 +396,17 @@ class RetailerRegistry:
                     'timestamp': datetime.now().isoformat(),
                     'success': False
                 })
+            
+            results[-1]['duration'] = time.perf_counter() - started
+            if on_result:
+                on_result(results[-1])
         
         return results
     
     def get_supported_retailers(self) -> List[str]:
-        """Get list of supported retailer names."""
-        return list(self.retailers.keys())
+        """Get list of supported retailer names (declared and directly registered)."""
+        names = list(self._get_specs())
+        return names + [name for name in self._instances if name not in names]
     
     def get_cache_stats(self) -> Dict:
         """Get cache statistics."""
@@ -150,7 +416,21 @@ class RetailerRegistry:
         return {
             'enabled': True,
             'size': self.cache.size(),
-            'default_ttl': self.cache.default_ttl
+            'default_ttl': self.cache.default_ttl,
+            'hits': self.cache.hits,
+            'misses': self.cache.misses
+        }
+    
+    def get_latency_stats(self) -> Dict:
+        """Get latency percentiles per retailer and stage (seconds)."""
+        return latency.snapshot()
+    
+    def get_coalescing_stats(self) -> Dict:
+        """Get single-flight statistics (fetches run and duplicate fetches saved)."""
+        return {
+            'fetches': self.flights.executions,
+            'fetches_saved': self.flights.saved,
+            'in_flight': self.flights.in_flight()
         }
     
     def clear_cache(self):
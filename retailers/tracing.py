@@ -0,0 +1,215 @@
+"""
+Lightweight span tracing written as Chrome trace files.
+
+Spans are only recorded while a recording is active; otherwise ``span()``
+returns a shared no-op context manager, so instrumentation left in hot paths
+costs a single context variable lookup. Each recording collects its own spans:
+runs recorded at the same time in different threads (e.g. a scrape job and
+the daily email) write separate traces. Open the written JSON file in
+chrome://tracing or https://ui.perfetto.dev to inspect a run as a timeline.
+"""
+
+from contextvars import ContextVar, Token
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _NullSpan:
+    """Span used while tracing is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """A timed region, recorded as a Chrome trace complete ("X") event."""
+
+    __slots__ = ("session", "name", "cat", "args", "start")
+
+    def __init__(self, session: "_Session", name: str, cat: str, args: Dict[str, Any]):
+        self.session = session
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.session.add({
+            "name": self.name,
+            "cat": self.cat,
+            "ph": "X",
+            "ts": (self.start - self.session.origin) / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.args
+        })
+        return False
+
+    def set(self, **args):
+        """Attach extra arguments (e.g. a result) to the span."""
+        self.args.update(args)
+
+
+class _Session:
+    """The spans of one recording."""
+
+    def __init__(self, max_events: int):
+        self.max_events = max_events
+        self.events: List[Dict[str, Any]] = []
+        self.threads: Dict[int, str] = {}
+        self.origin = time.perf_counter_ns()
+        self.depth = 1
+        self.token: Optional[Token] = None
+
+    def add(self, event: Dict[str, Any]):
+        if len(self.events) < self.max_events:
+            self.events.append(event)
+            tid = event["tid"]
+            if tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+
+
+class Tracer:
+    """Records spans into the recording active in the calling context.
+
+    A recording is bound to the context (thread, or asyncio task) that
+    started it; threads it starts itself record nothing unless they run in a
+    copy of that context (``contextvars.copy_context().run``).
+    """
+
+    def __init__(self, max_events: int = 100000):
+        self.max_events = max_events
+        self._session: ContextVar[Optional[_Session]] = ContextVar(f"tracer_session_{id(self)}", default=None)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether a recording is active in the calling context."""
+        return self._session.get() is not None
+
+    def span(self, name: str, cat: str = "app", **args):
+        """Time the enclosed block as a span named ``name``."""
+        session = self._session.get()
+        if session is None:
+            return _NULL_SPAN
+        return _Span(session, name, cat, args)
+
+    def traced(self, name: Optional[str] = None, cat: str = "app") -> Callable:
+        """Decorator recording each call of a function as a span."""
+        def decorator(fn: Callable) -> Callable:
+            span_name = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                session = self._session.get()
+                if session is None:
+                    return fn(*args, **kwargs)
+                with _Span(session, span_name, cat, {}):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def start(self):
+        """Start a recording in the calling context, or join the one already active in it."""
+        session = self._session.get()
+        if session is not None:
+            session.depth += 1
+            return
+        session = _Session(self.max_events)
+        session.token = self._session.set(session)
+
+    def stop(self, path: Optional[str] = None) -> Optional[str]:
+        """End the calling context's recording; the outermost stop writes the trace to ``path``.
+
+        Returns:
+            The written file path, or None if a recording is still open
+        """
+        session = self._session.get()
+        if session is None:
+            return None
+        session.depth -= 1
+        if session.depth:
+            return None
+        try:
+            self._session.reset(session.token)
+        except ValueError:  # Stopped from a different context than it was started in
+            self._session.set(None)
+        events, threads = session.events, session.threads
+
+        if path is None:
+            return None
+
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        ]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f, default=str)
+        logger.info(f"Wrote trace with {len(events)} spans to {path}")
+        return path
+
+    def recording(self, name: str, directory: str, enabled: bool = True) -> "_Recording":
+        """Record a whole run and write it to ``directory/<name>-<timestamp>.json``.
+
+        Nested recordings join the outer one; recordings in other threads are
+        kept apart. When ``enabled`` is False this is a no-op, so callers can
+        pass their config flag straight through.
+        """
+        return _Recording(self, name, directory, enabled)
+
+
+class _Recording:
+    def __init__(self, tracer: Tracer, name: str, directory: str, enabled: bool):
+        self.tracer = tracer
+        self.name = name
+        self.directory = directory
+        self.enabled = enabled
+        self.path: Optional[str] = None
+        self._span = _NULL_SPAN
+
+    def __enter__(self):
+        if self.enabled:
+            self.tracer.start()
+            self._span = self.tracer.span(self.name, cat="run")
+            self._span.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.enabled:
+            self._span.__exit__(exc_type, exc, tb)
+            filename = f"{self.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"
+            try:
+                self.path = self.tracer.stop(os.path.join(self.directory, filename))
+            except OSError as e:
+                logger.warning(f"Failed to write trace: {e}")
+        return False
+
+
+# Global tracer shared by the scraping and email pipeline
+tracer = Tracer()
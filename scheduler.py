@@ -0,0 +1,399 @@
+"""
+Event-driven job scheduler.
+
+Jobs are kept in a heap ordered by their exact next fire time. The dispatcher
+sleeps until the earliest one is due (or a job is added, moved or removed) and
+hands due jobs to a small worker pool, so a long email run never delays a
+health check. A job that is still running when it comes due again is skipped
+rather than stacked up.
+
+Each job's last and next run are written to a SQLite table. When a worker
+restarts, a job whose fire time passed while it was down runs once straight
+away (missed runs are coalesced), as long as it was missed by less than
+``catch_up_window`` seconds.
+
+The heap makes adding a job O(log n) and a wake-up only touches the jobs that
+are due, so thousands of per-product or per-user schedules cost nothing while
+they wait.
+"""
+
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import config_enhanced as config
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_DB = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "scheduler.db"
+)
+
+# Longest single sleep; guards against wall clock jumps (NTP, suspend) delaying jobs
+MAX_SLEEP = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name TEXT PRIMARY KEY,
+    last_run REAL,
+    next_run REAL,
+    last_status TEXT,
+    last_duration REAL,
+    last_error TEXT
+);
+"""
+
+
+class Every:
+    """Fixed-interval schedule (first run one interval after it is added)."""
+
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        self.seconds = float(seconds)
+
+    def first_run(self, now: float) -> float:
+        return now + self.seconds
+
+    def next_after(self, when: float) -> float:
+        return when + self.seconds
+
+    def __repr__(self) -> str:
+        return f"every {self.seconds:g}s"
+
+
+class DailyAt:
+    """Daily schedule at a local ``HH:MM`` time."""
+
+    def __init__(self, at: str):
+        hour, minute = (int(part) for part in at.split(":"))
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"Invalid time of day: {at}")
+        self.hour = hour
+        self.minute = minute
+
+    def first_run(self, now: float) -> float:
+        return self.next_after(now)
+
+    def next_after(self, when: float) -> float:
+        current = datetime.fromtimestamp(when)
+        fire = current.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if fire.timestamp() <= when:
+            fire += timedelta(days=1)
+        return fire.timestamp()
+
+    def __repr__(self) -> str:
+        return f"daily at {self.hour:02d}:{self.minute:02d}"
+
+
+@dataclass
+class ScheduledJob:
+    """A named job and its run state."""
+    name: str
+    fn: Callable[[], Any]
+    schedule: Any
+    catch_up: bool = True
+    next_run: float = 0.0
+    last_run: Optional[float] = None
+    last_status: Optional[str] = None
+    last_duration: Optional[float] = None
+    last_error: Optional[str] = None
+    pass_fire_time: bool = False
+    missed_run: Optional[float] = None
+    running: bool = False
+    runs: int = 0
+    skipped: int = 0
+    generation: int = field(default=0, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'schedule': repr(self.schedule),
+            'next_run': self.next_run,
+            'last_run': self.last_run,
+            'last_status': self.last_status,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+            'running': self.running,
+            'runs': self.runs,
+            'skipped': self.skipped
+        }
+
+
+class Scheduler:
+    """Heap-based scheduler with a worker pool and persisted run state."""
+
+    def __init__(self, db_path: Optional[str] = None, workers: Optional[int] = None,
+                 catch_up_window: Optional[float] = None, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            db_path: SQLite file for run state; defaults to ``data/scheduler.db``
+            workers: Worker threads; defaults to ``SCHEDULER_SETTINGS["workers"]``
+            catch_up_window: Longest a missed run may be late and still run on start
+            clock: Wall clock (overridable for tests)
+        """
+        settings = config.SCHEDULER_SETTINGS
+        self.db_path = db_path or SCHEDULER_DB
+        self.workers = workers or settings.get("workers", 4)
+        self.catch_up_window = (settings.get("catch_up_window", 12 * 3600)
+                                if catch_up_window is None else catch_up_window)
+        self.clock = clock
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._dispatcher: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Submitted runs that haven't finished, so stop() can cancel those not yet started
+        self._pending: Dict[Future, ScheduledJob] = {}
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._saved: Optional[Dict[str, tuple]] = None
+
+    # Persistence
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _saved_state(self, name: str) -> Optional[tuple]:
+        with self._db_lock:
+            if self._saved is None:
+                rows = self._connection().execute(
+                    "SELECT name, last_run, next_run, last_status, last_duration, last_error FROM scheduled_jobs"
+                ).fetchall()
+                self._saved = {row[0]: row[1:] for row in rows}
+            return self._saved.get(name)
+
+    def _save(self, job: ScheduledJob):
+        row = (job.last_run, job.next_run, job.last_status, job.last_duration, job.last_error)
+        with self._db_lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO scheduled_jobs "
+                "(name, last_run, next_run, last_status, last_duration, last_error) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.name, *row)
+            )
+            if self._saved is not None:
+                self._saved[job.name] = row
+
+    # Job management
+
+    def _push(self, job: ScheduledJob):
+        """Queue a job's next run (older heap entries for it become stale)."""
+        job.generation += 1
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job.name, job.generation))
+        self._cond.notify()
+
+    def add(self, name: str, fn: Callable[..., Any], every: Optional[float] = None,
+            at: Optional[str] = None, catch_up: bool = True, pass_fire_time: bool = False) -> ScheduledJob:
+        """Add (or replace) a job.
+
+        Args:
+            name: Unique job name, e.g. ``"daily_email"`` or ``"refresh:<product id>"``
+            fn: Callable run on a worker thread
+            every: Run every this many seconds
+            at: Run daily at this local ``HH:MM`` time
+            catch_up: Run once on start if a run was missed while stopped
+            pass_fire_time: Call ``fn(fire_time)`` with the time the run was scheduled for
+                (for a caught-up run, the missed time rather than when it actually starts)
+
+        Returns:
+            The scheduled job
+        """
+        if (every is None) == (at is None):
+            raise ValueError("Specify exactly one of 'every' or 'at'")
+        schedule = Every(every) if every is not None else DailyAt(at)
+        job = ScheduledJob(name=name, fn=fn, schedule=schedule, catch_up=catch_up, pass_fire_time=pass_fire_time)
+        now = self.clock()
+
+        with self._cond:
+            previous = self._jobs.get(name)
+        if previous is not None:
+            saved = (previous.last_run, previous.next_run, previous.last_status,
+                     previous.last_duration, previous.last_error)
+        else:
+            saved = self._saved_state(name)
+        due = None
+        if saved is not None:
+            job.last_run, due, job.last_status, job.last_duration, job.last_error = saved
+        if job.last_run is not None:
+            due = schedule.next_after(job.last_run)  # Follows schedule changes since the last run
+        if due is not None:
+            if due <= now:
+                if catch_up and now - due <= self.catch_up_window:
+                    logger.info(f"Job {name} missed its run at {datetime.fromtimestamp(due):%Y-%m-%d %H:%M}, "
+                                f"catching up now")
+                    job.missed_run = due
+                    due = now
+                else:
+                    due = schedule.next_after(now)
+            job.next_run = due
+        else:
+            job.next_run = schedule.first_run(now)
+
+        with self._cond:
+            previous = self._jobs.get(name)
+            if previous is not None:
+                job.running = previous.running
+                job.generation = previous.generation
+            self._jobs[name] = job
+            self._push(job)
+        self._save(job)
+        logger.debug(f"Scheduled {name} ({schedule!r}), next run {datetime.fromtimestamp(job.next_run):%Y-%m-%d %H:%M:%S}")
+        return job
+
+    def remove(self, name: str) -> bool:
+        """Remove a job; its heap entry is discarded when it comes up."""
+        with self._cond:
+            job = self._jobs.pop(name, None)
+            if job is not None:
+                self._cond.notify()
+        return job is not None
+
+    def run_now(self, name: str) -> bool:
+        """Move a job's next run to now."""
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None:
+                return False
+            job.next_run = self.clock()
+            self._push(job)
+        return True
+
+    def get_jobs(self) -> List[Dict[str, Any]]:
+        """Get every job's schedule and run state, soonest first."""
+        with self._cond:
+            jobs = sorted(self._jobs.values(), key=lambda job: job.next_run)
+            return [job.to_dict() for job in jobs]
+
+    # Dispatching
+
+    def _pop_due(self) -> Optional[ScheduledJob]:
+        """Wait for the next due job; returns None once stopped. Caller holds ``_cond``."""
+        while not self._stopping:
+            if not self._heap:
+                self._cond.wait()
+                continue
+            fire_at, _, name, generation = self._heap[0]
+            job = self._jobs.get(name)
+            if job is None or job.generation != generation:
+                heapq.heappop(self._heap)
+                continue
+            delay = fire_at - self.clock()
+            if delay > 0:
+                self._cond.wait(min(delay, MAX_SLEEP))
+                continue
+            heapq.heappop(self._heap)
+            return job
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                job = self._pop_due()
+                if job is None:
+                    return
+                now = self.clock()
+                fire_at = job.next_run
+                job.next_run = job.schedule.next_after(max(fire_at, now))
+                # A caught-up run stands in for the run it missed
+                fire_at, job.missed_run = job.missed_run or fire_at, None
+                if job.running:
+                    job.skipped += 1
+                    logger.warning(f"Job {job.name} is still running, skipping this run")
+                else:
+                    job.running = True
+                    future = self._executor.submit(self._run, job, fire_at)
+                    self._pending[future] = job
+                    future.add_done_callback(self._forget)
+                self._push(job)
+            self._save(job)
+
+    def _forget(self, future: Future):
+        with self._cond:
+            self._pending.pop(future, None)
+
+    def _run(self, job: ScheduledJob, fire_at: float):
+        started = self.clock()
+        status, error = "succeeded", None
+        try:
+            if job.pass_fire_time:
+                job.fn(fire_at)
+            else:
+                job.fn()
+        except Exception as e:
+            status, error = "failed", str(e)
+            logger.error(f"Scheduled job {job.name} failed: {e}")
+        finally:
+            with self._cond:
+                job.running = False
+                current = self._jobs.get(job.name)
+                if current is not None:
+                    current.running = False  # The job may have been replaced while running
+                job.runs += 1
+                job.last_run = started
+                job.last_status = status
+                job.last_error = error
+                job.last_duration = round(self.clock() - started, 3)
+            self._save(job)
+            logger.info(f"Scheduled job {job.name} {status} in {job.last_duration:.2f}s")
+
+    def start(self):
+        """Start the dispatcher and worker pool in the background."""
+        with self._cond:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler-worker")
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="scheduler", daemon=True)
+            self._dispatcher.start()
+        logger.info(f"Scheduler started with {len(self._jobs)} jobs and {self.workers} workers")
+
+    def stop(self, wait: bool = False):
+        """Stop dispatching; running jobs finish unless the process exits first.
+
+        Args:
+            wait: Block until running jobs have finished
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        if self._executor is not None:
+            # shutdown(cancel_futures=True) needs Python 3.9, so queued runs are cancelled here
+            with self._cond:
+                pending = list(self._pending.items())
+            for future, job in pending:
+                if future.cancel():
+                    job.running = False
+            self._executor.shutdown(wait=wait)
+        logger.info("Scheduler stopped")
+
+    def run_forever(self):
+        """Run until interrupted (Ctrl+C) or stopped from another thread."""
+        self.start()
+        try:
+            while self._dispatcher.is_alive():
+                self._dispatcher.join(timeout=MAX_SLEEP)
+        except KeyboardInterrupt:
+            logger.info("Scheduler stopped by user")
+        finally:
+            self.stop()
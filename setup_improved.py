@@ -10,10 +10,11 @@ from setuptools import setup, find_packages
 APP = ['main_improved.py']
 DATA_FILES = [
     ('', ['config.py', '.env']),
+    ('templates/email', ['templates/email/tracked.html', 'templates/email/tracked.txt']),
 ]
 OPTIONS = {
     'argv_emulation': True,
-    'packages': ['requests', 'bs4', 'schedule', 'dotenv'],
+    'packages': ['requests', 'bs4', 'schedule', 'dotenv', 'jinja2'],
     'includes': ['config'],
     'iconfile': None,  # Add icon file path if you have one
     'plist': {
@@ -41,6 +42,7 @@ setup(
         'beautifulsoup4==4.12.3',
         'python-dotenv==1.0.1',
         'schedule==1.2.1',
+        'jinja2>=3.1',
     ],
     entry_points={
         'console_scripts': [
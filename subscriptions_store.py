@@ -1,50 +1,193 @@
+"""
+Per-user product subscriptions.
+
+Subscriptions live in SQLite next to the legacy ``subscriptions.json`` (same
+name, ``.db`` extension), indexed by email and by retailer, so one user's
+products or one page of a filtered listing are found without reading the
+whole store. Writes are single transactions shared by every process, so
+concurrent subscribes no longer overwrite each other. An existing
+``subscriptions.json`` is imported the first time the database is opened.
+"""
+
 import os
 import json
+import sqlite3
+import threading
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from urllib.parse import urlparse
 import re
 
+from retailers import registry
+
 
 SUBSCRIPTIONS_FILE = os.path.join(os.path.abspath("."), "subscriptions.json")
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    url TEXT NOT NULL,
+    company TEXT,
+    added_at TEXT,
+    rules TEXT,
+    UNIQUE (email, url)
+);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_email ON subscriptions (email, id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_company ON subscriptions (company, email, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_db_lock = threading.Lock()
+_conn: Optional[sqlite3.Connection] = None
+_conn_path: Optional[str] = None
+
+
+def _db_path() -> str:
+    return os.path.splitext(SUBSCRIPTIONS_FILE)[0] + ".db"
+
+
+def _connection() -> sqlite3.Connection:
+    """Connect to the store (again, if ``SUBSCRIPTIONS_FILE`` was pointed elsewhere). Caller holds ``_db_lock``."""
+    global _conn, _conn_path
+    path = _db_path()
+    if _conn is None or _conn_path != path:
+        if _conn is not None:
+            _conn.close()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _conn, _conn_path = conn, path
+        _run(conn, _import_legacy)
+    return _conn
+
 
-def _read_store() -> Dict[str, Any]:
-    if not os.path.exists(SUBSCRIPTIONS_FILE):
-        return {"subscriptions": {}, "last_updated": None}
+def _run(conn: sqlite3.Connection, fn):
+    """Run ``fn(conn)`` in a write transaction, starting a new generation if it changed anything."""
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(SUBSCRIPTIONS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        before = conn.total_changes
+        result = fn(conn)
+        if conn.total_changes != before:
+            conn.execute("INSERT INTO meta (key, value) VALUES ('generation', 1) "
+                         "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+        conn.execute("COMMIT")
+        return result
     except Exception:
-        return {"subscriptions": {}, "last_updated": None}
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _transaction(fn):
+    with _db_lock:
+        return _run(_connection(), fn)
+
+
+def _insert(conn: sqlite3.Connection, subscriptions: Dict[str, List[Dict[str, Any]]]) -> int:
+    rows = [
+        ((email or "").strip().lower(), entry["url"], entry.get("company"), entry.get("added_at"),
+         json.dumps(entry["rules"]) if entry.get("rules") else None)
+        for email, entries in subscriptions.items() for entry in entries if entry.get("url")
+    ]
+    before = conn.total_changes
+    conn.executemany("INSERT OR IGNORE INTO subscriptions (email, url, company, added_at, rules) "
+                     "VALUES (?, ?, ?, ?, ?)", rows)
+    return conn.total_changes - before
+
+
+def _import_legacy(conn: sqlite3.Connection):
+    """Import ``SUBSCRIPTIONS_FILE`` once, the first time the database is opened."""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+        return
+    if os.path.exists(SUBSCRIPTIONS_FILE):
+        try:
+            with open(SUBSCRIPTIONS_FILE, "r", encoding="utf-8") as f:
+                store = json.load(f)
+        except Exception:
+            store = {}
+        _insert(conn, store.get("subscriptions", {}))
+    conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', 1)")
+
+
+def import_subscriptions(subscriptions: Dict[str, List[Dict[str, Any]]]) -> int:
+    """Bulk-add subscriptions in the legacy ``{email: [entry, ...]}`` shape (existing ones are kept).
+
+    Returns:
+        Number of subscriptions added
+    """
+    return _transaction(lambda conn: _insert(conn, subscriptions))
 
 
-def _write_store(store: Dict[str, Any]) -> None:
-    store["last_updated"] = datetime.now(timezone.utc).isoformat()
-    with open(SUBSCRIPTIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(store, f, indent=2)
+def generation() -> int:
+    """Get a counter that changes whenever the store is written (by any process)."""
+    with _db_lock:
+        row = _connection().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+    return row[0] if row else 0
+
+
+def _entry(url: str, company: Optional[str], added_at: Optional[str], rules: Optional[str]) -> Dict[str, Any]:
+    entry = {"url": url, "company": company, "added_at": added_at}
+    if rules:
+        entry["rules"] = json.loads(rules)
+    return entry
 
 
 def _detect_company(product_url: str) -> Optional[str]:
-    host = urlparse(product_url).netloc.lower()
-    if "lululemon" in host:
-        return "lululemon"
-    if "nike" in host:
-        return "nike"
-    return None
+    # Routed by the retailers' declared hosts, so plugin retailers are picked up too
+    return registry.get_retailer_name_for_url(product_url)
+
+
+ALERT_RULE_KEYS = {"min_drop", "min_drop_pct", "target_price", "all_time_low"}
+
 
+def _normalize_rules(rules: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    if rules is None:
+        return None, None
+    if not isinstance(rules, dict):
+        return None, "Rules must be an object"
+    unknown = set(rules) - ALERT_RULE_KEYS
+    if unknown:
+        return None, f"Unknown rule(s): {', '.join(sorted(unknown))}"
+    normalized: Dict[str, Any] = {}
+    for key, value in rules.items():
+        if key == "all_time_low":
+            normalized[key] = bool(value)
+        elif value is None:
+            normalized[key] = None
+        else:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                return None, f"Rule {key} must be a number"
+            if number < 0:
+                return None, f"Rule {key} must not be negative"
+            normalized[key] = number
+    return normalized, None
 
-def get_products(email: str) -> List[Dict[str, str]]:
-    store = _read_store()
-    return store.get("subscriptions", {}).get(email.lower(), [])
 
+def get_products(email: str) -> List[Dict[str, Any]]:
+    with _db_lock:
+        rows = _connection().execute(
+            "SELECT url, company, added_at, rules FROM subscriptions WHERE email = ? ORDER BY id",
+            ((email or "").strip().lower(),)
+        ).fetchall()
+    return [_entry(*row) for row in rows]
 
-def add_product(email: str, product_url: str) -> Dict[str, Any]:
+
+def add_product(email: str, product_url: str, rules: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     email_key = (email or "").strip().lower()
     product_url = (product_url or "").strip()
     if not email_key or not product_url:
         return {"success": False, "error": "Email and URL are required"}
 
+    rules, error = _normalize_rules(rules)
+    if error:
+        return {"success": False, "error": error}
+
     # Basic URL sanity check
     parsed = urlparse(product_url)
     if parsed.scheme not in {"http", "https"} or not parsed.netloc:
@@ -52,40 +195,90 @@ def add_product(email: str, product_url: str) -> Dict[str, Any]:
 
     company = _detect_company(product_url)
     if not company:
-        return {"success": False, "error": "Unsupported product URL (only Lululemon/Nike supported)"}
+        return {"success": False, "error": f"Unsupported product URL (supported: {', '.join(registry.get_supported_retailers())})"}
 
-    store = _read_store()
-    subs = store.setdefault("subscriptions", {}).setdefault(email_key, [])
-
-    # Prevent duplicates
-    if any(entry.get("url") == product_url for entry in subs):
+    # The (email, url) unique index prevents duplicates, even between concurrent requests
+    added = _transaction(lambda conn: conn.execute(
+        "INSERT OR IGNORE INTO subscriptions (email, url, company, added_at, rules) VALUES (?, ?, ?, ?, ?)",
+        (email_key, product_url, company, datetime.now(timezone.utc).isoformat(),
+         json.dumps(rules) if rules else None)
+    ).rowcount)
+    if not added:
         return {"success": True, "message": "Product already added"}
-
-    subs.append({
-        "url": product_url,
-        "company": company,
-        "added_at": datetime.now(timezone.utc).isoformat()
-    })
-    _write_store(store)
     return {"success": True, "message": "Product added"}
 
 
+def set_rules(email: str, product_url: str, rules: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    email_key = (email or "").strip().lower()
+    product_url = (product_url or "").strip()
+    rules, error = _normalize_rules(rules)
+    if error:
+        return {"success": False, "error": error}
+
+    updated = _transaction(lambda conn: conn.execute(
+        "UPDATE subscriptions SET rules = ? WHERE email = ? AND url = ?",
+        (json.dumps(rules) if rules else None, email_key, product_url)
+    ).rowcount)
+    if not updated:
+        return {"success": False, "error": "Product not found"}
+    return {"success": True, "message": "Rules updated"}
+
+
 def remove_product(email: str, product_url: str) -> Dict[str, Any]:
     email_key = (email or "").strip().lower()
     product_url = (product_url or "").strip()
-    store = _read_store()
-    subs = store.setdefault("subscriptions", {}).setdefault(email_key, [])
-    before = len(subs)
-    subs = [entry for entry in subs if entry.get("url") != product_url]
-    store["subscriptions"][email_key] = subs
-    if len(subs) == before:
+    removed = _transaction(lambda conn: conn.execute(
+        "DELETE FROM subscriptions WHERE email = ? AND url = ?", (email_key, product_url)
+    ).rowcount)
+    if not removed:
         return {"success": False, "error": "Product not found"}
-    _write_store(store)
     return {"success": True, "message": "Product removed"}
 
 
-def list_all_subscriptions() -> Dict[str, List[Dict[str, str]]]:
-    store = _read_store()
-    return store.get("subscriptions", {})
+def list_all_subscriptions() -> Dict[str, List[Dict[str, Any]]]:
+    with _db_lock:
+        rows = _connection().execute(
+            "SELECT email, url, company, added_at, rules FROM subscriptions ORDER BY email, id"
+        ).fetchall()
+    subscriptions: Dict[str, List[Dict[str, Any]]] = {}
+    for email, *entry in rows:
+        subscriptions.setdefault(email, []).append(_entry(*entry))
+    return subscriptions
+
+
+def list_subscriptions(limit: int, after: Optional[Tuple[str, int]] = None, company: Optional[str] = None,
+                       email_prefix: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, int]]]:
+    """Get one page of subscriptions, ordered by email.
+
+    Args:
+        limit: Page size
+        after: ``(email, id)`` of the last subscription on the previous page
+        company: Only this retailer's products
+        email_prefix: Only users whose email starts with this
 
+    Returns:
+        The page's subscriptions (each with its ``email``) and the ``after`` for the
+        next page, or None on the last page
+    """
+    where, params = [], []
+    if company:
+        where.append("company = ?")
+        params.append(company.strip().lower())
+    prefix = (email_prefix or "").strip().lower()
+    if prefix:
+        # A range on the email index; the upper bound is the prefix with its last character bumped
+        where.append("email >= ? AND email < ?")
+        params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+    if after:
+        where.append("(email, id) > (?, ?)")
+        params += list(after)
+    query = "SELECT id, email, url, company, added_at, rules FROM subscriptions"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY email, id LIMIT ?"
+    with _db_lock:
+        rows = _connection().execute(query, params + [limit + 1]).fetchall()
 
+    page = [dict(email=email, **_entry(*entry)) for _, email, *entry in rows[:limit]]
+    next_after = (rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    return page, next_after
@@ -0,0 +1,125 @@
+"""
+Tests for the offline benchmark suite (fixtures, replay server and baseline comparison).
+"""
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the path to import modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from benchmarks import fixtures, load, run
+from retailers import RetailerRegistry
+
+
+class TestFixtures(unittest.TestCase):
+    """Test fixture loading and replay."""
+
+    def test_synthetic_fallback(self):
+        """Without recorded fixtures, synthetic pages are generated per retailer."""
+        with patch.object(fixtures, "FIXTURES_DIR", tempfile.mkdtemp()):
+            loaded = fixtures.load(synthetic_per_retailer=2)
+        self.assertEqual(loaded['source'], "synthetic")
+        self.assertEqual(sorted(page['retailer'] for page in loaded['pages']),
+                         ["lululemon", "lululemon", "nike", "nike"])
+
+    def test_server_replays_pages_to_the_right_retailer(self):
+        """Served URLs keep the retailer host, so the registry routes them but they're answered locally."""
+        pages = fixtures.load(synthetic_per_retailer=1)['pages']
+        with fixtures.FixtureServer(pages) as server:
+            self.assertEqual(len(server.urls), len(pages))
+            self.assertTrue(all(url.startswith("http://") for url in server.urls))
+            missing = requests.get(server.urls[0] + "-missing", timeout=5)
+            self.assertEqual(missing.status_code, 404)
+
+            results = RetailerRegistry(enable_cache=False).scrape_multiple(server.urls, use_cache=False, delay=0)
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual({result['retailer'] for result in results}, {"lululemon", "nike"})
+
+
+class TestBaselineComparison(unittest.TestCase):
+    """Test regression detection against a stored baseline."""
+
+    def report(self, **results):
+        return {
+            'meta': {'fixture_version': 1, 'fixture_source': 'synthetic', 'quick': False, 'latency': 0.0},
+            'results': results
+        }
+
+    def test_regressions_respect_direction_and_tolerance(self):
+        baseline = self.report(
+            latency=run._metric(0.100, "s"),
+            throughput=run._metric(100.0, "products/s", better="higher"),
+            failures=run._metric(0, "count"),
+        )
+        current = self.report(
+            latency=run._metric(0.120, "s"),
+            throughput=run._metric(60.0, "products/s", better="higher"),
+            failures=run._metric(1, "count"),
+        )
+        comparison = run.compare(current, baseline, tolerance=0.25)
+        self.assertTrue(comparison['comparable'])
+        self.assertEqual(comparison['regressions'], ["failures", "throughput"])
+        self.assertAlmostEqual(comparison['changes']['latency']['change'], 0.2)
+
+    def test_different_fixtures_are_not_compared(self):
+        baseline = self.report(latency=run._metric(0.1, "s"))
+        current = self.report(latency=run._metric(1.0, "s"))
+        current['meta']['fixture_source'] = "recorded"
+        comparison = run.compare(current, baseline)
+        self.assertFalse(comparison['comparable'])
+        self.assertEqual(comparison['regressions'], [])
+
+
+class TestDailyBenchmark(unittest.TestCase):
+    """Test the offline end-to-end daily run."""
+
+    def test_delivers_every_email_to_the_file_sink(self):
+        pages = fixtures.load(synthetic_per_retailer=1)['pages']
+        results = run.bench_daily(pages, recipient_counts=(30,))
+        self.assertEqual(results["daily.r30.undelivered"]['value'], 0)
+        self.assertGreater(results["daily.r30.emails_per_second"]['value'], 0)
+
+
+class TestStartupBenchmark(unittest.TestCase):
+    """Test CLI startup timing."""
+
+    def test_reports_each_command(self):
+        results = run.bench_startup(runs=1, commands=(("--help",), ("recipients", "list")))
+        self.assertEqual(sorted(results), ["startup.help.min", "startup.help.p50",
+                                           "startup.recipients_list.min", "startup.recipients_list.p50"])
+        self.assertTrue(all(result['value'] > 0 for result in results.values()))
+
+
+class TestLoadGenerator(unittest.TestCase):
+    """Test the web API load generator against a local app."""
+
+    def test_parse_mix(self):
+        self.assertEqual(load.parse_mix("read"), load.MIXES["read"])
+        self.assertEqual(load.parse_mix("status=3,subscribe"), {"status": 3, "subscribe": 1})
+        with self.assertRaises(ValueError):
+            load.parse_mix("status=1,nope=2")
+
+    def test_reports_per_endpoint(self):
+        import subscriptions_store
+        original_file = subscriptions_store.SUBSCRIPTIONS_FILE
+
+        with load.local_app(subscribers=5) as base_url:
+            report = load.generate_load(base_url, {"status": 1, "subscriptions": 1, "subscribe": 1},
+                                        clients=2, total_requests=30)
+
+        self.assertEqual(subscriptions_store.SUBSCRIPTIONS_FILE, original_file)
+        self.assertEqual(report['total']['requests'], 30)
+        self.assertEqual(report['total']['errors'], 0)
+        status = report['endpoints']["GET /api/status"]
+        self.assertEqual(sum(status['statuses'].values()), status['requests'])
+        self.assertIsNotNone(status['latency']['p95'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,9 @@ from unittest.mock import Mock, patch, MagicMock
 import sys
 import os
 import json
+import asyncio
+import threading
+import time
 from datetime import datetime, timedelta
 
 # Add the parent directory to the path to import modules
@@ -254,6 +257,77 @@ class TestRetailerRegistry(unittest.TestCase):
         self.assertGreater(len(self.registry.retailers), 0)
         self.assertIn("lululemon", self.registry.get_supported_retailers())
         self.assertIn("nike", self.registry.get_supported_retailers())
+        # Scrapers are only instantiated once they are needed
+        self.assertEqual(self.registry.get_loaded_retailers(), [])
+    
+    def test_retailers_are_instantiated_on_first_matching_url(self):
+        """Test lazy instantiation and host-based routing."""
+        self.assertEqual(self.registry.get_retailer_name_for_url("https://www.nike.com/t/shoe/1"), "nike")
+        self.assertEqual(self.registry.get_loaded_retailers(), [])
+        
+        retailer = self.registry.get_retailer_for_url("https://www.nike.com/t/shoe/1")
+        self.assertIsInstance(retailer, NikeRetailer)
+        self.assertEqual(self.registry.get_loaded_retailers(), ["nike"])
+        self.assertIs(self.registry.retailers["nike"], retailer)
+        self.assertIs(self.registry.get_retailer("nike"), retailer)
+        
+        # Hosts match subdomains, not arbitrary substrings of the URL
+        self.assertEqual(self.registry.get_retailer_name_for_url("https://NIKE.com/t/shoe/1"), "nike")
+        self.assertIsNone(self.registry.get_retailer_name_for_url("https://notnike.com/t/shoe/1"))
+        self.assertIsNone(self.registry.get_retailer_name_for_url("https://example.com/?ref=www.nike.com"))
+    
+    def test_register_spec(self):
+        """Test declaring a retailer statically."""
+        spec = retailers.RetailerSpec("nike-outlet", ("nikeoutlet.example",), "retailers.nike:NikeRetailer")
+        self.registry.register_spec(spec)
+        self.assertIn("nike-outlet", self.registry.get_supported_retailers())
+        self.assertIs(self.registry.get_spec("nike-outlet"), spec)
+        self.assertEqual(self.registry.get_retailer_name_for_url("https://shop.nikeoutlet.example/p/1"), "nike-outlet")
+        self.assertNotIn("nike-outlet", self.registry.get_loaded_retailers())
+    
+    def test_plugins_are_discovered_from_entry_points(self):
+        """Test entry point discovery, skipping plugins that fail to load."""
+        from retailers import plugins
+        
+        good = Mock()
+        good.load.return_value = plugins.RetailerSpec("adidas", ("adidas.com",), "adidas_plugin:AdidasRetailer")
+        broken = Mock()
+        broken.name = "broken"
+        broken.load.side_effect = ImportError("missing dependency")
+        found = [good, broken] if sys.version_info >= (3, 10) else {plugins.ENTRY_POINT_GROUP: [good, broken]}
+        with patch("importlib.metadata.entry_points", return_value=found):
+            reg = RetailerRegistry(enable_cache=False)
+            self.assertEqual(reg.get_supported_retailers(), ["lululemon", "nike", "adidas"])
+        # The plugin's scraper module is never imported just to route or list it
+        self.assertEqual(reg.get_retailer_name_for_url("https://www.adidas.com/us/shoe"), "adidas")
+    
+    def test_plugins_are_discovered_from_installed_distributions(self):
+        """Test discovery through the real importlib.metadata API on this Python version."""
+        import importlib
+        import shutil
+        import tempfile
+        from retailers import plugins
+        
+        site = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, site)
+        with open(os.path.join(site, "sale_tracker_example_spec.py"), "w") as f:
+            f.write("from retailers.plugins import RetailerSpec\n"
+                    "SPEC = RetailerSpec('example', ('shop.example',), 'example_scraper:ExampleRetailer')\n")
+        dist_info = os.path.join(site, "sale_tracker_example-1.0.dist-info")
+        os.mkdir(dist_info)
+        with open(os.path.join(dist_info, "METADATA"), "w") as f:
+            f.write("Metadata-Version: 2.1\nName: sale-tracker-example\nVersion: 1.0\n")
+        with open(os.path.join(dist_info, "entry_points.txt"), "w") as f:
+            f.write(f"[{plugins.ENTRY_POINT_GROUP}]\nexample = sale_tracker_example_spec:SPEC\n")
+        
+        sys.path.insert(0, site)
+        self.addCleanup(sys.path.remove, site)
+        self.addCleanup(sys.modules.pop, "sale_tracker_example_spec", None)
+        importlib.invalidate_caches()
+        
+        names = [spec.name for spec in plugins.discover()]
+        self.assertEqual(names[:2], ["lululemon", "nike"])
+        self.assertIn("example", names)
     
     def test_get_retailer_for_url(self):
         """Test finding appropriate retailer for URL."""
@@ -307,6 +381,56 @@ class TestRetailerRegistry(unittest.TestCase):
         self.assertEqual(results[0]['retailer'], "lululemon")
         self.assertEqual(results[1]['retailer'], "nike")
     
+    def test_concurrent_scrapes_share_one_fetch(self):
+        """Test that concurrent callers for the same canonical URL share one fetch."""
+        release = threading.Event()
+        calls = []
+        
+        def slow_scrape(url):
+            calls.append(url)
+            release.wait(5)
+            return ("Shared Product", "$90USD", "")
+        
+        urls = ["https://www.nike.com/t/shoe/1", "https://www.nike.com/t/shoe/1/"] * 2
+        results = []
+        with patch('retailers.nike.NikeRetailer.scrape_product', side_effect=slow_scrape):
+            threads = [threading.Thread(target=lambda u=u: results.append(self.registry.scrape_product(u)))
+                       for u in urls]
+            for thread in threads:
+                thread.start()
+            for _ in range(500):
+                if self.registry.get_coalescing_stats()['fetches_saved'] == len(urls) - 1:
+                    break
+                threading.Event().wait(0.01)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [("Shared Product", "$90USD", "")] * len(urls))
+        stats = self.registry.get_coalescing_stats()
+        self.assertEqual(stats['fetches'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+    
+    @patch('retailers.nike.NikeRetailer.scrape_product')
+    def test_concurrent_async_scrapes_share_one_fetch(self, mock_scrape):
+        """Test the async variant, including errors propagating to every waiter."""
+        def blocked(url):
+            threading.Event().wait(0.2)
+            raise RuntimeError("blocked")
+        mock_scrape.side_effect = blocked
+        
+        async def scrape_all():
+            return await asyncio.gather(
+                *(self.registry.scrape_product_async("https://www.nike.com/t/shoe/2") for _ in range(3)),
+                return_exceptions=True
+            )
+        
+        results = asyncio.run(scrape_all())
+        self.assertEqual(mock_scrape.call_count, 1)
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(self.registry.get_coalescing_stats()['fetches_saved'], 2)
+    
     def test_get_cache_stats(self):
         """Test cache statistics."""
         stats = self.registry.get_cache_stats()
@@ -315,6 +439,925 @@ class TestRetailerRegistry(unittest.TestCase):
         self.assertIn('default_ttl', stats)
 
 
+class TestConcurrency(unittest.TestCase):
+    """Stress the shared registry, cache and metrics from many threads."""
+    
+    THREADS = 8
+    ITERATIONS = 2000
+    
+    def setUp(self):
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # Switch threads as often as possible to expose races
+    
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+    
+    def run_threads(self, target):
+        errors = []
+        
+        def worker(n):
+            try:
+                target(n)
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+        
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertEqual(errors, [])
+    
+    def test_cache_under_contention(self):
+        """Test concurrent get/set/expire on overlapping keys."""
+        from retailers.registry import SimpleCache
+        cache = SimpleCache(default_ttl=3600)
+        expired = datetime.now() - timedelta(seconds=1)
+        
+        def work(n):
+            for i in range(self.ITERATIONS):
+                key = f"key-{i % 50}"
+                if i % 3 == 0:
+                    with cache._lock_for(key):
+                        cache.cache[key] = (("stale", "$1", ""), expired)
+                elif i % 3 == 1:
+                    cache.set(key, (f"Product {n}", "$100", ""))
+                else:
+                    value = cache.get(key)
+                    self.assertTrue(value is None or value[0].startswith("Product"))
+        
+        self.run_threads(work)
+        self.assertLessEqual(cache.size(), 50)
+    
+    def test_metrics_counts_are_exact(self):
+        """Test that per-thread accumulators lose no updates, including after their threads exit."""
+        import main_enhanced
+        metrics = main_enhanced.PerformanceMetrics()
+        
+        def work(n):
+            for i in range(self.ITERATIONS):
+                metrics.record_scrape(i % 4 != 0, 0.01)
+                if i % 10 == 0:
+                    metrics.record_email_sent()
+                    metrics.get_metrics()
+        
+        self.run_threads(work)
+        # The worker threads have exited, so their counts live on only in the retired total
+        self.assertEqual(metrics._accumulators.snapshot()[1:], [])
+        result = metrics.get_metrics()
+        total = self.THREADS * self.ITERATIONS
+        self.assertEqual(result['scrapes_total'], total)
+        self.assertEqual(result['scrapes_failed'], total // 4)
+        self.assertEqual(result['scrapes_successful'], total - total // 4)
+        self.assertEqual(result['emails_sent'], self.THREADS * self.ITERATIONS // 10)
+        self.assertAlmostEqual(result['avg_scrape_time'], 0.01)
+    
+    @patch('retailers.nike.NikeRetailer.scrape_product', return_value=("Nike Product", "$150USD", ""))
+    def test_registry_scrapes_while_registering(self, _mock_scrape):
+        """Test concurrent scrapes, cache hits and retailer registration."""
+        reg = RetailerRegistry(enable_cache=True)
+        
+        def work(n):
+            for i in range(self.ITERATIONS // 10):
+                if n == 0 and i % 20 == 0:
+                    retailer = NikeRetailer()
+                    retailer.name = f"nike-{i}"
+                    reg.register_retailer(retailer)
+                name, _, _ = reg.scrape_product(f"https://www.nike.com/t/shoe/{i % 25}")
+                self.assertEqual(name, "Nike Product")
+                if i % 50 == 0:
+                    reg.clear_cache()
+        
+        self.run_threads(work)
+        stats = reg.get_coalescing_stats()
+        self.assertEqual(stats['in_flight'], 0)
+
+
+class TestLatencyMetrics(unittest.TestCase):
+    """Test latency histograms and per-stage scrape timings."""
+    
+    def test_percentiles_are_accurate(self):
+        """Test percentiles stay within the histogram's relative error."""
+        from retailers.metrics import LatencyHistogram
+        histogram = LatencyHistogram()
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000)
+        
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 1000)
+        self.assertAlmostEqual(summary['mean'], 0.5005)
+        for p, expected in ((50, 0.5), (95, 0.95), (99, 0.99)):
+            self.assertAlmostEqual(summary[f'p{p}'], expected, delta=expected / LatencyHistogram.SUB_BUCKETS)
+        self.assertEqual(summary['max'], 1.0)
+    
+    def test_empty_and_extreme_values(self):
+        """Test empty histograms and values outside the bucket range."""
+        from retailers.metrics import LatencyHistogram
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.summary()['p99'])
+        
+        histogram.record(0.0)
+        histogram.record(1e6)
+        summary = histogram.summary()
+        self.assertLess(summary['p50'], 2e-6)
+        self.assertEqual(summary['p99'], 1e6)
+    
+    def test_exited_threads_are_folded_into_the_total(self):
+        """Test short-lived threads don't each leave a shard behind."""
+        from retailers.metrics import LatencyHistogram
+        histogram = LatencyHistogram()
+        for _ in range(20):
+            thread = threading.Thread(target=histogram.record, args=(0.01,))
+            thread.start()
+            thread.join()
+        
+        self.assertEqual(histogram._shards.snapshot()[1:], [])
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 20)
+        self.assertEqual(summary['min'], 0.01)
+    
+    @patch('requests.Session.get')
+    def test_scrape_records_stages(self, mock_get):
+        """Test that a scrape through the registry times every stage."""
+        from retailers.metrics import latency
+        mock_response = Mock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.text = "<html><body><h1>Shoe</h1></body></html>"
+        mock_get.return_value = mock_response
+        latency.clear()
+        
+        reg = RetailerRegistry(enable_cache=True)
+        results = reg.scrape_multiple(["https://www.nike.com/t/shoe/1", "https://www.nike.com/t/shoe/1"], delay=0)
+        
+        stats = reg.get_latency_stats()['nike']
+        for stage in ("connect", "download", "parse", "extract"):
+            self.assertEqual(stats[stage]['count'], 1)
+        self.assertEqual(stats['cache_lookup']['count'], 3)  # Miss, re-check in flight, hit
+        self.assertEqual(stats['total']['count'], 2)
+        self.assertTrue(all(r['duration'] >= 0 for r in results))
+        mock_response.close.assert_called_once()
+    
+    def test_scrape_metrics_use_per_url_durations(self):
+        """Test that each product's own duration is recorded, not the batch average."""
+        import main_enhanced
+        results = [
+            {'url': 'https://www.nike.com/t/a/1', 'success': True, 'duration': 0.1},
+            {'url': 'https://www.nike.com/t/b/2', 'success': False, 'duration': 2.0},
+        ]
+        perf = main_enhanced.PerformanceMetrics()
+        with patch.object(main_enhanced, 'metrics', perf), \
+                patch.object(main_enhanced.registry, 'scrape_multiple', return_value=results), \
+                patch.dict(main_enhanced.config.STORAGE_SETTINGS, {'enable_price_history': False}):
+            main_enhanced.scrape_products_enhanced({'nike': [r['url'] for r in results]})
+        
+        recorded = perf.get_metrics()
+        self.assertEqual(recorded['scrapes_total'], 2)
+        self.assertEqual(recorded['scrape_latency']['min'], 0.1)
+        self.assertEqual(recorded['scrape_latency']['max'], 2.0)
+        self.assertAlmostEqual(recorded['avg_scrape_time'], 1.05)
+
+
+class TestTracing(unittest.TestCase):
+    """Test span tracing and Chrome trace output."""
+    
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+    
+    def test_disabled_tracing_records_nothing(self):
+        """Test that spans are shared no-ops outside a recording."""
+        from retailers.tracing import Tracer
+        tracer = Tracer()
+        self.assertIs(tracer.span("a"), tracer.span("b"))
+        with tracer.recording("run", self.tmpdir, enabled=False) as run:
+            with tracer.span("work"):
+                pass
+        self.assertIsNone(run.path)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+    
+    @patch('requests.Session.get')
+    def test_recording_writes_chrome_trace(self, mock_get):
+        """Test a recorded scrape run produces a nested timeline."""
+        from retailers import tracer
+        import requests
+        mock_response = Mock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.text = "<html><body><h1>Shoe</h1></body></html>"
+        mock_get.side_effect = [requests.exceptions.ConnectionError("reset"), mock_response, mock_response]
+        
+        reg = RetailerRegistry(enable_cache=False)
+        with patch('retailers.base.time.sleep'), patch('retailers.registry.time.sleep'):
+            with tracer.recording("test_run", self.tmpdir) as run:
+                reg.scrape_multiple(["https://www.nike.com/t/a/1", "https://www.nike.com/t/b/2"], delay=0.5)
+        
+        with open(run.path) as f:
+            trace = json.load(f)
+        spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        names = [e["name"] for e in spans]
+        for name in ("test_run", "scrape_multiple", "registry.scrape_product", "scrape_product",
+                     "connect", "download", "parse", "extract_product_info", "retry_backoff", "throttle"):
+            self.assertIn(name, names)
+        self.assertEqual(names.count("scrape_product"), 2)
+        first_scrape = next(e for e in spans if e["name"] == "scrape_product")
+        self.assertEqual(first_scrape["args"]["attempts"], 2)
+        self.assertTrue(any(e["ph"] == "M" for e in trace["traceEvents"]))
+        self.assertFalse(tracer.enabled)
+    
+    def test_concurrent_recordings_are_kept_apart(self):
+        """Test recordings in different threads each write only their own spans."""
+        from retailers.tracing import Tracer
+        tracer = Tracer()
+        both_started = threading.Barrier(2)
+        paths = {}
+        
+        def run(name):
+            with tracer.recording(name, self.tmpdir) as recording:
+                both_started.wait(5)
+                with tracer.span(f"{name}_work"):
+                    with tracer.recording("nested", self.tmpdir) as nested:
+                        pass
+                both_started.wait(5)
+            self.assertIsNone(nested.path)
+            paths[name] = recording.path
+        
+        threads = [threading.Thread(target=run, args=(name,)) for name in ("scrape", "daily_email")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        
+        for name in ("scrape", "daily_email"):
+            with open(paths[name]) as f:
+                names = {e["name"] for e in json.load(f)["traceEvents"] if e["ph"] == "X"}
+            self.assertEqual(names, {name, f"{name}_work", "nested"})
+        self.assertFalse(tracer.enabled)
+
+
+class TestScheduler(unittest.TestCase):
+    """Test the heap scheduler's timing, overlap protection and catch-up."""
+    
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "scheduler.db")
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+    
+    def test_daily_schedule_fires_at_next_occurrence(self):
+        """Test daily fire times roll over to tomorrow once passed."""
+        from scheduler import DailyAt
+        morning = datetime(2024, 5, 1, 8, 30).timestamp()
+        self.assertEqual(DailyAt("21:00").next_after(morning), datetime(2024, 5, 1, 21, 0).timestamp())
+        evening = datetime(2024, 5, 1, 21, 0).timestamp()
+        self.assertEqual(DailyAt("21:00").next_after(evening), datetime(2024, 5, 2, 21, 0).timestamp())
+    
+    def test_runs_due_jobs_without_polling(self):
+        """Test jobs run at their fire time while thousands of idle jobs wait."""
+        from scheduler import Scheduler
+        sched = Scheduler(self.db_path, workers=2)
+        fired = threading.Event()
+        for i in range(2000):
+            sched.add(f"product:{i}", lambda: None, every=3600)
+        sched.add("fast", fired.set, every=0.05)
+        sched.start()
+        try:
+            self.assertTrue(fired.wait(2))
+        finally:
+            sched.stop(wait=True)
+        jobs = {job['name']: job for job in sched.get_jobs()}
+        self.assertGreaterEqual(jobs['fast']['runs'], 1)
+        self.assertEqual(jobs['product:0']['runs'], 0)
+    
+    def test_overlapping_runs_are_skipped(self):
+        """Test a job still running when it comes due again isn't started twice."""
+        from scheduler import Scheduler
+        sched = Scheduler(self.db_path, workers=4)
+        release = threading.Event()
+        calls = []
+        
+        def slow():
+            calls.append(1)
+            release.wait(2)
+        
+        job = sched.add("slow", slow, every=0.02)
+        sched.start()
+        try:
+            deadline = time.time() + 2
+            while job.skipped < 3 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            release.set()
+            sched.stop(wait=True)
+        self.assertEqual(len(calls), 1)
+        self.assertGreaterEqual(job.skipped, 3)
+    
+    def test_stop_cancels_runs_that_have_not_started(self):
+        """Test runs queued behind busy workers are dropped on stop."""
+        from scheduler import Scheduler
+        sched = Scheduler(self.db_path, workers=1)
+        started, release = threading.Event(), threading.Event()
+        queued = []
+        
+        def busy():
+            started.set()
+            release.wait(2)
+        
+        sched.add("busy", busy, every=0.01)
+        waiting = sched.add("queued", lambda: queued.append(1), every=0.01)
+        sched.start()
+        self.assertTrue(started.wait(2))
+        deadline = time.time() + 2
+        while not waiting.running and time.time() < deadline:
+            time.sleep(0.01)
+        ran = len(queued)
+        threading.Timer(0.1, release.set).start()
+        sched.stop(wait=True)
+        self.assertEqual(len(queued), ran)
+        self.assertFalse(waiting.running)
+    
+    def test_restart_catches_up_missed_run_once(self):
+        """Test persisted state makes a restarted scheduler run a missed job once."""
+        from scheduler import Scheduler
+        now = datetime(2024, 5, 2, 8, 0).timestamp()
+        last_run = datetime(2024, 5, 1, 9, 0).timestamp()  # Missed 21:00 yesterday
+        
+        first = Scheduler(self.db_path, clock=lambda: last_run)
+        for job in (first.add("daily_email", lambda: None, at="21:00"), first.add("health", lambda: None, every=60)):
+            job.last_run = last_run
+            first._save(job)
+        
+        restarted = Scheduler(self.db_path, clock=lambda: now)
+        fired = []
+        caught_up = threading.Event()
+        
+        def daily(fire_time):
+            fired.append(fire_time)
+            caught_up.set()
+        
+        self.assertEqual(restarted.add("daily_email", daily, at="21:00", pass_fire_time=True).next_run, now)
+        self.assertEqual(restarted.add("health", lambda: None, every=60, catch_up=False).next_run, now + 60)
+        restarted.start()
+        try:
+            self.assertTrue(caught_up.wait(2))
+        finally:
+            restarted.stop(wait=True)
+        # The caught-up run is for the missed 21:00, not the time it actually ran
+        self.assertEqual(fired, [datetime(2024, 5, 1, 21, 0).timestamp()])
+        
+        too_late = Scheduler(self.db_path, clock=lambda: now, catch_up_window=3600)
+        self.assertEqual(too_late.add("daily_email", lambda: None, at="21:00").next_run,
+                         datetime(2024, 5, 2, 21, 0).timestamp())
+
+
+class TestWorkQueue(unittest.TestCase):
+    """Test leased work units and sharded daily runs."""
+    
+    def setUp(self):
+        import tempfile
+        from work_queue import WorkQueue
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "work.db")
+        self.queue = WorkQueue(self.db_path, lease_seconds=60, max_attempts=2)
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+    
+    def test_create_run_is_idempotent(self):
+        """Test only the first worker creates a run's units."""
+        self.assertTrue(self.queue.create_run("r", "fetch", [[1], [2]]))
+        self.assertFalse(self.queue.create_run("r", "fetch", [[1], [2], [3]]))
+        self.assertEqual(self.queue.get_run("r")['units'], {'fetch': {'pending': 2}})
+    
+    def test_expired_lease_is_taken_over(self):
+        """Test a crashed worker's unit goes to another worker, then fails after max attempts."""
+        from work_queue import WorkQueue
+        self.queue.create_run("r", "fetch", [["a"]])
+        crashed = self.queue.claim("r", "fetch")
+        self.assertIsNone(self.queue.claim("r", "fetch"))
+        
+        now = time.time()
+        with patch('work_queue.time.time', return_value=now + 120):
+            other = WorkQueue(self.db_path, lease_seconds=60, max_attempts=2)
+            takeover = other.claim("r", "fetch")
+            self.assertEqual((takeover.seq, takeover.attempt), (crashed.seq, 2))
+            self.assertFalse(self.queue.complete(crashed, "late"))
+        with patch('work_queue.time.time', return_value=now + 240):
+            self.assertIsNone(other.claim("r", "fetch"))
+        self.assertEqual(self.queue.get_run("r")['units'], {'fetch': {'failed': 1}})
+    
+    def test_lease_is_kept_while_waiting_for_the_send_budget(self):
+        """Test a unit held past its lease (waiting on the send budget) isn't taken over."""
+        from outbound import SendBudget
+        from work_queue import LeaseLost, WorkQueue
+        queue = WorkQueue(self.db_path, lease_seconds=0.3, max_attempts=2)
+        other = WorkQueue(self.db_path, lease_seconds=0.3, max_attempts=2)
+        queue.create_run("r", "email", [["a@example.com"], ["b@example.com"]])
+        unit = queue.claim("r", "email")
+        
+        budget = SendBudget(os.path.join(self.tmpdir, "outbound.db"), settings={'max_per_minute': 60})
+        budget.reserve()  # The next slot is a second away, well past the lease
+        started = time.monotonic()
+        budget.acquire(keep_alive=queue.keep_alive(unit))
+        self.assertGreater(time.monotonic() - started, 0.5)
+        self.assertEqual(other.claim("r", "email").seq, 1)  # Only the unclaimed unit is available
+        self.assertTrue(queue.complete(unit, {'sent': 1}))
+        
+        # Without renewals the lease runs out, another worker takes over and the keeper notices
+        queue.create_run("s", "email", [["c@example.com"]])
+        lapsed = queue.claim("s", "email")
+        keep_alive = queue.keep_alive(lapsed)
+        time.sleep(0.35)
+        self.assertIsNotNone(other.claim("s", "email"))
+        with self.assertRaises(LeaseLost):
+            keep_alive()
+    
+    def test_retries_back_off_and_deferrals_keep_their_attempts(self):
+        """Test a failed unit waits before its retry, and a deferred one isn't charged an attempt."""
+        from work_queue import WorkQueue
+        queue = WorkQueue(self.db_path, lease_seconds=60, max_attempts=2, retry_backoff=30)
+        queue.create_run("r", "email", [["a@example.com"]])
+        now = time.time()
+        with patch('work_queue.time.time', return_value=now):
+            queue.fail(queue.claim("r", "email"), "connection reset")
+            self.assertIsNone(queue.claim("r", "email"))
+            self.assertEqual(queue.next_retry("r", "email"), now + 30)
+        with patch('work_queue.time.time', return_value=now + 31):
+            unit = queue.claim("r", "email")
+            self.assertEqual(unit.attempt, 2)
+            queue.defer(unit, 3600, "Daily send cap reached")
+        with patch('work_queue.time.time', return_value=now + 3632):
+            self.assertEqual(queue.claim("r", "email").attempt, 2)
+    
+    def test_failed_units_keep_the_run_open_for_a_rerun(self):
+        """Test a run with failed units isn't marked done, and rerunning it retries them."""
+        import main_enhanced
+        from work_queue import RunIncomplete, WorkQueue
+        queue = WorkQueue(self.db_path, lease_seconds=60, max_attempts=2, retry_backoff=0)
+        emailed = []
+        outage = [True]
+        
+        def fake_send(products, batch, run_date=None, keep_alive=None):
+            if outage[0] and "b@example.com" in batch:
+                raise RuntimeError("SMTP server unavailable")
+            emailed.extend(batch)
+        
+        settings = dict(config.DAILY_RUN_SETTINGS, email_unit_size=1, poll_interval=0.01)
+        with patch.object(main_enhanced, 'work_queue', queue), \
+                patch.object(main_enhanced, 'gather_products', return_value=[]), \
+                patch.object(main_enhanced, 'send_enhanced_email', side_effect=fake_send), \
+                patch.object(config, '_env_loaded', True), \
+                patch.dict(os.environ, {'RECIPIENT_EMAIL': '', 'RECIPIENT_EMAIL2': ''}), \
+                patch.object(main_enhanced.recipients_store, 'load_recipients',
+                             return_value=["a@example.com", "b@example.com"]), \
+                patch.dict(config.ALERT_SETTINGS, {'enabled': False}), \
+                patch.dict(config.DAILY_RUN_SETTINGS, settings):
+            with self.assertRaises(RunIncomplete):
+                main_enhanced.send_daily_email_enhanced(run_id="daily-test")
+            self.assertEqual(queue.get_run("daily-test")['stage'], "email")
+            
+            outage[0] = False
+            main_enhanced.send_daily_email_enhanced(run_id="daily-test")
+        self.assertEqual(sorted(emailed), ["a@example.com", "b@example.com"])
+        self.assertEqual(queue.get_run("daily-test")['stage'], "done")
+    
+    def test_stage_advances_once(self):
+        """Test only one worker moves a finished stage on."""
+        self.queue.create_run("r", "fetch", [["a"]])
+        unit = self.queue.claim("r", "fetch")
+        self.assertFalse(self.queue.stage_finished("r", "fetch"))
+        self.queue.complete(unit, [{"url": "a"}])
+        self.assertTrue(self.queue.stage_finished("r", "fetch"))
+        self.assertTrue(self.queue.advance("r", "fetch", "email", [["x@example.com"]]))
+        self.assertFalse(self.queue.advance("r", "fetch", "email", [["x@example.com"]]))
+        self.assertEqual(self.queue.results("r", "fetch"), [[{"url": "a"}]])
+    
+    def test_daily_run_shared_by_workers(self):
+        """Test concurrent workers fetch each product and email each recipient exactly once."""
+        import main_enhanced
+        urls = [f"https://www.nike.com/t/p/{i}" for i in range(12)]
+        recipients = [f"user{i}@example.com" for i in range(7)]
+        fetched, emailed = [], []
+        
+        def fake_gather(product_links, on_result=None, sync=True):
+            time.sleep(0.05)
+            shard = product_links['shard']
+            fetched.extend(shard)
+            return [{'url': url, 'product_id': url, 'success': True} for url in shard]
+        
+        def fake_send(products, batch, before=None, run_date=None, keep_alive=None):
+            self.assertEqual(len(products), len(urls))
+            emailed.extend(batch)
+            return len(batch)
+        
+        def fake_alerts(products, batch, before=None):
+            return {recipient: [{'product_id': 'p', 'price_drop_pct': 10.0}] for recipient in batch}
+        
+        settings = dict(config.DAILY_RUN_SETTINGS, fetch_unit_size=2, email_unit_size=3, poll_interval=0.01)
+        with patch.object(main_enhanced, 'work_queue', self.queue), \
+                patch.object(main_enhanced.price_alerts, 'detect_price_drops', side_effect=fake_alerts), \
+                patch.object(main_enhanced, 'collect_product_links', return_value={'nike': urls}), \
+                patch.object(main_enhanced, 'gather_products', side_effect=fake_gather), \
+                patch.object(main_enhanced, 'send_price_alert_emails', side_effect=fake_send), \
+                patch.object(config, '_env_loaded', True), \
+                patch.dict(os.environ, {'RECIPIENT_EMAIL': '', 'RECIPIENT_EMAIL2': ''}), \
+                patch.object(main_enhanced.recipients_store, 'load_recipients', return_value=recipients), \
+                patch.dict(config.DAILY_RUN_SETTINGS, settings):
+            workers = [threading.Thread(target=main_enhanced.send_daily_email_enhanced, kwargs={'run_id': "daily-test"})
+                       for _ in range(3)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join(10)
+        
+        self.assertEqual(sorted(fetched), sorted(urls))
+        self.assertEqual(sorted(emailed), sorted(recipients))
+        run = self.queue.get_run("daily-test")
+        self.assertEqual(run['stage'], "done")
+        self.assertEqual(run['units'], {'fetch': {'done': 6}, 'email': {'done': 3}})
+    
+    def test_scheduled_run_is_keyed_on_its_fire_date(self):
+        """Test a 21:00 run caught up after midnight doesn't use up the next day's run."""
+        import main_enhanced
+        with patch.object(main_enhanced, '_run_daily_email') as run_daily_email:
+            main_enhanced._scheduled_daily_email(datetime(2024, 5, 1, 21, 0).timestamp())
+        _, run_id, run_date = run_daily_email.call_args[0]
+        self.assertEqual(run_id, "daily-2024-05-01")
+        self.assertEqual(run_date.isoformat(), "2024-05-01")
+
+
+class TestDeliveryLedger(unittest.TestCase):
+    """Test resumable email delivery."""
+    
+    def setUp(self):
+        import tempfile
+        from delivery_ledger import DeliveryLedger
+        self.tmpdir = tempfile.mkdtemp()
+        self.ledger = DeliveryLedger(os.path.join(self.tmpdir, "deliveries.db"))
+        self.products = [{'url': 'https://www.nike.com/t/a/1', 'name': 'Shoe', 'price': '$90.00',
+                          'retailer': 'nike', 'image': '', 'success': True, 'timestamp': '2024-05-01T21:00:00'}]
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+    
+    def test_content_hash_ignores_timestamps(self):
+        """Test the hash changes with what the recipient sees, not when it was scraped."""
+        from delivery_ledger import content_hash
+        later = [dict(self.products[0], timestamp='2024-05-01T21:05:00')]
+        cheaper = [dict(self.products[0], price='$70.00')]
+        self.assertEqual(content_hash("s", self.products), content_hash("s", later))
+        self.assertNotEqual(content_hash("s", self.products), content_hash("s", cheaper))
+    
+    @patch('smtplib.SMTP')
+    def test_retried_send_skips_delivered_recipients(self, mock_smtp):
+        """Test a failed recipient fails the send, and the retry only emails that recipient."""
+        import smtplib
+        import main_enhanced
+        from delivery_ledger import DeliveryError
+        from outbound import SendBudget
+        server = mock_smtp.return_value
+        server.sendmail.side_effect = [None, smtplib.SMTPException("down"), None]
+        
+        budget = Mock()
+        with patch.object(main_enhanced.delivery_ledger, 'ledger', self.ledger), \
+                patch.object(main_enhanced.outbound, 'budget', budget), \
+                patch.object(main_enhanced, 'get_email_credentials', return_value=("me@example.com", "pw", [])), \
+                patch.dict(config.EMAIL_SETTINGS, {'max_retries': 1}):
+            with self.assertRaises(DeliveryError):
+                main_enhanced.send_enhanced_email(self.products, ["a@example.com", "b@example.com"],
+                                                  run_date="2024-05-01")
+            self.assertEqual(main_enhanced.send_enhanced_email(self.products, ["a@example.com", "b@example.com"],
+                                                               run_date="2024-05-01"), [])
+        
+        recipients = [call.args[1] for call in server.sendmail.call_args_list]
+        self.assertEqual(recipients, ["a@example.com", "b@example.com", "b@example.com"])
+        self.assertEqual(self.ledger.count("2024-05-01"), 2)
+    
+    def test_exited_workers_units_are_resumed(self):
+        """Test a unit leased by a process that has exited is taken over without waiting for its lease."""
+        from work_queue import WorkQueue
+        queue = WorkQueue(os.path.join(self.tmpdir, "work.db"), lease_seconds=3600)
+        queue.create_run("r", "email", [["a@example.com"]])
+        self.assertIsNotNone(queue.claim("r", "email"))
+        self.assertIsNone(queue.claim("r", "email"))
+        with patch('work_queue._owner_alive', return_value=False):
+            resumed = queue.claim("r", "email")
+        self.assertEqual((resumed.seq, resumed.attempt), (0, 2))
+
+
+class TestSendBudget(unittest.TestCase):
+    """Test shared outbound email pacing."""
+    
+    def setUp(self):
+        import tempfile
+        from outbound import SendBudget
+        self.tmpdir = tempfile.mkdtemp()
+        self.budget = SendBudget(os.path.join(self.tmpdir, "outbound.db"), settings={
+            'max_per_minute': 60, 'min_per_minute': 1, 'max_per_day': 3, 'send_window': 0,
+            'backoff_factor': 0.5, 'recovery_step': 10, 'throttle_pause': 30
+        })
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+    
+    def test_slots_follow_the_rate(self):
+        """Test consecutive slots are 60/rate seconds apart, or spread across the window."""
+        waits = [self.budget.reserve() for _ in range(3)]
+        self.assertAlmostEqual(waits[0], 0.0, places=1)
+        self.assertAlmostEqual(waits[2] - waits[1], 1.0, places=1)
+        
+        self.budget.spread(count=10, window=100)
+        last = self.budget.reserve()
+        self.assertAlmostEqual(self.budget.reserve() - last, 10.0, places=1)
+    
+    def test_throttling_slows_down_then_recovers(self):
+        """Test a 4xx reply halves the rate and pauses, and deliveries win the rate back."""
+        self.budget.record_throttled()
+        stats = self.budget.get_stats()
+        self.assertEqual(stats['rate_per_minute'], 30.0)
+        self.assertGreater(stats['next_slot_in'], 29)
+        self.budget.record_sent()
+        self.assertEqual(self.budget.get_stats()['rate_per_minute'], 40.0)
+    
+    def test_daily_cap(self):
+        """Test no slot is given once the rolling 24-hour cap is used up."""
+        from outbound import BudgetExhausted
+        for _ in range(3):
+            self.budget.record_sent()
+        with self.assertRaises(BudgetExhausted):
+            self.budget.reserve()
+    
+    @patch('smtplib.SMTP')
+    def test_throttle_reply_retries_through_the_budget(self, mock_smtp):
+        """Test a 421 reply lowers the shared rate and is retried without the fixed retry delay."""
+        import smtplib
+        import main_enhanced
+        server = mock_smtp.return_value
+        server.sendmail.side_effect = [smtplib.SMTPResponseException(421, b"Try again later"), None]
+        products = [{'url': 'https://www.nike.com/t/a/1', 'name': 'Shoe', 'price': '$90.00', 'retailer': 'nike',
+                     'image': '', 'success': True, 'timestamp': '2024-05-01T21:00:00'}]
+        
+        with patch.object(main_enhanced.outbound, 'budget', self.budget), \
+                patch.object(self.budget, 'acquire'), \
+                patch.object(main_enhanced, 'get_email_credentials', return_value=("me@example.com", "pw", [])), \
+                patch('main_enhanced.time.sleep') as mock_sleep:
+            self.assertEqual(main_enhanced.send_enhanced_email(products, ["a@example.com"]), [])
+        
+        mock_sleep.assert_not_called()
+        self.assertEqual(server.sendmail.call_count, 2)
+        self.assertEqual(self.budget.get_stats()['rate_per_minute'], 40.0)
+    
+    def test_alert_batches_put_biggest_drops_first(self):
+        """Test identical alerts share a batch and the biggest drops are sent first."""
+        import main_enhanced
+        alerts = {
+            'a@example.com': [{'product_id': 'small', 'price_drop_pct': 5.0}],
+            'b@example.com': [{'product_id': 'big', 'price_drop_pct': 40.0}],
+            'c@example.com': [{'product_id': 'small', 'price_drop_pct': 5.0}],
+        }
+        batches = main_enhanced._alert_batches(alerts)
+        self.assertEqual([recipients for _, recipients in batches], [['b@example.com'], ['a@example.com', 'c@example.com']])
+
+
+class TestImageCache(unittest.TestCase):
+    """Test the product image thumbnail cache."""
+    
+    def setUp(self):
+        import tempfile
+        import image_cache
+        self.tmpdir = tempfile.mkdtemp()
+        self.images = image_cache.ImageCache(self.tmpdir, settings={'max_cache_bytes': 2500, 'public_base_url': ''})
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+    
+    def _serve(self, body, content_type="image/jpeg"):
+        response = Mock(headers={"Content-Type": content_type})
+        response.iter_content.return_value = [body]
+        return response
+    
+    def test_identical_images_are_stored_once_and_evicted_by_age(self):
+        """Test files are content-addressed and the least recently served ones are evicted."""
+        bodies = {"https://a.example.com/1.jpg": b"a" * 1000, "https://b.example.com/1.jpg": b"a" * 1000,
+                  "https://c.example.com/1.jpg": b"c" * 1000, "https://d.example.com/1.jpg": b"d" * 1000}
+        keys = [self.images.register(url) for url in bodies]
+        with patch('requests.get', side_effect=lambda url, **kwargs: self._serve(bodies[url])):
+            paths = [self.images.get(key)[0] for key in keys[:3]]
+            self.assertEqual(paths[0], paths[1])
+            self.assertEqual(self.images.get_stats()['bytes'], 2000)
+            
+            self.images.get(keys[3])
+            stats = self.images.get_stats()
+            self.assertLessEqual(stats['bytes'], 2500)
+            self.assertFalse(os.path.exists(paths[0]))
+            self.assertTrue(os.path.exists(self.images.get(keys[3])[0]))
+    
+    def test_failed_and_non_image_downloads_are_not_served(self):
+        """Test non-images are refused, failures aren't retried straight away and only HTTP URLs register."""
+        key = self.images.register("https://a.example.com/page.html")
+        with patch('requests.get', return_value=self._serve(b"<html>", "text/html")) as mock_get:
+            self.assertIsNone(self.images.get(key))
+            self.assertIsNone(self.images.get(key))
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIsNone(self.images.register("data:image/png;base64,AAAA"))
+    
+    def test_concurrent_requests_share_one_download(self):
+        """Test requests for an image being fetched wait for that download, and its lock is then dropped."""
+        import threading
+        import time
+        key = self.images.register("https://a.example.com/1.jpg")
+        
+        def slow_get(url, **kwargs):
+            time.sleep(0.05)
+            return self._serve(b"a" * 100)
+        
+        with patch('requests.get', side_effect=slow_get) as mock_get:
+            threads = [threading.Thread(target=self.images.get, args=(key,)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(self.images._fetch_locks, {})
+    
+    def test_email_links_need_a_public_url(self):
+        """Test emails keep the original image until the web app's public URL is configured."""
+        url = "https://a.example.com/1.jpg"
+        self.assertEqual(self.images.thumbnail_url(url, absolute=True), url)
+        self.assertTrue(self.images.thumbnail_url(url).startswith("/images/"))
+        with patch.dict(os.environ, {'PUBLIC_BASE_URL': 'https://tracker.example.com/'}):
+            self.assertEqual(self.images.thumbnail_url(url, absolute=True),
+                             "https://tracker.example.com" + self.images.thumbnail_url(url))
+
+
+class TestEmailBuilder(unittest.TestCase):
+    """Test compact multipart email building."""
+    
+    def _products(self, count, name="Shoe"):
+        return [{'url': f'https://www.nike.com/t/a/{i}', 'name': f'{name} {i}', 'price': '$90.00',
+                 'retailer': 'nike', 'image': f'https://img.example.com/{i}.jpg', 'success': True,
+                 'timestamp': '2024-05-01T21:00:00', 'previous_price': 120.0, 'price_drop': True}
+                for i in range(count)]
+    
+    def test_message_has_inline_styles_and_text_alternative(self):
+        """Test messages carry inline styles, escaped product names and a plain-text part."""
+        import email_builder
+        content = email_builder.render_daily_email(self._products(2, name="<b>Shoe</b> & Co"))
+        message = email_builder.build_message("me@example.com", "a@example.com", "Update", content)
+        
+        self.assertEqual(message.get_content_type(), "multipart/alternative")
+        text_part, html_part = message.get_payload()
+        self.assertEqual((text_part.get_content_type(), html_part.get_content_type()), ("text/plain", "text/html"))
+        html = html_part.get_payload(decode=True).decode("utf-8")
+        self.assertNotIn("<style", html)
+        self.assertIn(' style="font-size:18px;color:#e74c3c;font-weight:bold"', html)
+        self.assertIn("&lt;b&gt;Shoe&lt;/b&gt; &amp; Co 0", html)
+        text = text_part.get_payload(decode=True).decode("utf-8")
+        self.assertIn("<b>Shoe</b> & Co 1 - $90.00 (was $120.00)", text)
+        
+        email_builder.address(message, "b@example.com")
+        self.assertEqual(message.get_all("To"), ["b@example.com"])
+    
+    def test_previous_price_uses_configured_currency(self):
+        """Test the "was" price is shown with EMAIL_SETTINGS' currency symbol."""
+        import email_builder
+        with patch.dict(config.EMAIL_SETTINGS, {'currency_symbol': '€'}):
+            content = email_builder.render_daily_email(self._products(1))
+        self.assertIn("Was €120.00", content.html)
+        self.assertIn("(was €120.00)", content.text)
+    
+    def test_legacy_template_escapes_scraped_names(self):
+        """Test the tracked-products template autoescapes HTML but leaves the text part as scraped."""
+        import email_builder
+        content = email_builder.render_tracked_email("Tracked", [
+            {'name': '<script>alert(1)</script>', 'price': '$10', 'image': '', 'url': 'https://x/?a=1&b=2',
+             'retailer': 'nike'}
+        ])
+        self.assertNotIn("<script>", content.html)
+        self.assertIn('href="https://x/?a=1&amp;b=2"', content.html)
+        self.assertIn("<script>alert(1)</script> - $10", content.text)
+        self.assertIs(email_builder._environment(), email_builder._environment())
+    
+    def test_products_beyond_size_budget_are_left_out(self):
+        """Test the body stays under max_message_bytes and tells the reader how many products were left out."""
+        import email_builder
+        content = email_builder.render_daily_email(self._products(200), max_bytes=20000)
+        self.assertLessEqual(content.size, 20000)
+        self.assertEqual(content.shown + content.omitted, 200)
+        self.assertGreater(content.omitted, 0)
+        self.assertIn(f"{content.omitted} more products not shown", content.text)
+        self.assertIn("Sale Tracker v", content.html)
+        
+        unlimited = email_builder.render_daily_email(self._products(200), max_bytes=0)
+        self.assertEqual(unlimited.omitted, 0)
+
+
+class TestEmailTransport(unittest.TestCase):
+    """Test the configurable email transports."""
+    
+    def setUp(self):
+        import tempfile
+        from email.mime.text import MIMEText
+        self.tmpdir = tempfile.mkdtemp()
+        self.message = MIMEText("<p>Hi</p>", 'html')
+        self.message["Subject"] = "Daily Product Update"
+    
+    def tearDown(self):
+        import shutil
+        import email_transport
+        email_transport.close_transports()
+        shutil.rmtree(self.tmpdir)
+    
+    def test_local_sinks_store_messages(self):
+        """Test the maildir, mbox and file sinks each keep every message."""
+        import mailbox
+        import email_transport
+        for kind in ("maildir", "mbox", "file"):
+            outbox = os.path.join(self.tmpdir, kind)
+            with email_transport.create_transport({'transport': kind, 'outbox_path': outbox}) as transport:
+                self.assertFalse(transport.requires_credentials)
+                for recipient in ("a@example.com", "b@example.com"):
+                    transport.send("me@example.com", recipient, self.message)
+            
+            if kind == "maildir":
+                stored = list(mailbox.Maildir(outbox))
+            elif kind == "mbox":
+                stored = list(mailbox.mbox(os.path.join(outbox, "outbox.mbox")))
+            else:
+                stored = os.listdir(outbox)
+            self.assertEqual(len(stored), 2, kind)
+    
+    def test_environment_selects_transport(self):
+        """Test EMAIL_TRANSPORT overrides the configured transport and unknown names are rejected."""
+        import email_transport
+        with patch.dict(os.environ, {'EMAIL_TRANSPORT': 'file'}):
+            transport = email_transport.create_transport({'transport': 'smtp', 'outbox_path': self.tmpdir})
+        self.assertIsInstance(transport, email_transport.FileTransport)
+        with self.assertRaises(ValueError):
+            email_transport.create_transport({'transport': 'pigeon'})
+    
+    def test_transport_must_implement_send(self):
+        """Test a transport without send() fails when it is created, not when the first email goes out."""
+        import email_transport
+
+        class Incomplete(email_transport.EmailTransport):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+    
+    @patch('smtplib.SMTP')
+    def test_pool_reuses_connections(self, mock_smtp):
+        """Test pooled SMTP logs in once per connection and retires connections after max_messages."""
+        import email_transport
+        pool = email_transport.PooledSMTPTransport("smtp.example.com", 587, "me", "pw", pool_size=1, max_messages=2)
+        for i in range(3):
+            pool.send("me@example.com", f"user{i}@example.com", self.message)
+        pool.close()
+        self.assertEqual(mock_smtp.call_count, 2)
+        self.assertEqual(mock_smtp.return_value.login.call_count, 2)
+        self.assertEqual(mock_smtp.return_value.sendmail.call_count, 3)
+    
+    @patch('smtplib.SMTP')
+    def test_pool_replaces_dropped_idle_connection(self, mock_smtp):
+        """Test a pooled connection closed by the server while idle is replaced without failing the send."""
+        import smtplib
+        import email_transport
+        dropped, fresh = Mock(), Mock()
+        dropped.sendmail.side_effect = [None, smtplib.SMTPServerDisconnected("idle timeout")]
+        mock_smtp.side_effect = [dropped, fresh]
+        pool = email_transport.PooledSMTPTransport("smtp.example.com", 587, "me", "pw", pool_size=1)
+        pool.send("me@example.com", "a@example.com", self.message)
+        pool.send("me@example.com", "b@example.com", self.message)
+        fresh.sendmail.assert_called_once()
+    
+    def test_send_without_credentials_to_file_sink(self):
+        """Test the enhanced sender delivers offline to a file sink with no SMTP credentials or send budget."""
+        import main_enhanced
+        outbox = os.path.join(self.tmpdir, "outbox")
+        products = [{'url': 'https://www.nike.com/t/a/1', 'name': 'Shoe', 'price': '$90.00', 'retailer': 'nike',
+                     'image': '', 'success': True, 'timestamp': '2024-05-01T21:00:00'}]
+        budget = Mock()
+        with patch.dict(os.environ, {'EMAIL_TRANSPORT': 'file', 'SENDER_EMAIL': '', 'EMAIL_PASSWORD': ''}), \
+                patch.dict(config.EMAIL_SETTINGS, {'outbox_path': outbox}), \
+                patch.object(main_enhanced.outbound, 'budget', budget):
+            self.assertEqual(main_enhanced.send_enhanced_email(products, ["a@example.com", "b@example.com"]), [])
+            self.assertFalse(any("EMAIL_PASSWORD" in issue for issue in config.validate_config()))
+        self.assertEqual(len(os.listdir(outbox)), 2)
+        # The mail server's limits don't apply to local sinks, nor do local sends count against them
+        budget.acquire.assert_not_called()
+        budget.record_sent.assert_not_called()
+
+
 class TestEnhancedConfiguration(unittest.TestCase):
     """Test enhanced configuration system."""
     
@@ -392,6 +1435,24 @@ class TestIntegrationScenarios(unittest.TestCase):
             self.assertTrue(hasattr(main_enhanced, 'PerformanceMetrics'))
         except ImportError as e:
             self.fail(f"Enhanced main module should import cleanly: {e}")
+    
+    def test_cli_import_is_lightweight(self):
+        """Importing the CLI defers the scraping/email stack and doesn't touch logging files."""
+        import subprocess
+        import tempfile
+        
+        code = (
+            "import sys, cli_enhanced; "
+            "print(','.join(m for m in ('main_enhanced', 'requests', 'bs4', 'smtplib', 'schedule', 'dotenv', 'asyncio') "
+            "if m in sys.modules))"
+        )
+        workdir = tempfile.mkdtemp()
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env,
+                                capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+        self.assertEqual(os.listdir(workdir), [])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,356 @@
+"""
+Tests for price history tracking.
+"""
+
+import unittest
+import unittest.mock
+import sys
+import os
+import json
+import tempfile
+import shutil
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import price_history
+import price_alerts
+import refresh_scheduler
+import subscriptions_store
+from price_history import PriceHistoryStore, parse_price
+from retailers import registry
+import config_enhanced as config
+
+
+def make_result(url, price, success=True, ts=None):
+    """Build a scrape result dict the way RetailerRegistry.scrape_multiple does."""
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts if ts is not None else time.time()))
+    return {
+        'url': url,
+        'product_id': registry.canonical_url(url),
+        'name': "Test Product" if success else "Product name not found",
+        'price': price,
+        'image': "",
+        'retailer': 'nike',
+        'timestamp': stamp,
+        'success': success
+    }
+
+
+class TestParsePrice(unittest.TestCase):
+    """Test price string parsing."""
+
+    def test_parse_formats(self):
+        self.assertEqual(parse_price("$120USD"), 120.0)
+        self.assertEqual(parse_price("$1,299.50"), 1299.5)
+        self.assertEqual(parse_price("89.00 USD"), 89.0)
+
+    def test_parse_missing(self):
+        self.assertTrue(np.isnan(parse_price("Price not found")))
+        self.assertTrue(np.isnan(parse_price("")))
+        self.assertTrue(np.isnan(parse_price(None)))
+
+
+class TestCanonicalUrl(unittest.TestCase):
+    """Test canonical product ids."""
+
+    def test_tracking_params_dropped(self):
+        a = registry.canonical_url("https://shop.lululemon.com/p/jacket/_/prod1?color=0001&gclid=abc&sz=S")
+        b = registry.canonical_url("https://shop.lululemon.com/p/jacket/_/prod1?sz=M&color=0001")
+        self.assertEqual(a, b)
+        self.assertEqual(a, "https://shop.lululemon.com/p/jacket/_/prod1?color=0001")
+
+    def test_nike_drops_query(self):
+        url = registry.canonical_url("https://www.nike.com/t/jacket/FB7551-010?cp=123")
+        self.assertEqual(url, "https://www.nike.com/t/jacket/FB7551-010")
+
+
+class TestPriceHistoryStore(unittest.TestCase):
+    """Test the SQLite-backed price history."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = PriceHistoryStore(os.path.join(self.tmpdir, "history.db"))
+        self.url = "https://www.nike.com/t/jacket/FB7551-010"
+        self.product_id = registry.canonical_url(self.url)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_record_and_range(self):
+        now = time.time()
+        results = [
+            make_result(self.url, "$150USD", ts=now - 3 * 86400),
+            make_result(self.url, "Price not found", success=False, ts=now - 2 * 86400),
+            make_result(self.url, "$120USD", ts=now - 86400),
+        ]
+        self.assertEqual(self.store.record_results(results), 3)
+
+        ts, prices = self.store.get_range(self.product_id, days=90)
+        self.assertEqual(len(ts), 3)
+        self.assertEqual(prices.dtype, np.float64)
+        self.assertEqual(prices[0], 150.0)
+        self.assertTrue(np.isnan(prices[1]))
+        self.assertEqual(prices[2], 120.0)
+        self.assertTrue(np.all(np.diff(ts) > 0))
+
+        ts, prices = self.store.get_range(self.product_id, days=1.5)
+        self.assertEqual(list(prices), [120.0])
+
+    def test_unknown_product_is_empty(self):
+        ts, prices = self.store.get_range("https://example.com/none", days=90)
+        self.assertEqual(len(ts), 0)
+        self.assertEqual(len(prices), 0)
+
+    def test_list_products(self):
+        self.store.record_results([make_result(self.url, "$150USD")])
+        products = self.store.list_products()
+        self.assertEqual(len(products), 1)
+        self.assertEqual(products[0]['product_id'], self.product_id)
+
+    def test_change_rates_with_duplicate_ids(self):
+        now = time.time()
+        prices = ["$150USD", "$150USD", "$120USD"]
+        self.store.record_results([make_result(self.url, p, ts=now - (3 - i) * 3600) for i, p in enumerate(prices)])
+        rates = self.store.get_change_rates([self.product_id, "https://example.com/none", self.product_id], now=now)
+        self.assertEqual(rates[0], 0.5)
+        self.assertTrue(np.isnan(rates[1]))
+        self.assertEqual(rates[2], 0.5)
+
+    def test_retention_downsamples_to_daily_low(self):
+        now = time.time()
+        old_day = (int(now - 40 * 86400) // 86400) * 86400 + 3600
+        results = [
+            make_result(self.url, "$150USD", ts=old_day),
+            make_result(self.url, "$110USD", ts=old_day + 600),
+            make_result(self.url, "$130USD", ts=old_day + 1200),
+            make_result(self.url, "$125USD", ts=now - 86400),
+        ]
+        self.store.record_results(results)
+
+        removed = self.store.apply_retention(retention_days=30, now=now)
+        self.assertEqual(removed, 3)
+
+        ts, prices = self.store.get_range(self.product_id, days=90)
+        self.assertEqual(list(prices), [110.0, 125.0])
+
+        # Running again is a no-op
+        self.assertEqual(self.store.apply_retention(retention_days=30, now=now), 0)
+
+
+class TestPriceAlerts(unittest.TestCase):
+    """Test vectorised price-drop detection."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = PriceHistoryStore(os.path.join(self.tmpdir, "history.db"))
+        self.nike = "https://www.nike.com/t/jacket/FB7551-010"
+        self.lulu = "https://shop.lululemon.com/p/jacket/_/prod1?color=0001"
+        now = time.time()
+        self.store.record_results([
+            make_result(self.nike, "$150USD", ts=now - 2 * 86400),
+            make_result(self.nike, "$140USD", ts=now - 86400),
+            make_result(self.lulu, "$100USD", ts=now - 86400),
+        ])
+        self.rules = {"min_drop": 0.01, "min_drop_pct": None, "target_price": None, "all_time_low": False}
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def detect(self, products, recipients, subscriptions=None, rules=None):
+        return price_alerts.detect_price_drops(
+            products, recipients, subscriptions=subscriptions or {}, store=self.store,
+            default_rules=rules or self.rules
+        )
+
+    def test_drop_triggers_and_unchanged_does_not(self):
+        products = [make_result(self.nike, "$120USD"), make_result(self.lulu, "$100USD")]
+        alerts = self.detect(products, ["a@example.com"])
+
+        self.assertEqual(list(alerts), ["a@example.com"])
+        items = alerts["a@example.com"]
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['url'], self.nike)
+        self.assertEqual(items[0]['previous_price'], 140.0)
+        self.assertEqual(items[0]['price_drop'], 20.0)
+        self.assertEqual(items[0]['alert_reasons'], ["price_drop"])
+
+    def test_no_change_day_returns_nothing(self):
+        products = [make_result(self.nike, "$140USD"), make_result(self.lulu, "$105USD")]
+        self.assertEqual(self.detect(products, ["a@example.com"]), {})
+
+    def test_failed_scrapes_are_ignored(self):
+        products = [make_result(self.nike, "Price not found", success=False)]
+        self.assertEqual(self.detect(products, ["a@example.com"]), {})
+
+    def test_per_subscription_rules(self):
+        subscriptions = {
+            "pct@example.com": [{"url": self.nike, "rules": {"min_drop": None, "min_drop_pct": 20}}],
+            "target@example.com": [{"url": self.lulu, "rules": {"min_drop": None, "target_price": 100}}],
+            "low@example.com": [{"url": self.nike, "rules": {"min_drop": None, "all_time_low": True}}],
+        }
+        products = [make_result(self.nike, "$130USD"), make_result(self.lulu, "$100USD")]
+        alerts = self.detect(products, list(subscriptions), subscriptions=subscriptions)
+
+        # 130 vs 140 is only a 7% drop
+        self.assertNotIn("pct@example.com", alerts)
+        self.assertEqual(alerts["target@example.com"][0]['alert_reasons'], ["below_target"])
+        self.assertEqual(alerts["low@example.com"][0]['alert_reasons'], ["all_time_low"])
+
+    def test_send_price_alert_emails_skips_no_change_day(self):
+        import main_enhanced
+        with unittest.mock.patch.object(main_enhanced.price_alerts, 'detect_price_drops', return_value={}), \
+                unittest.mock.patch.object(main_enhanced, 'send_enhanced_email') as mock_send:
+            self.assertEqual(main_enhanced.send_price_alert_emails([], ["a@example.com"]), 0)
+            mock_send.assert_not_called()
+
+
+class TestRefreshScheduler(unittest.TestCase):
+    """Test incremental refresh scheduling."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = PriceHistoryStore(os.path.join(self.tmpdir, "history.db"))
+        self.scraped = []
+
+        def scrape(urls):
+            self.scraped.append(list(urls))
+            return [make_result(url, "$100USD") for url in urls]
+
+        self.scheduler = refresh_scheduler.RefreshScheduler(
+            scrape_fn=scrape, store=self.store,
+            settings={"batch_size": 2, "tick_interval": 600, "max_interval": 24 * 3600}
+        )
+        self.urls = [f"https://www.nike.com/t/product-{i}/ABC-{i}" for i in range(5)]
+        self.counts = {registry.canonical_url(url): 1 for url in self.urls}
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_new_products_are_staggered(self):
+        now = time.time()
+        self.assertEqual(self.scheduler.sync({"nike": self.urls}, self.counts, now=now), 5)
+        self.assertEqual(len(self.scheduler.due(now)), 2)
+        self.assertEqual(len(self.scheduler.due(now + 600, limit=10)), 4)
+        self.assertEqual(len(self.scheduler.due(now + 1200, limit=10)), 5)
+
+    def test_run_batch_fetches_small_batches(self):
+        self.scheduler.sync({"nike": self.urls}, self.counts)
+        results = self.scheduler.run_batch()
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.scraped, [self.urls[:2]])
+
+        # Fetched products are no longer due
+        self.assertEqual(self.scheduler.run_batch(), [])
+
+        fresh, stale = self.scheduler.collect(self.urls)
+        self.assertEqual([r['url'] for r in fresh], self.urls[:2])
+        self.assertEqual(stale, self.urls[2:])
+
+    def test_snapshots_are_reused_by_other_processes(self):
+        """Test a scheduler in another process (or after a restart) reuses what this one fetched."""
+        def scrape_and_record(urls):
+            results = [make_result(url, "$100USD") for url in urls]
+            self.store.record_results(results)  # As scrape_products_enhanced does
+            return results
+
+        self.scheduler.scrape_fn = scrape_and_record
+        now = time.time()
+        self.scheduler.sync({"nike": self.urls}, self.counts, now=now)
+        self.scheduler.run_batch(now)
+
+        other = refresh_scheduler.RefreshScheduler(scrape_fn=self.unexpected_scrape, store=self.store,
+                                                   settings=self.scheduler.settings)
+        fresh, stale = other.collect(self.urls)
+        self.assertEqual([r['url'] for r in fresh], self.urls[:2])
+        self.assertEqual(fresh[0]['price'], "$100USD")
+        self.assertEqual(stale, self.urls[2:])
+
+        # The fetched products aren't due again just because the schedule was rebuilt
+        other.sync({"nike": self.urls}, self.counts, now=now + 1)
+        self.assertEqual({e.url for e in other.due(now + 1, limit=10)}, set(self.urls[2:4]))
+
+    def unexpected_scrape(self, urls):
+        raise AssertionError(f"Unexpected scrape of {urls}")
+
+    def test_volatile_products_refresh_sooner(self):
+        now = time.time()
+        volatile, stable = self.urls[0], self.urls[1]
+        history = []
+        for day in range(10, 0, -1):
+            history.append(make_result(volatile, f"${100 + day}USD", ts=now - day * 86400))
+            history.append(make_result(stable, "$100USD", ts=now - day * 86400))
+        self.store.record_results(history)
+
+        counts = {registry.canonical_url(volatile): 1, registry.canonical_url(stable): 1}
+        self.scheduler.sync({"nike": [volatile, stable]}, counts, now=now)
+        entries = self.scheduler.entries
+        self.assertEqual(entries[registry.canonical_url(volatile)].interval,
+                         config.get_retailer_config("nike")["cache_ttl"])
+        self.assertEqual(entries[registry.canonical_url(stable)].interval, 24 * 3600)
+
+    def test_unsubscribed_products_refresh_slower(self):
+        now = time.time()
+        counts = {registry.canonical_url(self.urls[0]): 1}
+        self.scheduler.sync({"nike": self.urls[:2]}, counts, now=now)
+        subscribed = self.scheduler.entries[registry.canonical_url(self.urls[0])]
+        unsubscribed = self.scheduler.entries[registry.canonical_url(self.urls[1])]
+        self.assertGreater(unsubscribed.interval, subscribed.interval)
+
+    def test_snapshot_is_fresh_before_email(self):
+        now = time.time()
+        self.scheduler.sync({"nike": self.urls[:1]}, self.counts, now=now)
+        entry = self.scheduler.entries[registry.canonical_url(self.urls[0])]
+        # Fetched long ago with a slow interval: must be refetched inside the pre-email window
+        entry.interval = 3 * 86400
+        entry.last_fetched = now - 86400
+        due = self.scheduler._next_due(entry, now)
+        email_at = self.scheduler._next_email_time(now)
+        self.assertLessEqual(due, email_at)
+        self.assertGreaterEqual(due, min(email_at - self.scheduler.settings["max_staleness"], now))
+
+
+class TestSubscriptionRules(unittest.TestCase):
+    """Test alert rules stored with subscriptions."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.original_file = subscriptions_store.SUBSCRIPTIONS_FILE
+        subscriptions_store.SUBSCRIPTIONS_FILE = os.path.join(self.tmpdir, "subscriptions.json")
+        self.url = "https://www.nike.com/t/jacket/FB7551-010"
+
+    def tearDown(self):
+        subscriptions_store.SUBSCRIPTIONS_FILE = self.original_file
+        shutil.rmtree(self.tmpdir)
+
+    def test_add_with_rules(self):
+        result = subscriptions_store.add_product("a@example.com", self.url, rules={"target_price": "99.5"})
+        self.assertTrue(result['success'])
+        self.assertEqual(subscriptions_store.get_products("a@example.com")[0]['rules'], {"target_price": 99.5})
+
+    def test_invalid_rules_rejected(self):
+        self.assertFalse(subscriptions_store.add_product("a@example.com", self.url, rules={"bogus": 1})['success'])
+        self.assertFalse(subscriptions_store.add_product("a@example.com", self.url, rules={"min_drop": -1})['success'])
+
+    def test_set_rules(self):
+        subscriptions_store.add_product("a@example.com", self.url)
+        self.assertTrue(subscriptions_store.set_rules("a@example.com", self.url, {"all_time_low": 1})['success'])
+        self.assertEqual(subscriptions_store.get_products("a@example.com")[0]['rules'], {"all_time_low": True})
+
+    def test_legacy_file_is_imported(self):
+        with open(subscriptions_store.SUBSCRIPTIONS_FILE, "w") as f:
+            json.dump({"subscriptions": {"a@example.com": [
+                {"url": self.url, "company": "nike", "added_at": None, "rules": {"min_drop": 5.0}}
+            ]}}, f)
+        self.assertEqual(subscriptions_store.get_products("A@example.com")[0]['rules'], {"min_drop": 5.0})
+        self.assertEqual(subscriptions_store.add_product("a@example.com", self.url)['message'],
+                         "Product already added")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
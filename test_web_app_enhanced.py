@@ -0,0 +1,439 @@
+import os
+import json
+import tempfile
+import shutil
+import threading
+import importlib
+import unittest
+from unittest.mock import Mock, patch
+
+import jobs
+
+
+def fake_results():
+    return [
+        {'url': 'https://www.nike.com/t/a/1', 'name': 'A', 'price': '$100USD', 'image': '',
+         'retailer': 'nike', 'timestamp': '2024-01-01T00:00:00', 'success': True},
+        {'url': 'https://www.nike.com/t/b/2', 'name': 'Product name not found', 'price': 'Price not found',
+         'image': '', 'retailer': 'nike', 'timestamp': '2024-01-01T00:00:00', 'success': False},
+    ]
+
+
+def fake_scrape(product_links=None, on_result=None):
+    results = fake_results()
+    for result in results:
+        if on_result:
+            on_result(result)
+    return results
+
+
+class EnhancedWebAppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        import recipients_store
+        import subscriptions_store
+        recipients_store.RECIPIENTS_FILE = os.path.join(self.tmpdir, "recipients.json")
+        subscriptions_store.SUBSCRIPTIONS_FILE = os.path.join(self.tmpdir, "subscriptions.json")
+
+        os.environ["CRON_TOKEN"] = "testtoken"
+        os.environ["ADMIN_TOKEN"] = "admintoken"
+        global web_app_enhanced
+        import web_app_enhanced as _web_app_enhanced
+        importlib.reload(_web_app_enhanced)
+        web_app_enhanced = _web_app_enhanced
+        web_app_enhanced.job_manager = jobs.JobManager(os.path.join(self.tmpdir, "jobs.db"), workers=1)
+        web_app_enhanced.main_enhanced.exporter.directory = os.path.join(self.tmpdir, "metrics")
+        web_app_enhanced.profiler.directory = os.path.join(self.tmpdir, "profiles")
+        web_app_enhanced.app.config["TESTING"] = True
+        self.client = web_app_enhanced.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def wait_for(self, job_id):
+        web_app_enhanced.job_manager.wait(job_id, timeout=10)
+        resp = self.client.get(f"/api/jobs/{job_id}")
+        self.assertEqual(resp.status_code, 200)
+        return resp.json["job"]
+
+    @patch("web_app_enhanced.main_enhanced.scrape_products_enhanced", side_effect=fake_scrape)
+    def test_scrape_is_queued(self, _mock_scrape):
+        resp = self.client.get("/api/enhanced/scrape")
+        self.assertEqual(resp.status_code, 202)
+        self.assertTrue(resp.json["success"])
+        self.assertIn(resp.json["job_id"], resp.json["status_url"])
+
+        job = self.wait_for(resp.json["job_id"])
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["progress"]["done"], 2)
+        self.assertEqual([r["success"] for r in job["results"]], [True, False])
+        self.assertIsNotNone(job["duration"])
+        self.assertEqual(job["result"]["summary"]["successful"], 1)
+        self.assertEqual(len(web_app_enhanced.app_state.last_scrape_results), 2)
+
+    def test_concurrent_scrapes_are_coalesced(self):
+        release = threading.Event()
+
+        def slow_scrape(product_links=None, on_result=None):
+            release.wait(5)
+            return fake_scrape(product_links, on_result)
+
+        with patch("web_app_enhanced.main_enhanced.scrape_products_enhanced", side_effect=slow_scrape) as mock_scrape:
+            first = self.client.get("/api/enhanced/scrape").json
+            second = self.client.get("/api/scrape").json
+            self.assertEqual(first["job_id"], second["job_id"])
+            self.assertFalse(first["coalesced"])
+            self.assertTrue(second["coalesced"])
+
+            release.set()
+            self.assertEqual(self.wait_for(first["job_id"])["status"], "succeeded")
+            self.assertEqual(mock_scrape.call_count, 1)
+
+    @patch("web_app_enhanced.main_enhanced.scrape_products_enhanced", side_effect=fake_scrape)
+    def test_scrape_stream(self, _mock_scrape):
+        resp = self.client.get("/api/enhanced/scrape/stream")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "text/event-stream")
+
+        events = [line.split(": ", 1)[1] for line in resp.get_data(as_text=True).splitlines()
+                  if line.startswith("event: ")]
+        self.assertEqual(events, ["job", "result", "result", "done"])
+        self.assertIn('"successful": 1', resp.get_data(as_text=True))
+
+    @patch("web_app_enhanced.main_enhanced.send_daily_email_enhanced", return_value=None)
+    def test_cron_send_authorized(self, mock_send):
+        resp = self.client.post("/api/cron/send", headers={"X-CRON-TOKEN": "testtoken"})
+        self.assertEqual(resp.status_code, 202)
+        job = self.wait_for(resp.json["job_id"])
+        self.assertEqual(job["status"], "succeeded")
+        mock_send.assert_called_once()
+
+    @patch("web_app_enhanced.main_enhanced._plan_daily_run", side_effect=RuntimeError("work.db is locked"))
+    def test_failed_daily_run_fails_the_job(self, _mock_plan):
+        resp = self.client.post("/api/cron/send", headers={"X-CRON-TOKEN": "testtoken"})
+        job = self.wait_for(resp.json["job_id"])
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "work.db is locked")
+        self.assertIsNone(web_app_enhanced.app_state.last_email_sent)
+
+    @patch("web_app_enhanced.main_enhanced.scrape_products_enhanced", side_effect=fake_scrape)
+    def test_jobs_of_silent_workers_stop_blocking_new_ones(self, _mock_scrape):
+        import time
+        manager = web_app_enhanced.job_manager
+
+        def insert_running(job_id, heartbeat_at):
+            with manager._db_lock:
+                manager._connection().execute(
+                    "INSERT INTO jobs (id, kind, key, owner, status, created_at, started_at, heartbeat_at) "
+                    "VALUES (?, 'scrape', 'scrape', 'old-container:1', 'running', ?, ?, ?)",
+                    (job_id, heartbeat_at, heartbeat_at, heartbeat_at))
+
+        # A worker on another host that still sends heartbeats is joined
+        insert_running("live", time.time())
+        self.assertTrue(self.client.get("/api/enhanced/scrape").json["coalesced"])
+        with manager._db_lock:
+            manager._connection().execute("DELETE FROM jobs WHERE id = 'live'")
+
+        # One whose container is gone is failed, and the scrape runs again
+        insert_running("stale", time.time() - 3600)
+        resp = self.client.get("/api/enhanced/scrape").json
+        self.assertFalse(resp["coalesced"])
+        self.assertEqual(self.wait_for(resp["job_id"])["status"], "succeeded")
+        stale = manager.get("stale")
+        self.assertEqual((stale["status"], stale["error"]), ("failed", "Interrupted (worker stopped responding)"))
+
+    def test_job_results_are_appended_not_rewritten(self):
+        manager = web_app_enhanced.job_manager
+
+        def work(job):
+            for result in fake_results():
+                job.add_result(result)
+
+        job, _ = manager.submit('scrape', work)
+        manager.wait(job['id'], timeout=10)
+        with manager._db_lock:
+            conn = manager._connection()
+            stored = conn.execute("SELECT results, done FROM jobs WHERE id = ?", (job['id'],)).fetchone()
+            rows = conn.execute("SELECT COUNT(*) FROM job_results WHERE job_id = ?", (job['id'],)).fetchone()[0]
+        self.assertEqual(stored, (None, 2))
+        self.assertEqual(rows, 2)
+
+        # Another process sees the results from the job table
+        other = jobs.JobManager(manager.db_path).get(job['id'])
+        self.assertEqual([r["success"] for r in other["results"]], [True, False])
+        self.assertEqual(other["progress"]["done"], 2)
+
+    def test_followers_of_other_processes_jobs_read_only_new_results(self):
+        manager = web_app_enhanced.job_manager
+        added, release = threading.Event(), threading.Event()
+
+        def work(job):
+            results = fake_results()
+            job.add_result(results[0])
+            added.set()
+            release.wait(10)
+            job.add_result(results[1])
+
+        job, _ = manager.submit('scrape', work)
+        added.wait(10)
+        other = jobs.JobManager(manager.db_path)
+        self.assertEqual([r["success"] for r in other.get_results(job['id'])], [True])
+        self.assertEqual(other.get_results(job['id'], 1), [])
+
+        events = other.follow(job['id'], poll_interval=0.01)
+        self.assertEqual(next(events)[0], "result")
+        release.set()
+        rest = list(events)
+        self.assertEqual([event for event, _ in rest], ["result", "done"])
+        self.assertFalse(rest[0][1]["success"])
+        self.assertEqual(rest[1][1]["progress"]["done"], 2)
+
+    def test_cron_send_unauthorized(self):
+        resp = self.client.post("/api/cron/send", headers={"X-CRON-TOKEN": "wrong"})
+        self.assertEqual(resp.status_code, 401)
+
+    @patch("web_app_enhanced.main_enhanced.scrape_products_enhanced", side_effect=RuntimeError("boom"))
+    def test_failed_job_reports_error(self, _mock_scrape):
+        resp = self.client.get("/api/enhanced/scrape")
+        job = self.wait_for(resp.json["job_id"])
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "boom")
+
+    def test_app_state_under_concurrent_updates(self):
+        errors = []
+
+        def update():
+            try:
+                for i in range(300):
+                    web_app_enhanced.app_state.update_scrape_results(fake_results()[:1 + i % 2])
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                client = web_app_enhanced.app.test_client()
+                for _ in range(30):
+                    resp = client.get("/api/enhanced/metrics")
+                    self.assertEqual(resp.status_code, 200)
+                    performance = resp.json["performance"]
+                    self.assertEqual(performance["total_products"],
+                                     performance["successful_scrapes"] + performance["failed_scrapes"])
+            except Exception as e:
+                errors.append(e)
+
+        web_app_enhanced.app_state.update_scrape_results(fake_results())
+        threads = [threading.Thread(target=update) for _ in range(4)] + [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(errors, [])
+
+    def test_metrics_exposition_merges_processes(self):
+        exporter = web_app_enhanced.main_enhanced.exporter
+        exporter.flush()
+        with open(os.path.join(exporter.directory, f"{os.getpid()}.json")) as f:
+            other = json.load(f)
+        # A second (exited) worker: its counters still count, its gauges don't
+        other["pid"] = 999999999
+        other["counters"].append(["sale_tracker_emails_sent", {}, 5])
+        other["gauges"] = [["sale_tracker_fetches_in_flight", {}, 7]]
+        with open(os.path.join(exporter.directory, "999999999.json"), "w") as f:
+            json.dump(other, f)
+
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("application/openmetrics-text"))
+        body = resp.get_data(as_text=True)
+        self.assertTrue(body.endswith("# EOF\n"))
+        self.assertIn("# TYPE sale_tracker_scrapes counter", body)
+        self.assertIn('sale_tracker_scrapes_total{result="success"}', body)
+        self.assertIn('sale_tracker_scrape_duration_seconds_bucket{le="+Inf"}', body)
+        self.assertIn("sale_tracker_fetches_in_flight 0\n", body)
+
+        local = web_app_enhanced.main_enhanced.metrics.get_metrics()["emails_sent"]
+        self.assertIn(f"sale_tracker_emails_sent_total {2 * local + 5}\n", body)
+
+        # The exited worker's snapshot was folded into the retired totals
+        self.assertFalse(os.path.exists(os.path.join(exporter.directory, "999999999.json")))
+        body = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn(f"sale_tracker_emails_sent_total {2 * local + 5}\n", body)
+
+        # So is this process's at exit
+        with patch.object(exporter, "_started_pid", os.getpid()), patch.object(exporter, "_closed_pid", None):
+            exporter.close()
+        self.assertEqual(sorted(os.listdir(exporter.directory)), ["retired.json", "retired.lock"])
+        with open(os.path.join(exporter.directory, "retired.json")) as f:
+            retired = json.load(f)
+        self.assertIn(["sale_tracker_emails_sent", {}, 2 * local + 5], retired["counters"])
+
+    def test_profiling_admin(self):
+        self.assertEqual(self.client.get("/api/admin/profiling").status_code, 401)
+        headers = {"X-ADMIN-TOKEN": "admintoken"}
+
+        with patch.dict(web_app_enhanced.config.PERFORMANCE_SETTINGS):
+            resp = self.client.post("/api/admin/profiling", json={"enabled": True, "mode": "deterministic"},
+                                    headers=headers)
+            self.assertTrue(resp.json["enabled"])
+            self.assertEqual(self.client.get("/api/status").status_code, 200)
+
+            profiles = self.client.get("/api/admin/profiling", headers=headers).json["profiles"]
+            self.assertEqual([p["run"] for p in profiles], ["http-GET-api_status"])
+            self.assertEqual(profiles[0]["format"], "pstats")
+
+            summary = self.client.get(f"/api/admin/profiles/{profiles[0]['summary']}", headers=headers)
+            self.assertEqual(summary.status_code, 200)
+            self.assertIn("api_status", summary.get_data(as_text=True))
+            self.assertEqual(self.client.get("/api/admin/profiles/..%2Fjobs.db", headers=headers).status_code, 404)
+
+    def test_sampling_profile(self):
+        import time
+        profiler = web_app_enhanced.profiler
+        settings = {"enable_profiling": True, "profiling_mode": "sampling", "profiling_interval": 0.001}
+        with patch.dict(web_app_enhanced.config.PERFORMANCE_SETTINGS, settings):
+            with profiler.profile("busy"):
+                deadline = time.time() + 0.1
+                while time.time() < deadline:
+                    sum(range(1000))
+
+        profile = profiler.list_profiles()[0]
+        self.assertEqual((profile["run"], profile["format"]), ("busy", "collapsed"))
+        with open(profiler.profile_path(profile["file"])) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertIn("test_sampling_profile", lines[0])
+
+    def test_unknown_job(self):
+        resp = self.client.get("/api/jobs/does-not-exist")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_read_endpoints_revalidate(self):
+        """Unchanged reads are answered with an empty 304; any change to the data yields a new ETag."""
+        for path in ("/", "/api/status", "/api/config", "/api/enhanced/retailers", "/api/subscriptions"):
+            first = self.client.get(path)
+            self.assertEqual(first.status_code, 200, path)
+            self.assertIn("no-cache", first.headers["Cache-Control"])
+            again = self.client.get(path, headers={"If-None-Match": first.headers["ETag"]})
+            self.assertEqual(again.status_code, 304, path)
+            self.assertEqual(again.data, b"")
+
+        status = self.client.get("/api/status")
+        web_app_enhanced.app_state.update_scrape_results(fake_results())
+        changed = self.client.get("/api/status", headers={"If-None-Match": status.headers["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.json["last_scrape_results"]), 2)
+
+        # Cache counters don't invalidate the ETag, and another worker holding the same state issues the same one
+        stats = {"enabled": True, "default_ttl": 300, "hits": 41, "misses": 7}
+        with patch.object(web_app_enhanced.registry, "get_cache_stats", return_value=stats) as get_cache_stats:
+            for path in ("/api/status", "/api/enhanced/retailers"):
+                get_cache_stats.return_value = stats
+                etag = self.client.get(path).headers["ETag"]
+                get_cache_stats.return_value = dict(stats, hits=42)
+                self.assertEqual(self.client.get(path, headers={"If-None-Match": etag}).status_code, 304, path)
+        other_worker = web_app_enhanced.EnhancedWebAppState()
+        other_worker.update_scrape_results(fake_results(), scrape_id=web_app_enhanced.app_state.scrape_id)
+        self.assertEqual(other_worker.version(), web_app_enhanced.app_state.version())
+
+        config_etag = self.client.get("/api/config").headers["ETag"]
+        with patch.dict(web_app_enhanced.config.EMAIL_SETTINGS, {"schedule_time": "07:30"}):
+            self.assertEqual(self.client.get("/api/config", headers={"If-None-Match": config_etag}).status_code, 200)
+
+        subscriptions = self.client.get("/api/subscriptions")
+        self.assertIn("private", subscriptions.headers["Cache-Control"])
+        self.client.post("/api/subscriptions", json={"email": "a@example.com", "url": "https://www.nike.com/t/a/1"})
+        changed = self.client.get("/api/subscriptions", headers={"If-None-Match": subscriptions.headers["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual([s["email"] for s in changed.json["subscriptions"]], ["a@example.com"])
+
+    def test_subscription_rules_can_be_changed(self):
+        url = "https://www.nike.com/t/a/1"
+        self.client.post("/api/subscriptions", json={"email": "a@example.com", "url": url})
+
+        resp = self.client.patch("/api/subscriptions", json={
+            "email": "A@example.com", "url": url, "rules": {"target_price": 90, "all_time_low": False}})
+        self.assertEqual(resp.status_code, 200)
+        products = self.client.get("/api/subscriptions?email=a@example.com").json["products"]
+        self.assertEqual(products[0]["rules"], {"target_price": 90.0, "all_time_low": False})
+
+        self.assertEqual(self.client.patch("/api/subscriptions", json={
+            "email": "a@example.com", "url": url, "rules": {"target_price": -1}}).status_code, 400)
+        self.assertEqual(self.client.patch("/api/subscriptions", json={
+            "email": "b@example.com", "url": url, "rules": {}}).status_code, 404)
+
+        self.assertEqual(self.client.patch("/api/subscriptions", json={
+            "email": "a@example.com", "url": url, "rules": None}).status_code, 200)
+        products = self.client.get("/api/subscriptions?email=a@example.com").json["products"]
+        self.assertNotIn("rules", products[0])
+
+    def test_listings_are_paginated(self):
+        """Subscriptions and scrape results come a page at a time, filtered and trimmed to the requested fields."""
+        import subscriptions_store
+        subscriptions_store.import_subscriptions({
+            f"user{i}@example.com": [{"url": f"https://www.nike.com/t/p/{i}", "company": "nike"},
+                                     {"url": f"https://shop.lululemon.com/p/{i}", "company": "lululemon"}]
+            for i in range(5)
+        })
+        seen, cursor = [], None
+        while True:
+            page = self.client.get("/api/subscriptions", query_string={
+                "limit": 2, "retailer": "nike", "fields": "email,url", **({"cursor": cursor} if cursor else {})}).json
+            self.assertLessEqual(len(page["subscriptions"]), 2)
+            seen += page["subscriptions"]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual([s["email"] for s in seen], [f"user{i}@example.com" for i in range(5)])
+        self.assertEqual(set(seen[0]), {"email", "url"})
+
+        prefixed = self.client.get("/api/subscriptions?email_prefix=USER3").json["subscriptions"]
+        self.assertEqual({s["email"] for s in prefixed}, {"user3@example.com"})
+        self.assertEqual(self.client.get("/api/subscriptions?cursor=bogus").status_code, 400)
+        self.assertEqual(self.client.get("/api/subscriptions?limit=0").status_code, 400)
+
+        web_app_enhanced.app_state.update_scrape_results(fake_results() * 3)
+        first = self.client.get("/api/status?limit=2&success=true&fields=url").json
+        self.assertEqual(first["last_scrape_results"], [{"url": "https://www.nike.com/t/a/1"}] * 2)
+        self.assertEqual(first["last_scrape_results_page"]["total"], 3)
+        cursor = first["last_scrape_results_page"]["next_cursor"]
+        rest = self.client.get(f"/api/enhanced/metrics?limit=2&success=true&cursor={cursor}").json["system"]
+        self.assertEqual(len(rest["last_scrape_results"]), 1)
+        self.assertIsNone(rest["last_scrape_results_page"]["next_cursor"])
+
+        # Another worker process holding the same scrape continues the listing
+        other_worker = web_app_enhanced.EnhancedWebAppState()
+        other_worker.update_scrape_results(fake_results() * 3, scrape_id=web_app_enhanced.app_state.scrape_id)
+        rest, _ = other_worker.results_page(limit=2, cursor=cursor, success=True)
+        self.assertEqual(len(rest), 1)
+
+        # A cursor from an earlier scrape is refused rather than skipping or repeating results
+        web_app_enhanced.app_state.update_scrape_results(fake_results())
+        self.assertEqual(self.client.get(f"/api/status?cursor={cursor}").status_code, 400)
+
+    def test_product_images_are_proxied_once(self):
+        import image_cache
+        images = image_cache.ImageCache(os.path.join(self.tmpdir, "images"))
+        response = Mock(headers={"Content-Type": "image/png"})
+        response.iter_content.return_value = [b"\x89PNG fake image"]
+        with patch.object(web_app_enhanced.image_cache, "images", images), \
+                patch("requests.get", return_value=response) as mock_get:
+            url = images.thumbnail_url("https://images.example.com/shoe.png?b=2&a=1")
+            self.assertEqual(url, images.thumbnail_url("https://IMAGES.example.com/shoe.png?a=1&b=2"))
+
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            self.assertIn("max-age=2592000", first.headers["Cache-Control"])
+            self.assertIn("public", first.headers["Cache-Control"])
+            again = self.client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+            self.assertEqual(again.status_code, 304)
+            self.assertEqual(self.client.get(url).data, b"\x89PNG fake image")
+            self.assertEqual(mock_get.call_count, 1)
+
+            # Only registered images are fetched
+            self.assertEqual(self.client.get("/images/" + "0" * 32).status_code, 404)
+            self.assertEqual(mock_get.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -3,12 +3,16 @@ Enhanced web application with new retailer framework and improved UI.
 """
 
 import os
-from flask import Flask, request, jsonify, render_template
+from flask import (Flask, Response, request, jsonify, make_response, render_template, url_for,
+                   stream_with_context, g, send_file)
+from contextlib import ExitStack
 from datetime import datetime
+import hashlib
 import threading
 import time
 import json
 import logging
+import uuid
 
 # Import enhanced modules
 import main_enhanced
@@ -16,115 +20,289 @@ import config_enhanced as config
 from retailers import registry
 import recipients_store
 import subscriptions_store
+import jobs
+import openmetrics
+import image_cache
+import pagination
+from profiling import profiler
+
+# This module is the web entry point: load .env and set up logging here
+config.load_env()
+main_enhanced.setup_logging()
+logger = logging.getLogger(__name__)
 
 # Create Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'dev-key-change-in-production')
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
 # Get environment settings
 CRON_TOKEN = os.environ.get('CRON_TOKEN', '1')
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
 
 class EnhancedWebAppState:
-    """Enhanced application state management."""
+    """Enhanced application state management.
+    
+    Shared by request handlers and background jobs. Writers replace whole
+    values under a lock (never mutate them in place), so readers always see
+    a consistent snapshot without holding the lock while serialising.
+    """
+    
     def __init__(self):
+        self._results_index = None
+        self.scrape_id = None
         self.last_scrape_results = []
         self.is_running = False
         self.last_email_sent = None
         self.scheduler_thread = None
         self.performance_metrics = {}
         self.system_status = "starting"
+        self._lock = threading.Lock()
+    
+    def update_scrape_results(self, results, scrape_id=None):
+        """Update scrape results and metrics.
         
-    def update_scrape_results(self, results):
-        """Update scrape results and metrics."""
-        self.last_scrape_results = results
-        
-        # Update performance metrics
+        Args:
+            results: Results of the scrape
+            scrape_id: Identifies the scrape (its job id); a new id is made up when not given
+        """
         successful = sum(1 for r in results if r['success'])
         failed = len(results) - successful
         
-        self.performance_metrics.update({
-            'last_scrape_time': datetime.now().isoformat(),
-            'total_products': len(results),
-            'successful_scrapes': successful,
-            'failed_scrapes': failed,
-            'success_rate': (successful / len(results) * 100) if results else 0
-        })
+        with self._lock:
+            self.scrape_id = scrape_id or uuid.uuid4().hex
+            self.last_scrape_results = list(results)
+            
+            # Update performance metrics
+            performance_metrics = dict(self.performance_metrics)
+            performance_metrics.update({
+                'last_scrape_time': datetime.now().isoformat(),
+                'total_products': len(results),
+                'successful_scrapes': successful,
+                'failed_scrapes': failed,
+                'success_rate': (successful / len(results) * 100) if results else 0
+            })
+            self.performance_metrics = performance_metrics
     
-    def get_system_info(self):
-        """Get comprehensive system information."""
-        return {
-            'status': self.system_status,
-            'is_running': self.is_running,
-            'last_email_sent': self.last_email_sent,
-            'last_scrape_results': self.last_scrape_results,
-            'performance_metrics': self.performance_metrics,
+    def results_page(self, limit, cursor=None, retailer=None, success=None, fields=None):
+        """Get one page of the last scrape results.
+        
+        Args:
+            limit: Page size
+            cursor: ``next_cursor`` of the previous page
+            retailer: Only this retailer's products
+            success: Only successful (True) or failed (False) scrapes
+            fields: Result fields to include (all when None)
+        
+        Returns:
+            The page's results and a summary with the matching ``total`` and ``next_cursor``
+        
+        Raises:
+            ValueError: The cursor is malformed, or is from an earlier scrape
+        """
+        with self._lock:
+            index = self._results_index
+            if index is None or index.items is not self.last_scrape_results:
+                # Grouped by (retailer, success) once per scrape, so filtered pages needn't scan every result
+                index = self._results_index = pagination.ListIndex(
+                    self.last_scrape_results, lambda r: ((r.get('retailer') or '').lower(), bool(r.get('success'))))
+            # Cursors carry the id of the scrape they page through, which every worker agrees on
+            scrape_id = self.scrape_id or ''
+        
+        after = -1
+        if cursor:
+            cursor_scrape_id, after = pagination.decode_cursor(cursor, (str, int))
+            if cursor_scrape_id != scrape_id:
+                raise ValueError("Results changed since this cursor was issued; start from the first page")
+        retailer = (retailer or '').lower() or None
+        
+        def match(key):
+            return (retailer is None or key[0] == retailer) and (success is None or key[1] == success)
+        
+        positions, more = index.page(limit, after, match)
+        summary = {
+            'total': index.count(match),
+            'next_cursor': pagination.encode_cursor(scrape_id, positions[-1]) if more else None
+        }
+        return pagination.select_fields((index.items[p] for p in positions), fields), summary
+    
+    def version(self):
+        """Identify the state by its values, so every worker process holding the same state agrees on it."""
+        with self._lock:
+            return self.scrape_id, self.system_status, self.is_running, self.last_email_sent
+    
+    def get_system_info(self, results_query=None):
+        """Get comprehensive system information.
+        
+        Args:
+            results_query: ``results_page()`` arguments for the embedded scrape results
+                (defaults to the first page)
+        """
+        results, results_page = self.results_page(**(results_query or {'limit': pagination.parse_limit(None)}))
+        with self._lock:
+            state = {
+                'status': self.system_status,
+                'is_running': self.is_running,
+                'last_email_sent': self.last_email_sent,
+                'last_scrape_results': results,
+                'last_scrape_results_page': results_page,
+                'performance_metrics': self.performance_metrics
+            }
+        state.update({
             'supported_retailers': registry.get_supported_retailers(),
             'cache_stats': registry.get_cache_stats(),
             'config_version': config.get_config()['version'],
             'timestamp': datetime.now().isoformat()
-        }
+        })
+        return state
 
 # Global app state
 app_state = EnhancedWebAppState()
 
 
+def _status_version():
+    """Everything get_system_info() reports, as cheap-to-compare values.
+    
+    Cache hit and miss counters change on every request, so they're left out;
+    revalidated responses may show slightly old counters.
+    """
+    cache_stats = registry.get_cache_stats()
+    return (app_state.version(), cache_stats.get('enabled'), cache_stats.get('default_ttl'),
+            tuple(registry.get_supported_retailers()), config.VERSION)
+
+
+def _revalidated(version, build, private=False):
+    """Answer a GET with ``304 Not Modified`` when the client already has this version.
+    
+    Args:
+        version: Values that change whenever the response body would (store generations,
+            scrape ids, settings), hashed into a weak ETag; they must mean the same
+            thing in every worker process
+        build: Builds the full response; only called when the client's copy is stale
+        private: Keep shared caches from storing the response (per-user data)
+    
+    Clients must revalidate on every use (``no-cache``), so they never show stale
+    data, but unchanged data costs an empty 304 instead of a re-serialised payload.
+    """
+    etag = hashlib.sha1(repr(version).encode("utf-8")).hexdigest()[:20]
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(build())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response
+
+def _results_query():
+    """``results_page()`` arguments from the query string (``limit``, ``cursor``, ``retailer``,
+    ``success``, ``fields``); raises ValueError for invalid values."""
+    return {
+        'limit': pagination.parse_limit(request.args.get('limit')),
+        'cursor': request.args.get('cursor') or None,
+        'retailer': request.args.get('retailer') or None,
+        'success': pagination.parse_bool(request.args.get('success')),
+        'fields': pagination.parse_fields(request.args.get('fields'))
+    }
+
+
+def _bad_request(error):
+    return jsonify({'success': False, 'error': str(error)}), 400
+
+# Background jobs for scraping and email work
+job_manager = jobs.job_manager
+
+
+def _scrape_job(job):
+    """Background job: scrape all products and update the app state."""
+    job.set_total(sum(len(urls) for urls in config.PRODUCT_LINKS.values()))
+    try:
+        with main_enhanced.trace_run("scrape"):
+            results = main_enhanced.scrape_products_enhanced(on_result=job.add_result)
+    except Exception:
+        app_state.system_status = "error"
+        raise
+    
+    app_state.update_scrape_results(results, scrape_id=job.id)
+    app_state.system_status = "healthy"
+    
+    summary = {
+        'total': len(results),
+        'successful': sum(1 for r in results if r['success']),
+        'failed': sum(1 for r in results if not r['success']),
+        'retailers': list(set(r['retailer'] for r in results))
+    }
+    logger.info(f"Enhanced scraping completed: {summary}")
+    return {
+        'success': True,
+        'timestamp': datetime.now().isoformat(),
+        'results': results,
+        'summary': summary,
+        'cache_stats': registry.get_cache_stats(),
+        'performance_metrics': app_state.performance_metrics
+    }
+
+
+def _daily_email_job(job):
+    """Background job: run the daily email pipeline."""
+    main_enhanced.send_daily_email_enhanced(on_result=job.add_result)
+    app_state.last_email_sent = datetime.now().isoformat()
+    return {
+        'message': 'Enhanced daily emails sent successfully',
+        'timestamp': app_state.last_email_sent
+    }
+
+
+def _job_accepted(job, created):
+    """Build the 202 response for a queued (or joined) job."""
+    return jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'coalesced': not created,
+        'status_url': url_for('api_job_status', job_id=job['id']),
+        'timestamp': datetime.now().isoformat()
+    }), 202
+
+
 @app.route('/')
 def enhanced_dashboard():
     """Enhanced dashboard with new features."""
     scheduler_text = "Scheduled via GitHub Actions" if CRON_TOKEN else None
     
-    # Get enhanced system info
-    system_info = app_state.get_system_info()
+    def render():
+        # Get enhanced system info
+        system_info = app_state.get_system_info()
+        
+        return render_template('enhanced_dashboard.html', 
+                             products=app_state.last_scrape_results,
+                             is_running=app_state.is_running,
+                             last_email=app_state.last_email_sent,
+                             config=config,
+                             scheduler_text=scheduler_text,
+                             system_info=system_info,
+                             retailers=registry.get_supported_retailers(),
+                             cache_stats=registry.get_cache_stats())
     
-    return render_template('enhanced_dashboard.html', 
-                         products=app_state.last_scrape_results,
-                         is_running=app_state.is_running,
-                         last_email=app_state.last_email_sent,
-                         config=config,
-                         scheduler_text=scheduler_text,
-                         system_info=system_info,
-                         retailers=registry.get_supported_retailers(),
-                         cache_stats=registry.get_cache_stats())
+    return _revalidated(('dashboard', _status_version(), config.config_fingerprint(), scheduler_text), render)
 
 
 @app.route('/api/enhanced/scrape')
 def api_enhanced_scrape():
-    """Enhanced API endpoint to scrape all products using new framework."""
+    """Queue a scrape of all products; poll /api/jobs/<id> for progress and results."""
     try:
-        logger.info("Starting enhanced scraping via API")
-        
-        # Use the new enhanced scraping
-        results = main_enhanced.scrape_products_enhanced()
-        
-        # Update app state
-        app_state.update_scrape_results(results)
-        app_state.system_status = "healthy"
-        
-        # Return enhanced response
-        response = {
-            'success': True,
-            'timestamp': datetime.now().isoformat(),
-            'results': results,
-            'summary': {
-                'total': len(results),
-                'successful': sum(1 for r in results if r['success']),
-                'failed': sum(1 for r in results if not r['success']),
-                'retailers': list(set(r['retailer'] for r in results))
-            },
-            'cache_stats': registry.get_cache_stats(),
-            'performance_metrics': app_state.performance_metrics
-        }
-        
-        logger.info(f"Enhanced scraping completed: {response['summary']}")
-        return jsonify(response)
+        job, created = job_manager.submit('scrape', _scrape_job)
+        if created:
+            logger.info(f"Queued enhanced scraping job {job['id']}")
+        return _job_accepted(job, created)
         
     except Exception as e:
-        logger.error(f"Enhanced scraping failed: {e}")
-        app_state.system_status = "error"
+        logger.error(f"Failed to queue enhanced scraping: {e}")
         return jsonify({
             'success': False,
             'error': str(e),
@@ -132,18 +310,70 @@ def api_enhanced_scrape():
         }), 500
 
 
+@app.route('/api/enhanced/scrape/stream')
+def api_enhanced_scrape_stream():
+    """Stream scrape results as Server-Sent Events while the shared scrape job runs.
+    
+    Viewers join the in-flight scrape job when there is one, so many dashboards
+    watch a single run. Events: ``job`` (id and status), ``result`` (one per
+    product as it lands) and ``done`` (final job state including the summary).
+    """
+    try:
+        job, created = job_manager.submit('scrape', _scrape_job)
+    except Exception as e:
+        logger.error(f"Failed to queue enhanced scraping: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    
+    def generate():
+        yield sse('job', {'job_id': job['id'], 'status': job['status'], 'coalesced': not created})
+        for event, data in job_manager.follow(job['id']):
+            yield sse(event, data)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """Get status, progress, duration and per-URL results of a background job."""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
 @app.route('/api/enhanced/retailers')
 def api_enhanced_retailers():
-    """Get detailed information about supported retailers."""
+    """Get detailed information about supported retailers.
+    
+    As with the status endpoints, cache hit and miss counters are left out of
+    the ETag, so revalidated responses may show slightly old counters.
+    """
+    cache_stats = registry.get_cache_stats()
+    return _revalidated(('retailers', tuple(registry.get_supported_retailers()), cache_stats.get('enabled'),
+                         cache_stats.get('default_ttl'), config.config_fingerprint()),
+                        _retailers_response)
+
+
+def _retailers_response():
+    """Build the retailer details response."""
     try:
         retailers_info = {}
         
         for retailer_name in registry.get_supported_retailers():
             retailer = registry.get_retailer(retailer_name)
             if retailer:
+                spec = registry.get_spec(retailer_name)
                 retailers_info[retailer_name] = {
                     'metadata': retailer.get_metadata(),
                     'config': config.get_retailer_config(retailer_name),
+                    'hosts': list(spec.hosts) if spec else [],
                     'supported_urls_pattern': f"*{retailer_name}*"
                 }
         
@@ -199,14 +429,91 @@ def api_enhanced_health():
         }), 503
 
 
+@app.before_request
+def _start_metrics_export():
+    """Start this worker's periodic metrics snapshots (once per process)."""
+    main_enhanced.exporter.ensure_started()
+
+
+@app.before_request
+def _start_request_profile():
+    """Profile the request when profiling is enabled (admin endpoints excluded)."""
+    if profiler.enabled and not request.path.startswith('/api/admin/'):
+        stack = ExitStack()
+        stack.enter_context(profiler.profile(f"http-{request.method}-{request.endpoint or 'unknown'}"))
+        g.profile = stack
+
+
+@app.teardown_request
+def _stop_request_profile(exc):
+    stack = g.pop('profile', None)
+    if stack is not None:
+        stack.close()
+
+
+def _admin_authorized():
+    return bool(ADMIN_TOKEN) and request.headers.get('X-ADMIN-TOKEN') == ADMIN_TOKEN
+
+
+@app.route('/api/admin/profiling', methods=['GET', 'POST'])
+def api_admin_profiling():
+    """Get or change profiling settings at runtime, and list the latest profiles.
+    
+    POST body: {"enabled": true, "mode": "sampling"}
+    """
+    if not _admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if 'enabled' in data:
+            config.PERFORMANCE_SETTINGS['enable_profiling'] = bool(data['enabled'])
+        if data.get('mode') in ('deterministic', 'sampling'):
+            config.PERFORMANCE_SETTINGS['profiling_mode'] = data['mode']
+        logger.info(f"Profiling set to enabled={config.PERFORMANCE_SETTINGS['enable_profiling']} "
+                    f"mode={config.PERFORMANCE_SETTINGS.get('profiling_mode')} by {request.remote_addr}")
+    
+    return jsonify({
+        'enabled': profiler.enabled,
+        'mode': config.PERFORMANCE_SETTINGS.get('profiling_mode', 'deterministic'),
+        'profiles': profiler.list_profiles(request.args.get('limit', 20, type=int))
+    })
+
+
+@app.route('/api/admin/profiles/<filename>')
+def api_admin_profile(filename):
+    """Download a profile file (.pstats, .collapsed or .txt summary)."""
+    if not _admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    path = profiler.profile_path(filename)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    mimetype = 'application/octet-stream' if filename.endswith('.pstats') else 'text/plain'
+    return send_file(path, mimetype=mimetype, as_attachment=filename.endswith('.pstats'))
+
+
+@app.route('/metrics')
+def metrics_exposition():
+    """Metrics for all web workers and the scheduler in OpenMetrics text format."""
+    return Response(main_enhanced.exporter.render(), mimetype=None,
+                    headers={'Content-Type': openmetrics.CONTENT_TYPE})
+
+
 @app.route('/api/enhanced/metrics')
 def api_enhanced_metrics():
     """Get performance metrics and statistics."""
     try:
+        try:
+            system_info = app_state.get_system_info(_results_query())
+        except ValueError as e:
+            return _bad_request(e)
         metrics = {
             'performance': app_state.performance_metrics,
             'cache': registry.get_cache_stats(),
-            'system': app_state.get_system_info(),
+            'coalescing': registry.get_coalescing_stats(),
+            'latency': registry.get_latency_stats(),
+            'system': system_info,
             'configuration': {
                 'retailers_count': len(registry.get_supported_retailers()),
                 'total_product_links': sum(len(urls) for urls in config.PRODUCT_LINKS.values()),
@@ -230,6 +537,7 @@ def api_enhanced_cache():
             return jsonify({
                 'success': True,
                 'cache_stats': registry.get_cache_stats(),
+                'image_cache': image_cache.images.get_stats(),
                 'timestamp': datetime.now().isoformat()
             })
         
@@ -278,6 +586,7 @@ def api_test_retailer():
             'name': name,
             'price': price,
             'image': image,
+            'thumbnail': image_cache.images.thumbnail_url(image),
             'scrape_time': round(end_time - start_time, 2),
             'timestamp': datetime.now().isoformat()
         }
@@ -289,6 +598,19 @@ def api_test_retailer():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/images/<key>')
+def product_image(key):
+    """Serve a cached product thumbnail (downloaded from the retailer on first request)."""
+    found = image_cache.images.get(key)
+    if found is None:
+        return jsonify({'error': 'Image not found'}), 404
+    path, content_type, digest = found
+    response = send_file(path, mimetype=content_type, etag=digest, conditional=True,
+                         max_age=config.IMAGE_SETTINGS.get("cache_max_age", 30 * 86400))
+    response.cache_control.public = True
+    return response
+
+
 # Keep the original endpoints for backward compatibility
 @app.route('/api/cron/send', methods=['POST'])
 def api_cron_send():
@@ -299,14 +621,10 @@ def api_cron_send():
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
-        logger.info("Cron-triggered enhanced daily email starting...")
-        main_enhanced.send_daily_email_enhanced()
-        app_state.last_email_sent = datetime.now().isoformat()
-        return jsonify({
-            'success': True,
-            'message': 'Enhanced daily emails sent successfully',
-            'timestamp': app_state.last_email_sent
-        })
+        job, created = job_manager.submit('daily_email', _daily_email_job)
+        if created:
+            logger.info(f"Cron-triggered enhanced daily email queued as job {job['id']}")
+        return _job_accepted(job, created)
     except Exception as e:
         logger.error(f"Cron email send failed: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -320,19 +638,34 @@ def api_scrape():
 
 @app.route('/api/status')
 def api_status():
-    """API endpoint to get application status."""
-    return jsonify(app_state.get_system_info())
+    """API endpoint to get application status.
+    
+    Scrape results are paged: ``limit``, ``cursor`` (the previous page's ``next_cursor``),
+    ``retailer`` and ``success`` filters and ``fields`` (comma-separated) select what is embedded.
+    """
+    try:
+        query = _results_query()
+    except ValueError as e:
+        return _bad_request(e)
+    
+    def build():
+        try:
+            return jsonify(app_state.get_system_info(query))
+        except ValueError as e:
+            return _bad_request(e)
+    
+    return _revalidated(('status', _status_version(), sorted(request.args.items(multi=True))), build)
 
 
 @app.route('/api/config')
 def api_config():
     """API endpoint to get current configuration."""
     try:
-        return jsonify({
+        return _revalidated(('config', config.config_fingerprint()), lambda: jsonify({
             'success': True,
             'config': config.get_config(),
             'timestamp': datetime.now().isoformat()
-        })
+        }))
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -368,18 +701,37 @@ def api_recipients():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/subscriptions', methods=['GET', 'POST', 'DELETE'])
+@app.route('/api/subscriptions', methods=['GET', 'POST', 'PATCH', 'DELETE'])
 def api_subscriptions():
     """Enhanced subscriptions management API."""
     try:
         if request.method == 'GET':
             email = request.args.get('email', '').strip()
-            if email:
-                products = subscriptions_store.get_products(email)
-                return jsonify({'success': True, 'products': products})
-            else:
-                all_subs = subscriptions_store.list_all_subscriptions()
-                return jsonify({'success': True, 'subscriptions': all_subs})
+            try:
+                fields = pagination.parse_fields(request.args.get('fields'))
+                if email:
+                    return _revalidated(('subscriptions', subscriptions_store.generation(), email.lower(), fields),
+                                        lambda: jsonify({'success': True, 'products': pagination.select_fields(
+                                            subscriptions_store.get_products(email), fields)}), private=True)
+                
+                # Everyone's subscriptions a page at a time, ordered by email
+                limit = pagination.parse_limit(request.args.get('limit'))
+                cursor = request.args.get('cursor')
+                after = tuple(pagination.decode_cursor(cursor, (str, int))) if cursor else None
+            except ValueError as e:
+                return _bad_request(e)
+            
+            def build():
+                page, next_after = subscriptions_store.list_subscriptions(
+                    limit, after, company=request.args.get('retailer'), email_prefix=request.args.get('email_prefix'))
+                return jsonify({
+                    'success': True,
+                    'subscriptions': pagination.select_fields(page, fields),
+                    'next_cursor': pagination.encode_cursor(*next_after) if next_after else None
+                })
+            
+            return _revalidated(('subscriptions', subscriptions_store.generation(),
+                                 sorted(request.args.items(multi=True))), build, private=True)
         
         elif request.method == 'POST':
             data = request.get_json()
@@ -395,9 +747,20 @@ def api_subscriptions():
                     'supported_retailers': registry.get_supported_retailers()
                 }), 400
             
-            result = subscriptions_store.add_product(email, url)
+            result = subscriptions_store.add_product(email, url, rules=data.get('rules'))
             return jsonify(result), 200 if result['success'] else 400
         
+        elif request.method == 'PATCH':
+            # Replace a subscription's alert rules (null or {} goes back to the defaults)
+            data = request.get_json()
+            email = data.get('email', '').strip()
+            url = data.get('url', '').strip()
+            
+            result = subscriptions_store.set_rules(email, url, data.get('rules'))
+            if result['success']:
+                return jsonify(result), 200
+            return jsonify(result), 404 if result['error'] == 'Product not found' else 400
+        
         elif request.method == 'DELETE':
             data = request.get_json()
             email = data.get('email', '').strip()
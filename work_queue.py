@@ -0,0 +1,404 @@
+"""
+Leased work units for runs split across worker processes or nodes.
+
+A run (e.g. the daily email for one date) is a sequence of stages, each made
+of independent work units. Any number of workers sharing the SQLite file can
+take part: a worker claims one unit at a time with a lease, and a unit whose
+lease expires (its worker crashed or was killed) is handed to the next worker
+that asks, up to ``max_attempts`` times. Units held by a process on the same
+host that no longer exists are taken over straight away, so a restarted
+worker resumes without waiting for its old leases to run out. Once every unit in a stage has
+finished, the first worker to notice moves the run to its next stage; the
+compare-and-set on the run's stage makes sure that only happens once.
+
+Creating a run is idempotent, so every worker can simply try to create it
+and then work on whatever is left.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import config_enhanced as config
+from jobs import _owner_alive, _owner_id
+
+logger = logging.getLogger(__name__)
+
+WORK_DB = os.path.join(
+    os.path.abspath("."),
+    config.STORAGE_SETTINGS.get("data_directory", "data"),
+    "work.db"
+)
+
+DONE_STAGE = "done"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    meta TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS units (
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    finished_at REAL,
+    not_before REAL,
+    PRIMARY KEY (run_id, stage, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_units_claim ON units (run_id, stage, status);
+CREATE INDEX IF NOT EXISTS idx_runs_created ON runs (created_at);
+"""
+
+
+class RunIncomplete(Exception):
+    """Raised when a run can't finish now: units failed, or retries are deferred for a while."""
+
+
+class LeaseLost(Exception):
+    """Raised when a unit's lease ran out and another worker took the unit over."""
+
+
+@dataclass
+class WorkUnit:
+    """A claimed unit of work."""
+    run_id: str
+    stage: str
+    seq: int
+    payload: Any
+    owner: str
+    attempt: int
+
+
+class LeaseKeeper:
+    """Keeps a claimed unit's lease alive while its worker is still busy with it.
+
+    Call it often (between emails, while waiting for the send budget); it only
+    renews once a third of the lease has passed.
+    """
+
+    def __init__(self, queue: "WorkQueue", unit: WorkUnit):
+        self.queue = queue
+        self.unit = unit
+        self.interval = queue.lease_seconds / 3
+        self._renewed = time.monotonic()
+
+    def __call__(self):
+        """Renew the lease if it's due (raises ``LeaseLost`` if another worker has the unit)."""
+        now = time.monotonic()
+        if now - self._renewed < self.interval:
+            return
+        if not self.queue.renew(self.unit):
+            raise LeaseLost(f"{self.unit.stage} unit {self.unit.seq} of run {self.unit.run_id} "
+                            f"was taken over by another worker")
+        self._renewed = now
+
+
+class WorkQueue:
+    """SQLite-backed runs of leased work units."""
+
+    def __init__(self, db_path: Optional[str] = None, lease_seconds: Optional[float] = None,
+                 max_attempts: Optional[int] = None, retry_backoff: Optional[float] = None):
+        """
+        Args:
+            db_path: Shared SQLite file; defaults to ``data/work.db``
+            lease_seconds: How long a claim lasts before another worker may take the unit over
+            max_attempts: Claims per unit before it is marked failed
+            retry_backoff: Wait before a failed unit's first retry, doubling with each attempt
+        """
+        settings = config.DAILY_RUN_SETTINGS
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds or settings.get("lease_seconds", 300)
+        self.max_attempts = max_attempts or settings.get("max_attempts", 3)
+        self.retry_backoff = settings.get("retry_backoff", 60) if retry_backoff is None else retry_backoff
+        self.owner = _owner_id()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.db_path or WORK_DB
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            if "not_before" not in {row[1] for row in conn.execute("PRAGMA table_info(units)")}:
+                conn.execute("ALTER TABLE units ADD COLUMN not_before REAL")  # Files from before retry backoff
+            self._conn = conn
+        return self._conn
+
+    def _transaction(self, fn):
+        """Run ``fn(conn)`` in a write transaction shared with other processes."""
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _insert_units(conn: sqlite3.Connection, run_id: str, stage: str, payloads: Sequence[Any]):
+        conn.executemany(
+            "INSERT INTO units (run_id, stage, seq, payload) VALUES (?, ?, ?, ?)",
+            [(run_id, stage, seq, json.dumps(payload)) for seq, payload in enumerate(payloads)]
+        )
+
+    def create_run(self, run_id: str, stage: str, payloads: Sequence[Any],
+                   meta: Optional[Dict[str, Any]] = None) -> bool:
+        """Create a run and its first stage's units unless the run already exists.
+
+        Returns:
+            True if this call created the run
+        """
+        def create(conn):
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO runs (id, stage, meta, created_at) VALUES (?, ?, ?, ?)",
+                (run_id, stage, json.dumps(meta or {}), time.time())
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._insert_units(conn, run_id, stage, payloads)
+            retention = config.DAILY_RUN_SETTINGS.get("retention_days", 7) * 86400
+            old = [row[0] for row in conn.execute(
+                "SELECT id FROM runs WHERE created_at < ?", (time.time() - retention,)
+            )]
+            for old_id in old:
+                conn.execute("DELETE FROM units WHERE run_id = ?", (old_id,))
+                conn.execute("DELETE FROM runs WHERE id = ?", (old_id,))
+            return True
+
+        created = self._transaction(create)
+        if created:
+            logger.info(f"Created run {run_id} with {len(payloads)} {stage} units")
+        return created
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Get a run's stage, metadata and unit counts per stage and status."""
+        with self._db_lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT id, stage, meta, created_at, finished_at FROM runs WHERE id = ?", (run_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = conn.execute(
+                "SELECT stage, status, COUNT(*) FROM units WHERE run_id = ? GROUP BY stage, status", (run_id,)
+            ).fetchall()
+        units: Dict[str, Dict[str, int]] = {}
+        for stage, status, count in counts:
+            units.setdefault(stage, {})[status] = count
+        return {
+            'id': row[0],
+            'stage': row[1],
+            'meta': json.loads(row[2]) if row[2] else {},
+            'created_at': row[3],
+            'finished_at': row[4],
+            'units': units
+        }
+
+    def last_finished_run(self, prefix: str) -> Optional[Dict[str, Any]]:
+        """Get the most recently created finished run whose id starts with ``prefix``."""
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT id FROM runs WHERE id LIKE ? AND stage = ? ORDER BY created_at DESC LIMIT 1",
+                (prefix + "%", DONE_STAGE)
+            ).fetchone()
+        return self.get_run(row[0]) if row else None
+
+    def claim(self, run_id: str, stage: str) -> Optional[WorkUnit]:
+        """Lease the next available unit of a stage.
+
+        Units whose lease expired, or whose worker on this host has exited,
+        are taken over; those that have used up their attempts are marked
+        failed instead.
+
+        Returns:
+            The claimed unit, or None if every unit is finished or leased
+        """
+        def claim(conn):
+            now = time.time()
+            conn.execute(
+                "UPDATE units SET status = 'failed', error = 'Lease expired too many times', finished_at = ? "
+                "WHERE run_id = ? AND stage = ? AND status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, run_id, stage, now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT seq, payload, attempts FROM units WHERE run_id = ? AND stage = ? "
+                "AND ((status = 'pending' AND (not_before IS NULL OR not_before <= ?)) "
+                "OR (status = 'leased' AND lease_expires < ?)) ORDER BY seq LIMIT 1",
+                (run_id, stage, now, now)
+            ).fetchone()
+            if row is None:
+                # A resumed worker needn't wait out the lease of a process on this host that has exited
+                leased = conn.execute(
+                    "SELECT seq, payload, attempts, owner FROM units WHERE run_id = ? AND stage = ? "
+                    "AND status = 'leased' ORDER BY seq", (run_id, stage)
+                ).fetchall()
+                row = next((unit[:3] for unit in leased
+                            if unit[2] < self.max_attempts and not _owner_alive(unit[3])), None)
+            if row is None:
+                return None
+            seq, payload, attempts = row
+            conn.execute(
+                "UPDATE units SET status = 'leased', owner = ?, lease_expires = ?, attempts = ?, not_before = NULL "
+                "WHERE run_id = ? AND stage = ? AND seq = ?",
+                (self.owner, now + self.lease_seconds, attempts + 1, run_id, stage, seq)
+            )
+            if attempts:
+                logger.warning(f"Took over {stage} unit {seq} of run {run_id} (attempt {attempts + 1})")
+            return WorkUnit(run_id, stage, seq, json.loads(payload), self.owner, attempts + 1)
+
+        return self._transaction(claim)
+
+    def _finish(self, unit: WorkUnit, status: str, result: Any = None, error: Optional[str] = None,
+                not_before: Optional[float] = None, attempts: Optional[int] = None) -> bool:
+        def finish(conn):
+            cursor = conn.execute(
+                "UPDATE units SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires = NULL, "
+                "not_before = ?, attempts = ? "
+                "WHERE run_id = ? AND stage = ? AND seq = ? AND owner = ? AND attempts = ? AND status = 'leased'",
+                (status, json.dumps(result, default=str), error, time.time(), not_before,
+                 unit.attempt if attempts is None else attempts,
+                 unit.run_id, unit.stage, unit.seq, unit.owner, unit.attempt)
+            )
+            return cursor.rowcount == 1
+
+        finished = self._transaction(finish)
+        if not finished:
+            logger.warning(f"Lost the lease on {unit.stage} unit {unit.seq} of run {unit.run_id}")
+        return finished
+
+    def complete(self, unit: WorkUnit, result: Any = None) -> bool:
+        """Store a unit's result.
+
+        Returns:
+            False if the lease had expired and the unit was taken over
+        """
+        return self._finish(unit, "done", result=result)
+
+    def fail(self, unit: WorkUnit, error: str) -> bool:
+        """Give a unit back for another attempt after a backoff, or mark it failed once out of attempts."""
+        if unit.attempt >= self.max_attempts:
+            return self._finish(unit, "failed", error=error)
+        backoff = self.retry_backoff * 2 ** (unit.attempt - 1)
+        return self._finish(unit, "pending", error=error, not_before=time.time() + backoff)
+
+    def defer(self, unit: WorkUnit, retry_after: float, reason: str) -> bool:
+        """Give a unit back untried, to be claimed again after ``retry_after`` seconds.
+
+        For waits that aren't the unit's fault (e.g. the daily send cap), so they
+        don't use up its attempts.
+        """
+        return self._finish(unit, "pending", error=reason, not_before=time.time() + retry_after,
+                            attempts=unit.attempt - 1)
+
+    def renew(self, unit: WorkUnit) -> bool:
+        """Extend a unit's lease while long work is still in progress."""
+        def renew(conn):
+            return conn.execute(
+                "UPDATE units SET lease_expires = ? WHERE run_id = ? AND stage = ? AND seq = ? "
+                "AND owner = ? AND attempts = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, unit.run_id, unit.stage, unit.seq, unit.owner, unit.attempt)
+            ).rowcount == 1
+
+        return self._transaction(renew)
+
+    def keep_alive(self, unit: WorkUnit) -> LeaseKeeper:
+        """Get a callable that renews a unit's lease during long work."""
+        return LeaseKeeper(self, unit)
+
+    def stage_finished(self, run_id: str, stage: str) -> bool:
+        """Check whether every unit of a stage is done or failed."""
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT COUNT(*) FROM units WHERE run_id = ? AND stage = ? AND status IN ('pending', 'leased')",
+                (run_id, stage)
+            ).fetchone()
+        return row[0] == 0
+
+    def failed_units(self, run_id: str, stage: str) -> int:
+        """Count a stage's units that ran out of attempts."""
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT COUNT(*) FROM units WHERE run_id = ? AND stage = ? AND status = 'failed'", (run_id, stage)
+            ).fetchone()
+        return row[0]
+
+    def next_retry(self, run_id: str, stage: str) -> Optional[float]:
+        """Get when the earliest backed-off unit of a stage may be claimed (None if none are waiting)."""
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT MIN(not_before) FROM units WHERE run_id = ? AND stage = ? AND status = 'pending' "
+                "AND not_before > ?", (run_id, stage, time.time())
+            ).fetchone()
+        return row[0]
+
+    def retry_failed(self, run_id: str) -> int:
+        """Give the failed units of a run's current stage a fresh set of attempts.
+
+        Returns:
+            Number of units reset
+        """
+        def reset(conn):
+            return conn.execute(
+                "UPDATE units SET status = 'pending', attempts = 0, not_before = NULL, finished_at = NULL "
+                "WHERE run_id = ? AND status = 'failed' AND stage = (SELECT stage FROM runs WHERE id = ?)",
+                (run_id, run_id)
+            ).rowcount
+
+        reset_count = self._transaction(reset)
+        if reset_count:
+            logger.info(f"Retrying {reset_count} failed units of run {run_id}")
+        return reset_count
+
+    def advance(self, run_id: str, from_stage: str, to_stage: str, payloads: Sequence[Any] = ()) -> bool:
+        """Move a finished stage on to the next one and create its units.
+
+        Returns:
+            True if this call advanced the run (False if another worker did)
+        """
+        def advance(conn):
+            cursor = conn.execute(
+                "UPDATE runs SET stage = ?, finished_at = ? WHERE id = ? AND stage = ?",
+                (to_stage, time.time() if to_stage == DONE_STAGE else None, run_id, from_stage)
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._insert_units(conn, run_id, to_stage, payloads)
+            return True
+
+        advanced = self._transaction(advance)
+        if advanced:
+            logger.info(f"Run {run_id} moved from {from_stage} to {to_stage} ({len(payloads)} units)")
+        return advanced
+
+    def results(self, run_id: str, stage: str) -> List[Any]:
+        """Get the results of a stage's finished units in unit order."""
+        with self._db_lock:
+            rows = self._connection().execute(
+                "SELECT result FROM units WHERE run_id = ? AND stage = ? AND status = 'done' ORDER BY seq",
+                (run_id, stage)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows if row[0] is not None]
+
+
+# Global work queue (connects on first use)
+work_queue = WorkQueue()